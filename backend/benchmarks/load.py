@@ -0,0 +1,236 @@
+"""
+Offline load benchmark: serves the real app with uvicorn (in this process,
+so it can be pointed at the fakes in fakes/ with injected latency) and
+reports throughput and p50/p95/p99 latency per endpoint as gallery size and
+concurrency grow.
+
+    python benchmarks/load.py --sizes 100,1000 --concurrency 1,8,32 --requests 200
+    python benchmarks/load.py --output baseline.json
+    python benchmarks/load.py --baseline baseline.json   # after a change
+
+Latencies are per simulated RPC (milliseconds); GCS also charges transfer
+time at --gcs-mbps.
+"""
+import os
+import io
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import datetime
+import threading
+import contextlib
+from unittest.mock import patch
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import httpx
+import uvicorn
+from PIL import Image
+from fakes import install_fakes, Latency, VOCABULARY
+
+USER_ID = "bench-user"
+HEADERS = {"Authorization": f"Bearer {USER_ID}"}
+ENDPOINTS = ("upload", "images", "search", "image")
+
+
+def make_jpeg(seed: int, size=(640, 480)) -> bytes:
+    # Noise, so every upload has distinct bytes and dedup doesn't short-circuit it
+    rng = random.Random(seed)
+    image = Image.frombytes("RGB", (64, 48), bytes(rng.getrandbits(8) for _ in range(64 * 48 * 3))).resize(size)
+    out = io.BytesIO()
+    image.save(out, format="JPEG", quality=85)
+    return out.getvalue()
+
+
+def seed_gallery(fakes, size: int) -> list:
+    """Store `size` tagged images for USER_ID (docs, blobs and tag index). Returns their filenames."""
+    from services.gcs import FIRESTORE_COLLECTION
+    from services.tag_index import index_images, set_index_ready
+
+    content = make_jpeg(0)
+    start = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=1)
+    filenames, tags_by_id = [], {}
+    with fakes.bucket.latency.paused(), fakes.db.latency.paused():
+        for i in range(size):
+            image_id = f"seed{i:07d}"
+            blob_name = f"images/{image_id}.jpg"
+            tags = fakes.vision.tags_for(image_id)
+            fakes.bucket.put(blob_name, content)
+            fakes.db.put(f"{FIRESTORE_COLLECTION}/{image_id}", {
+                "id": image_id,
+                "filename": f"{image_id}.jpg",
+                "blob_name": blob_name,
+                "tags": tags,
+                "tag_status": "done",
+                "created_at": start + datetime.timedelta(seconds=i),
+                "uploaded_by": f"{USER_ID}@example.com",
+                "user_id": USER_ID,
+            })
+            filenames.append(f"{image_id}.jpg")
+            tags_by_id[image_id] = tags
+        index_images(USER_ID, tags_by_id)
+        set_index_ready(USER_ID, True)
+    return filenames
+
+
+def percentile(samples: list, pct: float) -> float:
+    """Nearest-rank percentile of sorted samples."""
+    if not samples:
+        return 0.0
+    rank = max(1, min(len(samples), round(pct / 100 * len(samples) + 0.5)))
+    return samples[rank - 1]
+
+
+def start_server():
+    """Run the app with uvicorn on a background thread. Returns (server, base_url)."""
+    from main import app
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    # No lifespan: background workers aren't part of what's measured
+    config = uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", lifespan="off")
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server, f"http://127.0.0.1:{port}"
+
+
+async def run_endpoint(client, endpoint: str, filenames: list, requests: int, concurrency: int) -> dict:
+    counter = iter(range(requests))
+    latencies, errors = [], 0
+    # Built up front so encoding doesn't compete with the server for the CPU
+    uploads = [make_jpeg(1_000_000 + i) for i in range(requests)] if endpoint == "upload" else None
+
+    async def one(i: int):
+        if endpoint == "upload":
+            files = {"file": (f"bench{i}.jpg", uploads[i], "image/jpeg")}
+            return await client.post("/upload", files=files, headers=HEADERS)
+        if endpoint == "images":
+            return await client.get("/images", params={"limit": 20}, headers=HEADERS)
+        if endpoint == "search":
+            return await client.get("/search", params={"tag": random.choice(VOCABULARY)[:4]}, headers=HEADERS)
+        return await client.get(f"/images/{random.choice(filenames)}")
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            started = time.perf_counter()
+            response = await one(i)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "throughput_rps": requests / wall,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+async def run_case(args, base_url: str, size: int, concurrency: int) -> list:
+    from services import limits
+
+    results = []
+    for endpoint in args.endpoints:
+        with install_fakes(
+            storage_latency=Latency(args.gcs_ms / 1000, args.jitter_ms / 1000, args.gcs_mbps * 1024 * 1024),
+            firestore_latency=Latency(args.firestore_ms / 1000, args.jitter_ms / 1000),
+            vision_latency=Latency(args.vision_ms / 1000, args.jitter_ms / 1000),
+        ) as fakes:
+            filenames = seed_gallery(fakes, size)
+            pool = httpx.Limits(max_connections=concurrency)
+            async with httpx.AsyncClient(base_url=base_url, timeout=None, limits=pool) as client:
+                # The upload quota would otherwise end the run after 25 uploads
+                with quiet(args.verbose), patch.object(limits, "DAILY_LIMIT_USER", 10 ** 9):
+                    stats = await run_endpoint(client, endpoint, filenames, args.requests, concurrency)
+            stats.update(endpoint=endpoint, gallery_size=size, concurrency=concurrency,
+                         firestore_reads=fakes.db.reads, vision_calls=fakes.vision.calls)
+        results.append(stats)
+        print(format_row(stats), flush=True)
+    return results
+
+
+@contextlib.contextmanager
+def quiet(verbose: bool):
+    """Silence the app's per-request prints unless --verbose."""
+    if verbose:
+        yield
+        return
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def case_key(row: dict) -> str:
+    return f"{row['endpoint']}/{row['gallery_size']}/{row['concurrency']}"
+
+
+def format_row(row: dict, baseline: dict = None) -> str:
+    line = (f"{row['endpoint']:>7} size={row['gallery_size']:<7} c={row['concurrency']:<4} "
+            f"{row['throughput_rps']:8.1f} req/s  p50 {row['p50_ms']:8.1f}  p95 {row['p95_ms']:8.1f}  "
+            f"p99 {row['p99_ms']:8.1f} ms  errors {row['errors']}")
+    if baseline:
+        def delta(key):
+            return (row[key] - baseline[key]) / baseline[key] * 100 if baseline[key] else 0.0
+        line += f"  | vs baseline: req/s {delta('throughput_rps'):+.0f}%  p50 {delta('p50_ms'):+.0f}%  p95 {delta('p95_ms'):+.0f}%"
+    return line
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="100,1000", help="gallery sizes (comma separated)")
+    parser.add_argument("--concurrency", default="1,8,32", help="concurrent clients (comma separated)")
+    parser.add_argument("--requests", type=int, default=200, help="requests per case")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS))
+    parser.add_argument("--firestore-ms", type=float, default=8)
+    parser.add_argument("--gcs-ms", type=float, default=20)
+    parser.add_argument("--gcs-mbps", type=float, default=100, help="simulated GCS transfer rate, MiB/s")
+    parser.add_argument("--vision-ms", type=float, default=1500)
+    parser.add_argument("--jitter-ms", type=float, default=2)
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--baseline", help="JSON from an earlier --output run to compare against")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true", help="show the app's log output")
+    args = parser.parse_args()
+    args.endpoints = [e for e in args.endpoints.split(",") if e]
+    unknown = set(args.endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(sorted(unknown))}")
+    random.seed(args.seed)
+
+    server, base_url = start_server()
+    results = []
+    try:
+        for size in [int(s) for s in args.sizes.split(",")]:
+            for concurrency in [int(c) for c in args.concurrency.split(",")]:
+                results.extend(asyncio.run(run_case(args, base_url, size, concurrency)))
+    finally:
+        server.should_exit = True
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = {case_key(row): row for row in json.load(f)["results"]}
+        print("\nCompared with", args.baseline)
+        for row in results:
+            print(format_row(row, baseline.get(case_key(row))))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
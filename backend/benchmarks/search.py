@@ -0,0 +1,64 @@
+"""
+Search benchmark: builds an in-memory tag matrix for a synthetic gallery and
+reports the latency of ranked queries against it (substring, multi-word,
+typo and short-prefix queries).
+
+    python benchmarks/search.py --images 10000 --runs 20
+    python benchmarks/search.py --budget-ms 50
+
+Exits non-zero if any query's median exceeds --budget-ms, so it can gate CI.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from services.tag_search import TagMatrix
+
+QUERIES = ("dog", "blue lake", "mountian", "re")
+
+
+def build_matrix(images: int, tags_per_image: int, seed: int = 0) -> TagMatrix:
+    rng = random.Random(seed)
+    vocabulary = [f"{rng.choice(['red', 'blue', 'wild', 'old'])}{word}" for word in
+                  ("cat", "dog", "tree", "lake", "car", "house", "beach", "mountain", "city", "flower")] * 20
+    vocabulary = [f"{w}{i}" for i, w in enumerate(vocabulary)]
+    return TagMatrix.from_images({f"img{i:07d}": rng.sample(vocabulary, tags_per_image) for i in range(images)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=10000, help="gallery size")
+    parser.add_argument("--tags", type=int, default=8, help="tags per image")
+    parser.add_argument("--runs", type=int, default=20, help="timed runs per query")
+    parser.add_argument("--limit", type=int, default=50, help="results per query")
+    parser.add_argument("--budget-ms", type=float, default=None, help="fail if a query's median exceeds this")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    matrix = build_matrix(args.images, args.tags)
+    print(f"Built matrix for {args.images} images in {(time.perf_counter() - started) * 1000:.1f} ms")
+    matrix.search(QUERIES[0], args.limit)  # warm-up
+
+    over_budget = False
+    for query in QUERIES:
+        timings = []
+        for _ in range(args.runs):
+            started = time.perf_counter()
+            matrix.search(query, args.limit)
+            timings.append((time.perf_counter() - started) * 1000)
+        median = statistics.median(timings)
+        print(f"{query!r:14} median {median:7.2f} ms   max {max(timings):7.2f} ms")
+        if args.budget_ms is not None and median > args.budget_ms:
+            over_budget = True
+    if over_budget:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Cold-start benchmark: time from launching the server process to its first
+successful response, the part of a Cloud Run cold start we control.
+
+    python benchmarks/startup.py --runs 5 --budget-ms 3000
+
+Exits non-zero if the median exceeds --budget-ms, so it can gate CI.
+"""
+import os
+import sys
+import time
+import socket
+import argparse
+import statistics
+import subprocess
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def time_to_first_response(timeout: float) -> float:
+    port = free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=BACKEND_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            if server.poll() is not None:
+                raise RuntimeError(f"Server exited with code {server.returncode}")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except OSError:
+                time.sleep(0.01)
+        raise RuntimeError(f"No response within {timeout}s")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--budget-ms", type=float, default=None, help="fail if the median is slower")
+    args = parser.parse_args()
+
+    samples = []
+    for i in range(args.runs):
+        elapsed = time_to_first_response(args.timeout) * 1000
+        samples.append(elapsed)
+        print(f"run {i + 1}: {elapsed:.0f} ms")
+
+    median = statistics.median(samples)
+    print(f"min {min(samples):.0f} ms, median {median:.0f} ms, max {max(samples):.0f} ms")
+    if args.budget_ms is not None and median > args.budget_ms:
+        print(f"Over budget: median {median:.0f} ms > {args.budget_ms:.0f} ms")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+In-memory stand-ins for GCS, Firestore, the vision model and Firebase Auth,
+for tests and the offline benchmarks. Each fake takes a Latency so a run can
+simulate network round trips without touching the cloud:
+
+    with install_fakes(firestore_latency=Latency(0.005)) as fakes:
+        fakes.db.put("images/abc", {...})
+        client.get("/images", headers={"Authorization": "Bearer user-1"})
+
+Under install_fakes the bearer token is the user id.
+"""
+import time
+from contextlib import ExitStack, contextmanager
+from types import SimpleNamespace
+from unittest.mock import patch
+from fakes.latency import Latency
+from fakes.storage import FakeBucket, FakeBlob, FakeStorageClient
+from fakes.firestore import FakeFirestore
+from fakes.vision import FakeVisionModel, VOCABULARY
+from services.circuit_breaker import CircuitBreaker
+
+
+def fake_verify_id_token(token: str) -> dict:
+    if not token or token.startswith("invalid"):
+        raise ValueError("Invalid token")
+    return {"uid": token, "email": f"{token}@example.com", "exp": time.time() + 3600}
+
+
+def clear_caches():
+    """Reset every in-process cache so state from one run can't leak into the next."""
+    from services.image_cache import image_cache
+    from services.dedup import digest_cache
+    from services.listing_cache import listing_cache
+    from services.token_cache import token_cache
+    from services.tag_search import tag_matrices
+    from services.similarity import similarity_indexes
+    from services.signed_urls import signed_urls
+    from services.stats import global_stats, stats_recorder
+    for cache in (image_cache, digest_cache, listing_cache, token_cache, tag_matrices, similarity_indexes, signed_urls, global_stats, stats_recorder):
+        cache.clear()
+
+
+@contextmanager
+def install_fakes(storage_latency: Latency = None, firestore_latency: Latency = None,
+                  vision_latency: Latency = None, vision_error_rate: float = 0.0):
+    """Point the app's client singletons at fresh fakes for the duration of the block."""
+    from services import gcs, analyze, limits
+    from services.token_cache import token_cache
+    from routers import images
+
+    bucket = FakeBucket(latency=storage_latency)
+    db = FakeFirestore(latency=firestore_latency)
+    vision = FakeVisionModel(latency=vision_latency, error_rate=vision_error_rate)
+
+    with ExitStack() as stack:
+        stack.enter_context(patch.dict(gcs._clients, {"storage": FakeStorageClient(bucket), "firestore": db}, clear=True))
+        stack.enter_context(patch.object(gcs, "GCS_BUCKET_NAME", bucket.name))
+        stack.enter_context(patch.object(images, "GCS_BUCKET_NAME", bucket.name))
+        stack.enter_context(patch.object(analyze, "OPENAI_API_KEY", "fake"))
+        stack.enter_context(patch.object(analyze, "_openai_client", vision))
+        stack.enter_context(patch.object(analyze, "vision_breaker", CircuitBreaker("vision", analyze.VISION_BREAKER_FAILURES, analyze.VISION_BREAKER_RESET_SECONDS)))
+        stack.enter_context(patch.object(token_cache, "verify", fake_verify_id_token))
+        stack.enter_context(patch.object(limits, "_leases", limits.QuotaLeases()))
+        stack.enter_context(patch.object(limits, "_exhausted", limits.ExhaustedCache()))
+        clear_caches()
+        stack.callback(clear_caches)
+        yield SimpleNamespace(bucket=bucket, db=db, vision=vision)
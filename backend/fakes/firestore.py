@@ -0,0 +1,383 @@
+
+import copy
+import time
+import uuid
+import datetime
+import threading
+from google.api_core.exceptions import NotFound, AlreadyExists
+from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+from google.cloud.firestore_v1 import transforms
+from fakes.latency import Latency
+
+MAX_BATCH_WRITES = 500
+
+
+class FakeSnapshot:
+    def __init__(self, reference: "FakeDocument", data: dict):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path: str):
+        value = self._data
+        for part in field_path.split("."):
+            value = (value or {}).get(part)
+        return copy.deepcopy(value)
+
+
+def _project(data: dict, field_paths) -> dict:
+    if data is None or field_paths is None:
+        return data
+    return {field: data[field] for field in field_paths if field in data}
+
+
+def _set_path(data: dict, path: str, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        data = data.setdefault(part, {})
+    if value is transforms.DELETE_FIELD:
+        data.pop(parts[-1], None)
+    else:
+        data[parts[-1]] = value
+
+
+def _get_path(data: dict, path: str):
+    for part in path.split("."):
+        if not isinstance(data, dict):
+            return None
+        data = data.get(part)
+    return data
+
+
+class FakeDocument:
+    def __init__(self, db: "FakeFirestore", path: str):
+        self._db = db
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def collection(self, name: str) -> "FakeCollection":
+        return FakeCollection(self._db, f"{self.path}/{name}")
+
+    def get(self, field_paths=None, transaction=None) -> FakeSnapshot:
+        if transaction is None:
+            self._db.latency.wait()
+        return FakeSnapshot(self, _project(self._db._read(self.path), field_paths))
+
+    def set(self, data: dict, merge: bool = False):
+        self._db.latency.wait()
+        self._db._apply([("set", self, data, merge)])
+
+    def create(self, data: dict):
+        self._db.latency.wait()
+        self._db._apply([("create", self, data, False)])
+
+    def update(self, data: dict):
+        self._db.latency.wait()
+        self._db._apply([("update", self, data, False)])
+
+    def delete(self):
+        self._db.latency.wait()
+        self._db._apply([("delete", self, None, False)])
+
+
+class FakeQuery:
+    def __init__(self, db, path, filters=(), orders=(), limit=None, fields=None, start_after=None):
+        self._db = db
+        self._path = path
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._fields = fields
+        self._start_after = start_after
+
+    def _copy(self, **changes):
+        state = dict(filters=self._filters, orders=self._orders, limit=self._limit,
+                     fields=self._fields, start_after=self._start_after)
+        state.update(changes)
+        return FakeQuery(self._db, self._path, **state)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path: str, direction: str = "ASCENDING"):
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count: int):
+        return self._copy(limit=count)
+
+    def select(self, field_paths):
+        return self._copy(fields=list(field_paths))
+
+    def start_after(self, document_fields):
+        if isinstance(document_fields, FakeSnapshot):
+            snapshot = document_fields
+            document_fields = {field: (snapshot.id if field == "__name__" else snapshot.get(field)) for field, _ in self._orders}
+        return self._copy(start_after=dict(document_fields))
+
+    def _value(self, doc_id, data, field):
+        return doc_id if field == "__name__" else _get_path(data, field)
+
+    def _matches(self, doc_id, data) -> bool:
+        for field, op, expected in self._filters:
+            value = self._value(doc_id, data, field)
+            if op == "==" and value != expected:
+                return False
+            if op == "in" and value not in expected:
+                return False
+            if op == "array_contains" and expected not in (value or []):
+                return False
+            if op in ("<", "<=", ">", ">="):
+                if value is None:
+                    return False
+                if not {"<": value < expected, "<=": value <= expected, ">": value > expected, ">=": value >= expected}[op]:
+                    return False
+        # Firestore leaves out docs that lack an ordered field
+        return all(field == "__name__" or _get_path(data, field) is not None for field, _ in self._orders)
+
+    def _after_cursor(self, doc_id, data) -> bool:
+        for field, direction in self._orders:
+            if field not in self._start_after:
+                break
+            cursor = self._start_after[field]
+            value = self._value(doc_id, data, field)
+            if field == "__name__" and not isinstance(cursor, str):
+                cursor = cursor.id
+            if value == cursor:
+                continue
+            return value < cursor if direction == "DESCENDING" else value > cursor
+        return False
+
+    def stream(self, transaction=None):
+        if transaction is None:
+            self._db.latency.wait()
+        docs = self._db._children(self._path, self._matches)
+        # Stable multi-key sort: apply the last order first
+        docs.sort(key=lambda item: item[0])
+        for field, direction in reversed(self._orders):
+            docs.sort(key=lambda item: self._value(item[0], item[1], field), reverse=direction == "DESCENDING")
+        if self._start_after is not None:
+            docs = [(doc_id, data) for doc_id, data in docs if self._after_cursor(doc_id, data)]
+        if self._limit is not None:
+            docs = docs[:self._limit]
+        # Like Firestore, reads are billed per document returned
+        self._db._count_reads(len(docs))
+        for doc_id, data in docs:
+            yield FakeSnapshot(FakeDocument(self._db, f"{self._path}/{doc_id}"), copy.deepcopy(_project(data, self._fields)))
+
+    def get(self, transaction=None):
+        return list(self.stream(transaction=transaction))
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, db, path):
+        super().__init__(db, path)
+        self.id = path.rsplit("/", 1)[-1]
+
+    def document(self, document_id: str = None) -> FakeDocument:
+        return FakeDocument(self._db, f"{self._path}/{document_id or uuid.uuid4().hex}")
+
+    def add(self, data: dict):
+        ref = self.document()
+        ref.set(data)
+        return None, ref
+
+
+class FakeWriteBatch:
+    def __init__(self, db):
+        self._db = db
+        self._writes = []
+
+    def set(self, reference, data, merge=False):
+        self._writes.append(("set", reference, data, merge))
+
+    def create(self, reference, data):
+        self._writes.append(("create", reference, data, False))
+
+    def update(self, reference, data):
+        self._writes.append(("update", reference, data, False))
+
+    def delete(self, reference):
+        self._writes.append(("delete", reference, None, False))
+
+    def commit(self):
+        if len(self._writes) > MAX_BATCH_WRITES:
+            raise ValueError(f"A batch can contain at most {MAX_BATCH_WRITES} writes")
+        self._db.latency.wait()
+        self._db._apply(self._writes)
+        self._writes = []
+
+
+class FakeTransaction(FakeWriteBatch):
+    """
+    Serializable by construction: the whole database is locked from begin to
+    commit. Implements the hooks google.cloud.firestore.transactional calls.
+    """
+
+    def __init__(self, db, max_attempts=5, read_only=False):
+        super().__init__(db)
+        self._max_attempts = max_attempts
+        self._read_only = read_only
+        self._id = None
+
+    def _clean_up(self):
+        self._writes = []
+        self._id = None
+
+    def _begin(self, retry_id=None):
+        self._db.latency.wait()
+        self._db._transaction_lock.acquire()
+        self._id = uuid.uuid4().bytes
+
+    def _commit(self):
+        try:
+            self._db._apply(self._writes)
+        finally:
+            self._clean_up()
+            self._db._transaction_lock.release()
+
+    def _rollback(self):
+        if self._id is not None:
+            self._clean_up()
+            self._db._transaction_lock.release()
+
+    def get(self, ref_or_query):
+        if isinstance(ref_or_query, FakeDocument):
+            return iter([ref_or_query.get(transaction=self)])
+        return ref_or_query.stream(transaction=self)
+
+    def commit(self):
+        raise RuntimeError("Use google.cloud.firestore.transactional")
+
+
+class FakeFirestore:
+    """
+    In-memory Firestore client: documents, subcollections, queries, get_all,
+    batches, transactions and the transforms this app uses. Every call that
+    would be an RPC waits on `latency`; `reads`/`writes` count documents.
+    """
+
+    def __init__(self, latency: Latency = None):
+        self.latency = latency or Latency()
+        self._docs = {}  # "col/doc[/col/doc...]" -> dict
+        self._lock = threading.RLock()
+        self._transaction_lock = threading.RLock()
+        self._last_timestamp = 0.0
+        self.reads = 0
+        self.writes = 0
+
+    def collection(self, name: str) -> FakeCollection:
+        return FakeCollection(self, name)
+
+    def document(self, path: str) -> FakeDocument:
+        return FakeDocument(self, path)
+
+    def batch(self) -> FakeWriteBatch:
+        return FakeWriteBatch(self)
+
+    def transaction(self, max_attempts=5, read_only=False) -> FakeTransaction:
+        return FakeTransaction(self, max_attempts=max_attempts, read_only=read_only)
+
+    def get_all(self, references, field_paths=None, transaction=None):
+        references = list(references)
+        if transaction is None:
+            self.latency.wait()
+        for ref in references:
+            yield FakeSnapshot(ref, _project(self._read(ref.path), field_paths))
+
+    # Storage
+
+    def _read(self, path: str):
+        with self._lock:
+            self.reads += 1
+            data = self._docs.get(path)
+            return copy.deepcopy(data) if data is not None else None
+
+    def _children(self, collection_path: str, matches) -> list:
+        """(id, data) of matching docs in a collection. data is shared: callers copy what they return."""
+        depth = collection_path.count("/") + 1
+        prefix = collection_path + "/"
+        with self._lock:
+            return [
+                (path.rsplit("/", 1)[1], data)
+                for path, data in self._docs.items()
+                if path.startswith(prefix) and path.count("/") == depth and matches(path.rsplit("/", 1)[1], data)
+            ]
+
+    def _count_reads(self, count: int):
+        with self._lock:
+            self.reads += count
+
+    def _timestamp(self):
+        # Strictly increasing, like distinct server commit times
+        now = max(time.time(), self._last_timestamp + 1e-6)
+        self._last_timestamp = now
+        return DatetimeWithNanoseconds.fromtimestamp(now, tz=datetime.timezone.utc)
+
+    def _resolve(self, old, value):
+        if value is transforms.SERVER_TIMESTAMP:
+            return self._timestamp()
+        if isinstance(value, datetime.datetime) and not isinstance(value, DatetimeWithNanoseconds):
+            # Firestore hands timestamps back as DatetimeWithNanoseconds
+            return DatetimeWithNanoseconds.fromtimestamp(value.timestamp(), tz=datetime.timezone.utc)
+        if isinstance(value, transforms.Increment):
+            return (old or 0) + value.value
+        if isinstance(value, transforms.ArrayUnion):
+            current = list(old or [])
+            return current + [v for v in value.values if v not in current]
+        if isinstance(value, transforms.ArrayRemove):
+            return [v for v in (old or []) if v not in value.values]
+        if isinstance(value, dict):
+            return {k: self._resolve((old or {}).get(k) if isinstance(old, dict) else None, v) for k, v in value.items()}
+        return copy.deepcopy(value)
+
+    def _merge(self, target: dict, data: dict):
+        for key, value in data.items():
+            if value is transforms.DELETE_FIELD:
+                target.pop(key, None)
+            elif isinstance(value, dict) and isinstance(target.get(key), dict):
+                self._merge(target[key], value)
+            else:
+                target[key] = self._resolve(target.get(key), value)
+
+    def _apply(self, writes):
+        """Apply writes atomically: all of them or (on a failed precondition) none."""
+        with self._lock:
+            staged = {}
+            for op, ref, data, merge in writes:
+                current = staged[ref.path] if ref.path in staged else self._docs.get(ref.path)
+                if op == "delete":
+                    staged[ref.path] = None
+                elif op == "create":
+                    if current is not None:
+                        raise AlreadyExists(f"Document already exists: {ref.path}")
+                    staged[ref.path] = self._resolve(None, data)
+                elif op == "set":
+                    if merge and current is not None:
+                        merged = copy.deepcopy(current)
+                        self._merge(merged, data)
+                        staged[ref.path] = merged
+                    else:
+                        staged[ref.path] = {k: self._resolve(None, v) for k, v in data.items() if v is not transforms.DELETE_FIELD}
+                elif op == "update":
+                    if current is None:
+                        raise NotFound(f"No document to update: {ref.path}")
+                    updated = copy.deepcopy(current)
+                    for path, value in data.items():
+                        _set_path(updated, path, value if value is transforms.DELETE_FIELD else self._resolve(_get_path(updated, path), value))
+                    staged[ref.path] = updated
+            for path, data in staged.items():
+                if data is None:
+                    self._docs.pop(path, None)
+                else:
+                    self._docs[path] = data
+            self.writes += len(writes)
+
+    def put(self, path: str, data: dict):
+        """Seed a document without latency; transforms are resolved."""
+        self._apply([("set", FakeDocument(self, path), data, False)])
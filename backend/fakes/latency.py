@@ -0,0 +1,43 @@
+
+import time
+import random
+import threading
+from contextlib import contextmanager
+
+
+class Latency:
+    """
+    Simulated round-trip time for one fake service: each call sleeps
+    seconds + uniform(0, jitter), plus size / bytes_per_second for payloads.
+    """
+
+    def __init__(self, seconds: float = 0.0, jitter: float = 0.0, bytes_per_second: float = None):
+        self.seconds = seconds
+        self.jitter = jitter
+        self.bytes_per_second = bytes_per_second
+        self.calls = 0
+        self._paused = 0
+        self._lock = threading.Lock()
+
+    def wait(self, size: int = 0):
+        with self._lock:
+            self.calls += 1
+            if self._paused:
+                return
+        delay = self.seconds + (random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if size and self.bytes_per_second:
+            delay += size / self.bytes_per_second
+        if delay > 0:
+            time.sleep(delay)
+
+    @contextmanager
+    def paused(self):
+        """No delays inside the block, e.g. while seeding data."""
+        with self._lock:
+            self._paused += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._paused -= 1
+
@@ -0,0 +1,157 @@
+
+import base64
+import hashlib
+import datetime
+import threading
+from google.api_core.exceptions import NotFound, PreconditionFailed
+from fakes.latency import Latency
+
+CHUNK_BYTES = 256 * 1024
+
+
+class _Object:
+    def __init__(self, data: bytes, content_type: str, cache_control: str, generation: int):
+        self.data = data
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.generation = generation
+        self.updated = datetime.datetime.now(datetime.timezone.utc)
+        self.md5_hash = base64.b64encode(hashlib.md5(data).digest()).decode("ascii")
+        self.etag = hashlib.sha1(f"{generation}:{self.md5_hash}".encode()).hexdigest()[:16]
+
+
+class FakeBlob:
+    """The subset of google.cloud.storage.Blob this app uses."""
+
+    def __init__(self, bucket: "FakeBucket", name: str):
+        self.bucket = bucket
+        self.name = name
+        self.cache_control = None
+        self.content_type = None
+        self._object = None  # metadata snapshot, as after reload()
+
+    def _load(self, obj: _Object):
+        self._object = obj
+        self.cache_control = obj.cache_control
+        self.content_type = obj.content_type
+        return self
+
+    @property
+    def size(self):
+        return len(self._object.data) if self._object else None
+
+    @property
+    def generation(self):
+        return self._object.generation if self._object else None
+
+    @property
+    def etag(self):
+        return self._object.etag if self._object else None
+
+    @property
+    def md5_hash(self):
+        return self._object.md5_hash if self._object else None
+
+    @property
+    def updated(self):
+        return self._object.updated if self._object else None
+
+    def _current(self) -> _Object:
+        obj = self.bucket._objects.get(self.name)
+        if obj is None:
+            raise NotFound(f"No such object: {self.bucket.name}/{self.name}")
+        return obj
+
+    def upload_from_string(self, data, content_type=None, if_generation_match=None, **kwargs):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.bucket.latency.wait(len(data))
+        self._load(self.bucket._put(self.name, data, content_type or self.content_type, self.cache_control, if_generation_match))
+
+    def upload_from_file(self, file_obj, rewind=False, size=None, content_type=None, if_generation_match=None, **kwargs):
+        if rewind:
+            file_obj.seek(0)
+        data = file_obj.read() if size is None else file_obj.read(size)
+        self.upload_from_string(data, content_type=content_type, if_generation_match=if_generation_match)
+
+    def exists(self, **kwargs) -> bool:
+        self.bucket.latency.wait()
+        return self.name in self.bucket._objects
+
+    def reload(self, **kwargs):
+        self.bucket.latency.wait()
+        self._load(self._current())
+
+    def download_as_bytes(self, start=None, end=None, **kwargs) -> bytes:
+        obj = self._current()
+        data = obj.data[start or 0:(end + 1) if end is not None else None]
+        self.bucket.latency.wait(len(data))
+        return data
+
+    def download_to_file(self, file_obj, start=None, end=None, checksum="md5", **kwargs):
+        data = self.download_as_bytes(start=start, end=end)
+        for offset in range(0, len(data), CHUNK_BYTES):
+            file_obj.write(data[offset:offset + CHUNK_BYTES])
+
+    def generate_signed_url(self, expiration=None, method="GET", version=None, **kwargs) -> str:
+        """Local signing, as with a service account key: no round trip. Each call gets a new signature."""
+        with self.bucket._lock:
+            self.bucket.signed += 1
+            signature = hashlib.sha1(f"{self.name}:{self.bucket.signed}".encode()).hexdigest()
+        expires = int(expiration.total_seconds()) if isinstance(expiration, datetime.timedelta) else expiration
+        return f"https://storage.googleapis.com/{self.bucket.name}/{self.name}?X-Goog-Expires={expires}&X-Goog-Signature={signature}"
+
+    def delete(self, **kwargs):
+        self.bucket.latency.wait()
+        with self.bucket._lock:
+            if self.bucket._objects.pop(self.name, None) is None:
+                raise NotFound(f"No such object: {self.bucket.name}/{self.name}")
+
+
+class FakeBucket:
+    """In-memory bucket. Every call that would be an RPC waits on `latency`."""
+
+    def __init__(self, name: str = "fake-bucket", latency: Latency = None):
+        self.name = name
+        self.latency = latency or Latency()
+        self._objects = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.signed = 0  # generate_signed_url calls
+
+    def _put(self, name, data, content_type, cache_control, if_generation_match) -> _Object:
+        with self._lock:
+            existing = self._objects.get(name)
+            if if_generation_match is not None:
+                current = existing.generation if existing else 0
+                if current != if_generation_match:
+                    raise PreconditionFailed(f"Generation mismatch for {name}")
+            self._generation += 1
+            obj = _Object(data, content_type, cache_control, self._generation)
+            self._objects[name] = obj
+            return obj
+
+    def blob(self, name: str) -> FakeBlob:
+        return FakeBlob(self, name)
+
+    def get_blob(self, name: str, **kwargs):
+        self.latency.wait()
+        obj = self._objects.get(name)
+        return FakeBlob(self, name)._load(obj) if obj else None
+
+    def list_blobs(self, prefix: str = None, **kwargs):
+        self.latency.wait()
+        names = sorted(n for n in self._objects if not prefix or n.startswith(prefix))
+        return [FakeBlob(self, n)._load(self._objects[n]) for n in names if n in self._objects]
+
+    def put(self, name: str, data: bytes, content_type: str = "image/jpeg"):
+        """Seed an object without latency."""
+        self._put(name, data, content_type, None, None)
+
+
+class FakeStorageClient:
+    def __init__(self, bucket: FakeBucket):
+        self._bucket = bucket
+
+    def bucket(self, name: str) -> FakeBucket:
+        return self._bucket
@@ -0,0 +1,48 @@
+
+import json
+import random
+import hashlib
+import threading
+from types import SimpleNamespace
+from fakes.latency import Latency
+
+VOCABULARY = [
+    "cat", "dog", "beach", "sunset", "mountain", "forest", "city", "night",
+    "portrait", "food", "car", "flower", "snow", "river", "bridge", "sky",
+    "blue", "green", "red", "golden", "calm", "happy", "vintage", "street",
+    "architecture", "ocean", "desert", "lake", "bird", "tree", "coffee", "book",
+]
+
+
+class FakeVisionModel:
+    """
+    Stands in for the OpenAI client: chat.completions.create() returns a
+    JSON tags response derived from the image bytes (the same image always
+    gets the same tags). error_rate makes that share of calls raise.
+    """
+
+    def __init__(self, latency: Latency = None, tags_per_image: int = 5, error_rate: float = 0.0):
+        self.latency = latency or Latency()
+        self.tags_per_image = tags_per_image
+        self.error_rate = error_rate
+        self.calls = 0
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def tags_for(self, payload: str) -> list:
+        seed = int(hashlib.sha1(payload.encode("utf-8")).hexdigest()[:8], 16)
+        return random.Random(seed).sample(VOCABULARY, self.tags_per_image)
+
+    def _create(self, messages=None, **kwargs):
+        with self._lock:
+            self.calls += 1
+        self.latency.wait()
+        if self.error_rate and random.random() < self.error_rate:
+            raise RuntimeError("Injected vision error")
+
+        payload = ""
+        for part in messages[0]["content"]:
+            if part.get("type") == "image_url":
+                payload = part["image_url"]["url"]
+        content = json.dumps({"tags": self.tags_for(payload)})
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
@@ -1,6 +1,8 @@
 
 import uvicorn
 import os
+import time
+import threading
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
@@ -9,11 +11,16 @@ from dotenv import load_dotenv
 load_dotenv()
 
 # Import Routers
-from routers import images, auth
+from routers import images, auth, metrics, stats
+from services.metrics import MetricsMiddleware
+from services.uploads import UploadSizeLimitMiddleware
 
 # Initialize App
 app = FastAPI()
 
+# 413 for oversized uploads before their bodies are read
+app.add_middleware(UploadSizeLimitMiddleware)
+
 # CORS Middleware
 app.add_middleware(
     CORSMiddleware,
@@ -22,10 +29,68 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Outermost, so request latency includes everything (GET /metrics)
+app.add_middleware(MetricsMiddleware)
 
 # Include Routers
 app.include_router(images.router)
 app.include_router(auth.router)
+app.include_router(metrics.router)
+app.include_router(stats.router)
+
+# Background tagging workers (/upload?async_tagging=true)
+from services.tagging import tagging_workers, pending_sweeper
+# Gives back quota leased for uploads that never happened
+from services.limits import lease_releaser
+# Keeps Firebase token signing certs fetched ahead of expiry
+from services.token_cache import cert_refresher
+# Sends OTP emails queued by /auth/send-otp
+from services.email_dispatch import email_dispatcher
+# Writes usage statistics changes off the request path
+from services.stats import stats_recorder
+
+# Clients are created lazily on first use. With WARM_UP_CLIENTS=true they
+# are created in the background right after startup instead, so the first
+# request doesn't pay for it but the instance still starts serving at once.
+WARM_UP_CLIENTS = os.getenv("WARM_UP_CLIENTS", "false").lower() == "true"
+
+def warm_up_clients():
+    from services.gcs import get_storage_client, get_firestore_client
+    from services.firebase_app import get_firebase_app
+    from services.analyze import get_openai_client, OPENAI_API_KEY
+    from services.email_dispatch import get_sendgrid_client, SENDGRID_API_KEY
+    started = time.perf_counter()
+    get_storage_client()
+    try:
+        get_firestore_client()
+    except Exception as e:
+        print(f"Warm-up Error: {e}")
+    get_firebase_app()
+    if OPENAI_API_KEY:
+        get_openai_client()
+    if SENDGRID_API_KEY:
+        get_sendgrid_client()
+    print(f"Clients warmed up in {time.perf_counter() - started:.2f}s")
+
+@app.on_event("startup")
+def start_background_services():
+    tagging_workers.start()
+    pending_sweeper.start()
+    lease_releaser.start()
+    cert_refresher.start()
+    email_dispatcher.start()
+    stats_recorder.start()
+    if WARM_UP_CLIENTS:
+        threading.Thread(target=warm_up_clients, name="warm-up", daemon=True).start()
+
+@app.on_event("shutdown")
+def stop_background_services():
+    tagging_workers.stop()
+    pending_sweeper.stop()
+    lease_releaser.stop()
+    cert_refresher.stop()
+    email_dispatcher.stop()
+    stats_recorder.stop()
 
 @app.get("/")
 def health_check():
@@ -1,8 +1,10 @@
 
+import asyncio
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel, EmailStr
-from services.otp import generate_otp, store_otp, send_otp_email, verify_otp_logic
+from services.otp import generate_otp, store_otp, discard_otp, send_otp_email, verify_otp_logic
 from services.auth import check_user_exists
+from services.executor import run_blocking, io_executor
 
 router = APIRouter(prefix="/auth", tags=["Auth"])
 
@@ -16,41 +18,47 @@ class VerifyRequest(BaseModel):
 @router.post("/send-otp")
 async def send_otp(request: EmailRequest):
     """
-    Generates a 6-digit OTP and sends it via email.
+    Generates a 6-digit OTP and queues the email with it.
+    The existence check and the OTP write run concurrently, off the event loop.
     """
     email = request.email
-    
-    # 0. Check if user already exists
-    if check_user_exists(email):
-        raise HTTPException(status_code=400, detail="User with this email already exists")
 
-    # 1. Generate Code
+    # 0. Generate Code
     otp = generate_otp()
-    
-    # 2. Store in Firestore (10 min expiry)
-    try:
-        store_otp(email, otp)
-    except Exception as e:
-        print(f"Store OTP Error: {e}")
+
+    # 1 + 2. Check if user already exists, and store in Firestore (10 min expiry)
+    exists, stored = await asyncio.gather(
+        run_blocking(check_user_exists, email),
+        run_blocking(store_otp, email, otp),
+        return_exceptions=True,
+    )
+    if exists is True:
+        if not isinstance(stored, Exception):
+            io_executor.submit(discard_otp, email)
+        raise HTTPException(status_code=400, detail="User with this email already exists")
+    if isinstance(stored, Exception):
+        print(f"Store OTP Error: {stored}")
         raise HTTPException(status_code=500, detail="Failed to generate OTP")
-    
-    # 3. Send Email
-    try:
-        send_otp_email(email, otp)
-    except Exception as e:
-        print(f"Send Email Error: {e}")
-        raise HTTPException(status_code=500, detail="Failed to send email")
-        
+
+    # 3. Send Email (background dispatcher)
+    if not send_otp_email(email, otp):
+        raise HTTPException(status_code=503, detail="Too many signups right now, please retry shortly")
+
     return {"success": True, "message": "OTP sent successfully"}
 
 @router.post("/verify-otp")
 async def verify_otp(request: VerifyRequest):
     """
-    Verifies the OTP code.
+    Verifies the OTP code. A code verifies at most once.
     """
-    is_valid = verify_otp_logic(request.email, request.code)
-    
+    try:
+        is_valid = await run_blocking(verify_otp_logic, request.email, request.code)
+    except Exception as e:
+        print(f"Verify OTP Error: {e}")
+        raise HTTPException(status_code=500, detail="Failed to verify OTP")
+
     if not is_valid:
         raise HTTPException(status_code=400, detail="Invalid or expired OTP")
-        
+
     return {"success": True, "message": "OTP verified"}
+
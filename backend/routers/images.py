@@ -1,148 +1,575 @@
 
-import uuid
-import base64
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Query, Request
-from fastapi.responses import Response
-from google.cloud import firestore
+import io
+import json
+import asyncio
+from typing import List
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Query, Request, BackgroundTasks
+from fastapi.responses import Response, StreamingResponse, JSONResponse, RedirectResponse
+from fastapi.encoders import jsonable_encoder
 from services.auth import verify_token, get_current_user_optional
-from services.limits import check_guest_limit, check_user_limit
-from services.gcs import get_bucket, get_firestore_collection, GCS_BUCKET_NAME
-from services.analyze import analyze_image_with_vision
+from services.limits import check_guest_limit, check_user_limit, refund_guest_uploads, refund_user_uploads
+from services.gcs import get_bucket, GCS_BUCKET_NAME
+from services.executor import run_blocking, io_executor
+from services.tagging import ASYNC_TAGGING
+from services.uploads import (
+    Uploader, store_upload, save_metadata, save_metadata_batch, after_metadata_saved, after_batch_saved, upload_result,
+    check_upload_size, derive_from_upload, BATCH_UPLOAD_CONCURRENCY, BATCH_UPLOAD_MAX_FILES, BATCH_WRITE_SIZE, BATCH_LINGER_SECONDS,
+)
+from services.delivery import blob_headers, is_not_modified, parse_range, iter_blob, RangeNotSatisfiable
+from services.image_cache import image_cache, CachedImage
+from services.derivatives import nearest_width, derivative_blob_name, create_derivative, is_derivative
+from services.listing_cache import listing_cache
+from services.export import iter_export, create_export_token, redeem_export_token
+from services.signed_urls import signed_urls, signing_epoch, IMAGE_DELIVERY_MODE
+from services.metrics import span
 
 router = APIRouter()
 
+# Largest page /images and /search return
+MAX_PAGE_SIZE = 100
+
 @router.post("/upload")
 async def upload_image(
     request: Request,
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...), 
+    async_tagging: bool = Query(None),
     user_token: dict = Depends(get_current_user_optional)
 ):
     """
+    With async_tagging, steps 3 and 5 run later on the tagging worker pool and
+    the image is stored with tag_status "pending".
+
+    Content seen before (by SHA-256) reuses the owner's stored blob and the
+    cached tags instead of uploading and analyzing again.
+
     1. Check Usage Limits (User vs Guest)
     2. Upload image to GCS
-    3. Analyze with OpenAI Vision
+    3. Analyze with OpenAI Vision (concurrently with 2)
     4. Save metadata to Firestore
+    5. Update the user's tag index
+    6. Generate resized derivatives (after the response is sent)
+
+    The file is streamed from its spool, never held in memory whole; files
+    over MAX_UPLOAD_BYTES get a 413.
     """
-    
-    # Determine Identity & Check Limits
-    user_id = None
-    user_email = "guest"
-    
-    if user_token:
-        # Logged-in User
-        user_id = user_token['uid']
-        user_email = user_token.get('email', 'unknown')
-        check_user_limit(user_id)
-    else:
-        # Guest
-        # In Cloud Run (behind proxy), use X-Forwarded-For
-        forwarded = request.headers.get("X-Forwarded-For")
-        if forwarded:
-            ip = forwarded.split(",")[0]
-        else:
-            ip = request.client.host
-        check_guest_limit(ip)
-    
+    check_upload_size(file)
     if not GCS_BUCKET_NAME:
         raise HTTPException(status_code=500, detail="GCS_BUCKET_NAME not configured")
 
+    # 1. Check Usage Limits
+    uploader = _get_uploader(request, user_token)
+    await _reserve_uploads(uploader, 1)
+
+    if async_tagging is None:
+        async_tagging = ASYNC_TAGGING
+
+    saved = False
     try:
-        # 1. Upload to GCS
-        file_id = str(uuid.uuid4())
-        extension = file.filename.split(".")[-1]
-        blob_name = f"images/{file_id}.{extension}"
-        
         bucket = get_bucket()
-        blob = bucket.blob(blob_name)
-        
-        # Read file content
-        content = await file.read()
-        blob.upload_from_string(content, content_type=file.content_type)
-        
-        # 2. Analyze with OpenAI Vision
-        base64_image = base64.b64encode(content).decode('utf-8')
-        tags = analyze_image_with_vision(base64_image, extension)
-
-        # 3. Save to Firestore
-        doc_ref = get_firestore_collection().document(file_id)
-        
-        doc_data = {
-            "id": file_id,
-            "filename": file.filename,
-            "blob_name": blob_name, 
-            "tags": tags,
-            "created_at": firestore.SERVER_TIMESTAMP,
-            "uploaded_by": user_email, 
-            "user_id": user_id # None for guests
-        }
-        doc_ref.set(doc_data)
-
-        # Return Proxy URL
-        proxy_url = f"/images/{file_id}.{extension}"
-
-        return {
-            "success": True, 
-            "image_url": proxy_url, 
-            "tags": tags,
-            "id": file_id
-        }
+
+        # 2 + 3. Upload to GCS and analyze with OpenAI Vision
+        stored = await store_upload(file, uploader, bucket, async_tagging)
+
+        # 4. Save to Firestore
+        await run_blocking(save_metadata, stored)
+        saved = True
+
+        # 5. Update the user's tag index (or queue tagging)
+        await run_blocking(after_metadata_saved, stored, uploader)
+
+        # 6. Thumbnails don't block the response; /images/{filename}?w= builds any that are missing
+        if not stored.reused_blob:
+            background_tasks.add_task(derive_from_upload, bucket, stored.blob_name, _detach_upload(file))
+
+        return upload_result(stored)
 
     except HTTPException as he:
+        if not saved:
+            await run_blocking(_refund_uploads, uploader, 1)
         raise he
     except Exception as e:
         print(f"Error processing upload: {e}")
+        if not saved:
+            await run_blocking(_refund_uploads, uploader, 1)
         raise HTTPException(status_code=500, detail=str(e))
 
-from services.gallery import get_recent_images_for_user, search_images_for_user
+@router.post("/upload/batch")
+async def upload_batch(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    async_tagging: bool = Query(None),
+    user_token: dict = Depends(get_current_user_optional)
+):
+    """
+    Upload many images at once. The quota is reserved for the whole batch up
+    front and given back for files that fail; files are stored and tagged BATCH_UPLOAD_CONCURRENCY at a time and
+    their docs committed with Firestore WriteBatches. Streams one NDJSON line
+    per file as it finishes, then a summary line.
+    """
+    if len(files) > BATCH_UPLOAD_MAX_FILES:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_UPLOAD_MAX_FILES} files per batch")
+    for file in files:
+        check_upload_size(file)
+
+    if not GCS_BUCKET_NAME:
+        raise HTTPException(status_code=500, detail="GCS_BUCKET_NAME not configured")
+
+    uploader = _get_uploader(request, user_token)
+    await _reserve_uploads(uploader, len(files))
+
+    if async_tagging is None:
+        async_tagging = ASYNC_TAGGING
+
+    bucket = get_bucket()
+    files = [_detach_upload(f) for f in files]
+    return StreamingResponse(
+        _batch_results(files, uploader, bucket, async_tagging),
+        media_type="application/x-ndjson",
+    )
+
+def _get_uploader(request: Request, user_token: dict) -> Uploader:
+    if user_token:
+        # Logged-in User
+        return Uploader(user_id=user_token['uid'], user_email=user_token.get('email', 'unknown'))
+
+    # Guest
+    # In Cloud Run (behind proxy), use X-Forwarded-For
+    forwarded = request.headers.get("X-Forwarded-For")
+    if forwarded:
+        ip = forwarded.split(",")[0]
+    else:
+        ip = request.client.host
+    return Uploader(ip=ip)
+
+async def _reserve_uploads(uploader: Uploader, count: int):
+    """Check Usage Limits (User vs Guest) and reserve `count` uploads."""
+    with span("upload", "quota"):
+        if uploader.user_id:
+            await run_blocking(check_user_limit, uploader.user_id, count)
+        else:
+            await run_blocking(check_guest_limit, uploader.ip, count)
+
+def _refund_uploads(uploader: Uploader, count: int):
+    """Give back reserved uploads that were never stored. Blocking."""
+    if count <= 0:
+        return
+    if uploader.user_id:
+        refund_user_uploads(uploader.user_id, count)
+    else:
+        refund_guest_uploads(uploader.ip, count)
+
+def _detach_upload(upload: UploadFile) -> UploadFile:
+    """
+    FastAPI closes form files as soon as the endpoint returns, but a streamed
+    batch and the derivatives task keep reading them afterwards: move the
+    spool to a new UploadFile and leave the original holding an empty buffer to close.
+    """
+    detached = UploadFile(file=upload.file, size=upload.size, filename=upload.filename, headers=upload.headers)
+    upload.file = io.BytesIO()
+    return detached
+
+async def _batch_results(files: list, uploader: Uploader, bucket, async_tagging: bool):
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(BATCH_UPLOAD_CONCURRENCY)
+
+    async def store_one(file):
+        async with semaphore:
+            derive = False
+            try:
+                stored = await store_upload(file, uploader, bucket, async_tagging)
+                derive = not stored.reused_blob
+                return file.filename, stored, None
+            except HTTPException as he:
+                return file.filename, None, he.detail
+            except Exception as e:
+                print(f"Error processing upload: {e}")
+                return file.filename, None, str(e)
+            finally:
+                if derive:
+                    # Fire-and-forget; the spool is closed once the derivatives are stored
+                    io_executor.submit(derive_from_upload, bucket, stored.blob_name, file)
+                else:
+                    await file.close()
+
+    def line(data: dict) -> str:
+        return json.dumps(data) + "\n"
+
+    running = {asyncio.ensure_future(store_one(f)) for f in files}
+    uploaded = failed = 0
+    refunded = False
+    try:
+        while running:
+            # Group commit: take whatever finishes within a short window, up to one WriteBatch
+            done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            deadline = loop.time() + BATCH_LINGER_SECONDS
+            while running and len(done) < BATCH_WRITE_SIZE and loop.time() < deadline:
+                more, running = await asyncio.wait(running, timeout=deadline - loop.time(), return_when=asyncio.FIRST_COMPLETED)
+                done |= more
+
+            ready = []
+            for task in done:
+                filename, stored, error = task.result()
+                if error is not None:
+                    failed += 1
+                    yield line({"filename": filename, "success": False, "error": error})
+                else:
+                    ready.append((filename, stored))
+
+            for start in range(0, len(ready), BATCH_WRITE_SIZE):
+                group = ready[start:start + BATCH_WRITE_SIZE]
+                try:
+                    await run_blocking(save_metadata_batch, [stored for _, stored in group])
+                except Exception as e:
+                    print(f"Batch Metadata Error: {e}")
+                    failed += len(group)
+                    for filename, _ in group:
+                        yield line({"filename": filename, "success": False, "error": str(e)})
+                    continue
+                uploaded += len(group)
+
+                # The docs are committed: the images are uploaded even if indexing fails
+                results = await asyncio.gather(*[
+                    run_blocking(after_metadata_saved, stored, uploader, batched=True) for _, stored in group
+                ], return_exceptions=True)
+                for error in results:
+                    if isinstance(error, Exception):
+                        print(f"Batch Index Error: {error}")
+                try:
+                    await run_blocking(after_batch_saved, [stored for _, stored in group], uploader)
+                except Exception as e:
+                    print(f"Batch Index Error: {e}")
+                for filename, stored in group:
+                    yield line({"filename": filename, **upload_result(stored)})
+
+        # Quota was reserved for every file; give back what wasn't stored
+        refunded = True
+        await run_blocking(_refund_uploads, uploader, len(files) - uploaded)
+        yield line({"done": True, "uploaded": uploaded, "failed": failed})
+    finally:
+        # Client went away mid-stream: stop the remaining work
+        for task in running:
+            task.cancel()
+        if not refunded:
+            io_executor.submit(_refund_uploads, uploader, len(files) - uploaded)
+
+from services.gallery import (
+    get_recent_images_for_user, search_images_for_user, delete_image_for_user, get_image_status_for_user,
+    similar_images_for_user,
+)
+
+def _cached_listing(request: Request, user_id: str, kind: str, params: dict, fetch):
+    """
+    Serve a listing from the per-user cache, with an ETag so an unchanged
+    listing costs the client a 304. fetch() returns the JSON body on a miss.
+    """
+    try:
+        version = listing_cache.version(user_id)
+    except Exception as e:
+        print(f"Listing Version Error: {e}")
+        return fetch()
+
+    if IMAGE_DELIVERY_MODE == "signed":
+        # Pages embed signed URLs; stop serving them (and matching their ETag) before those expire
+        params = {**params, "signing_epoch": signing_epoch()}
+    etag = listing_cache.etag(user_id, version, kind, params)
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag in [tag.strip().removeprefix("W/") for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    body = listing_cache.get(etag)
+    if body is None:
+        body = fetch()
+        listing_cache.put(etag, body)
+    return JSONResponse(jsonable_encoder(body), headers=headers)
 
 @router.get("/search")
 def search_images(
+    request: Request,
     tag: str = Query(..., min_length=1),
+    limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str = None,
     user_token: dict = Depends(verify_token)
 ):
     """
-    Search images using in-memory fuzzy matching (MVP)
+    Search images by tag substring using the per-user tag index.
+    Pass next_cursor back as cursor for the next page.
     """
     user_id = user_token['uid']
-    return {"results": search_images_for_user(user_id, tag)}
+
+    def fetch():
+        try:
+            results, next_cursor = search_images_for_user(user_id, tag, limit, cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return {"results": results, "next_cursor": next_cursor}
+
+    return _cached_listing(request, user_id, "search", {"tag": tag, "limit": limit, "cursor": cursor}, fetch)
 
 @router.get("/images")
 def get_recent_images(
-    limit: int = 20,
+    request: Request,
+    limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+    cursor: str = None,
     user_token: dict = Depends(verify_token)
 ):
     """
-    Get most recently uploaded images for the user
+    Get most recently uploaded images for the user.
+    Pass next_cursor back as cursor for the next page.
     """
     user_id = user_token['uid']
 
+    def fetch():
+        try:
+            results, next_cursor = get_recent_images_for_user(user_id, limit, cursor)
+            return {"results": results, "next_cursor": next_cursor}
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            print(f"Firestore Query Error: {e}")
+            # Identify if it's an index error
+            if "bit.ly" in str(e) or "FAILED_PRECONDITION" in str(e):
+                 raise HTTPException(status_code=500, detail="Firestore Index Required. Check backend logs for creation link.")
+            raise HTTPException(status_code=500, detail=str(e))
+
+    return _cached_listing(request, user_id, "images", {"limit": limit, "cursor": cursor}, fetch)
+
+@router.get("/images/export")
+def export_images(user_token: dict = Depends(verify_token)):
+    """
+    Download all of the user's images as one ZIP, with a tags.json manifest
+    of their metadata. The archive is built while it streams.
+    """
+    return _export_response(user_token['uid'])
+
+@router.post("/images/export/link")
+def create_export_link(user_token: dict = Depends(verify_token)):
+    """
+    A one-time, short-lived export URL for browsers, which can then download
+    the ZIP by plain navigation (streamed to disk) instead of fetching it into memory.
+    """
     try:
-        results = get_recent_images_for_user(user_id, limit)
-        return {"results": results}
+        token = create_export_token(user_token['uid'])
     except Exception as e:
-        print(f"Firestore Query Error: {e}")
-        # Identify if it's an index error
-        if "bit.ly" in str(e) or "FAILED_PRECONDITION" in str(e):
-             raise HTTPException(status_code=500, detail="Firestore Index Required. Check backend logs for creation link.")
-        raise HTTPException(status_code=500, detail=str(e))
+        print(f"Export Link Error: {e}")
+        raise HTTPException(status_code=500, detail="Failed to create export link")
+    return {"url": f"/images/export/{token}"}
+
+@router.get("/images/export/{token}")
+def export_images_by_link(token: str):
+    """
+    The export ZIP for a link from POST /images/export/link
+    """
+    user_id = redeem_export_token(token)
+    if user_id is None:
+        raise HTTPException(status_code=404, detail="Export link expired or already used")
+    return _export_response(user_id)
+
+def _export_response(user_id: str) -> StreamingResponse:
+    if not GCS_BUCKET_NAME:
+        raise HTTPException(status_code=500, detail="GCS_BUCKET_NAME not configured")
+    return StreamingResponse(
+        iter_export(user_id),
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": 'attachment; filename="smart-gallery-export.zip"',
+            "Cache-Control": "private, no-store",
+        },
+    )
+
+@router.get("/images/{image_id}/similar")
+def get_similar_images(
+    request: Request,
+    image_id: str,
+    limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+    user_token: dict = Depends(verify_token)
+):
+    """
+    The user's images that look most like this one (perceptual hash and colors), closest first.
+    """
+    user_id = user_token['uid']
+
+    def fetch():
+        results = similar_images_for_user(user_id, image_id, limit)
+        if results is None:
+            raise HTTPException(status_code=404, detail="Image not found")
+        return {"results": results}
+
+    return _cached_listing(request, user_id, "similar", {"id": image_id, "limit": limit}, fetch)
+
+@router.get("/images/{image_id}/status")
+def get_image_status(
+    image_id: str,
+    user_token: dict = Depends(get_current_user_optional)
+):
+    """
+    Tagging status of an uploaded image (poll after /upload?async_tagging=true)
+    """
+    user_id = user_token['uid'] if user_token else None
+    status = get_image_status_for_user(user_id, image_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return status
+
+@router.delete("/images/{image_id}")
+def delete_image(
+    image_id: str,
+    user_token: dict = Depends(verify_token)
+):
+    """
+    Delete one of the user's images
+    """
+    user_id = user_token['uid']
+    if not delete_image_for_user(user_id, image_id):
+        raise HTTPException(status_code=404, detail="Image not found")
+    return {"success": True, "id": image_id}
 
 @router.get("/images/{filename}")
-async def get_image(filename: str):
+def get_image(filename: str, request: Request, w: int = Query(None, ge=1)):
     """
-    Proxy image from GCS
+    Serve image from the hot cache or stream it from GCS (supports Range and conditional requests).
+    With ?w=, serve the nearest downscaled derivative, creating it on first use.
+    In the redirect and signed delivery modes, answer with a 302 to a signed GCS URL instead.
     """
+    blob_name = f"images/{filename}"
+    if is_derivative(blob_name):
+        # Already a downscaled copy; only originals are resized
+        w = None
+
+    if IMAGE_DELIVERY_MODE != "proxy":
+        response = _redirect_image(blob_name, w)
+        if response is not None:
+            return response
+        # Signing failed; serve it ourselves
+
+    if w is not None:
+        width = nearest_width(w)
+        response = _serve_blob(request, derivative_blob_name(blob_name, width))
+        if response is not None:
+            return response
+        created = _create_derivative(blob_name, width)
+        if created is not None:
+            blob, content = created
+            return _image_response(request, blob, content)
+        # Not an image we can resize; fall back to the original
+
+    response = _serve_blob(request, blob_name)
+    if response is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return response
+
+def _create_derivative(blob_name: str, width: int):
+    """(blob, content or None) of a newly stored derivative, or None if the original can't be resized."""
+    try:
+        with span("get_image", "derivative"):
+            created = create_derivative(get_bucket(), blob_name, width)
+    except Exception as e:
+        print(f"Derivative Error ({blob_name}): {e}")
+        return None
+    if created is not None:
+        blob, content = created
+        if content is not None:
+            image_cache.put(CachedImage.from_blob(blob, content))
+    return created
+
+def _blob_exists(blob_name: str) -> bool:
+    if image_cache.get(blob_name) is not None:
+        return True
+    with span("get_image", "gcs_metadata", backend="gcs"):
+        blob = get_bucket().get_blob(blob_name)
+    if blob is None:
+        # Deleted, possibly through another instance
+        image_cache.invalidate(blob_name)
+        return False
+    return True
+
+def _redirect_image(blob_name: str, w: int = None):
+    """
+    302 to a signed URL for the blob, or its ?w= derivative (created if
+    missing), so the bytes come straight from GCS. A cached signature skips
+    the existence check. None if signing isn't possible.
+    """
+    try:
+        signed = None
+        if w is not None:
+            width = nearest_width(w)
+            signed = signed_urls.get(derivative_blob_name(blob_name, width), exists=_blob_exists)
+            if signed is None and _create_derivative(blob_name, width) is not None:
+                signed = signed_urls.get(derivative_blob_name(blob_name, width))
+        if signed is None:
+            signed = signed_urls.get(blob_name, exists=_blob_exists)
+    except Exception as e:
+        print(f"Signed Redirect Error ({blob_name}): {e}")
+        return None
+    if signed is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    url, reusable_for = signed
+    # Browsers may reuse the redirect only while the URL it points to has time left
+    return RedirectResponse(url, status_code=302, headers={"Cache-Control": f"private, max-age={max(0, int(reusable_for))}"})
+
+def _serve_blob(request: Request, blob_name: str):
+    """Response for a blob from the hot cache or GCS, or None if it doesn't exist."""
+    with span("get_image", "cache"):
+        cached = image_cache.get(blob_name)
+    if cached is not None:
+        return _image_response(request, cached, cached.content)
+
     try:
-        blob_name = f"images/{filename}"
         bucket = get_bucket()
-        blob = bucket.blob(blob_name)
-        
-        if not blob.exists():
-            raise HTTPException(status_code=404, detail="Image not found")
-            
-        content = blob.download_as_bytes()
-        content_type = blob.content_type or "image/jpeg"
-        
-        return Response(content=content, media_type=content_type)
+        # Single metadata round trip; None if the object doesn't exist
+        with span("get_image", "gcs_metadata", backend="gcs"):
+            blob = bucket.get_blob(blob_name)
     except Exception as e:
         # print(f"Proxy Error: {e}")
-        raise HTTPException(status_code=404, detail="Image not found")
+        return None
+
+    if blob is None:
+        # Deleted, possibly through another instance
+        image_cache.invalidate(blob_name)
+        return None
+
+    # A cached copy that GCS just confirmed is still current
+    cached = image_cache.get(blob_name, blob.generation)
+    if cached is not None:
+        return _image_response(request, cached, cached.content)
+
+    if not image_cache.accepts(blob.size) or is_not_modified(request.headers, blob):
+        return _image_response(request, blob)
+
+    try:
+        # Generation is pinned by get_blob, so content matches the metadata we cache
+        with span("get_image", "gcs_download", backend="gcs"):
+            content = blob.download_as_bytes()
+    except Exception as e:
+        return None
+    image_cache.put(CachedImage.from_blob(blob, content))
+    return _image_response(request, blob, content)
+
+def _image_response(request: Request, blob, content: bytes = None):
+    """
+    Build the response for a blob (or cached entry with the same attributes).
+    Streams from GCS unless the full content is already in memory.
+    """
+    headers = blob_headers(blob)
+    if is_not_modified(request.headers, blob):
+        return Response(status_code=304, headers=headers)
+
+    try:
+        byte_range = parse_range(request.headers, blob)
+    except RangeNotSatisfiable:
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{blob.size}"})
+
+    content_type = blob.content_type or "image/jpeg"
+    if byte_range is None:
+        if content is not None:
+            return Response(content=content, media_type=content_type, headers=headers)
+        headers["Content-Length"] = str(blob.size)
+        return StreamingResponse(iter_blob(blob), media_type=content_type, headers=headers)
+
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{blob.size}"
+    if content is not None:
+        return Response(content=content[start:end + 1], status_code=206, media_type=content_type, headers=headers)
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(iter_blob(blob, start, end), status_code=206, media_type=content_type, headers=headers)
@@ -0,0 +1,46 @@
+import os
+import hmac
+from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import PlainTextResponse
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from services import metrics
+from services.image_cache import image_cache
+from services.listing_cache import listing_cache
+from services.token_cache import token_cache
+from services.signed_urls import signed_urls
+from services.tagging import tagging_queue
+from services.analyze import vision_breaker
+from services.email_dispatch import email_dispatcher
+
+# The service is deployed with --allow-unauthenticated, so /metrics is off
+# unless METRICS_TOKEN is set, and then needs "Authorization: Bearer <token>"
+# (the scraper's, not a Firebase ID token).
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+router = APIRouter(tags=["Metrics"])
+metrics_bearer = HTTPBearer(auto_error=False)
+
+def verify_metrics_token(credentials: HTTPAuthorizationCredentials = Depends(metrics_bearer)):
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not credentials or not hmac.compare_digest(credentials.credentials.encode(), METRICS_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+
+@router.get("/metrics", response_class=PlainTextResponse, dependencies=[Depends(verify_metrics_token)])
+def get_metrics():
+    """
+    Request, stage and outbound call metrics of this process, plus cache
+    and tagging queue gauges, in Prometheus text format.
+    """
+    gauges = []
+    gauges += metrics.render_stats("image_cache", image_cache.stats())
+    gauges += metrics.render_stats("listing_cache", listing_cache.stats())
+    gauges += metrics.render_stats("token_cache", token_cache.stats())
+    gauges += metrics.render_stats("signed_url_cache", signed_urls.stats())
+    gauges += metrics.render_stats("vision_breaker", vision_breaker.stats())
+    gauges += metrics.render_stats("email_dispatcher", email_dispatcher.stats())
+    try:
+        gauges += metrics.render_stats("tagging_queue", {"jobs": tagging_queue.size()})
+    except Exception as e:
+        print(f"Metrics Error: {e}")
+    return PlainTextResponse(metrics.render(gauges), media_type="text/plain; version=0.0.4")
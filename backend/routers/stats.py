@@ -0,0 +1,17 @@
+from fastapi import APIRouter, Depends, HTTPException
+from services.auth import verify_token
+from services.stats import global_stats, user_stats
+
+router = APIRouter(tags=["Stats"])
+
+@router.get("/stats")
+def get_stats(user_token: dict = Depends(verify_token)):
+    """
+    Image and user counts and the most used tags, overall and for the caller.
+    Read from the maintained aggregates; the overall numbers may lag a little.
+    """
+    try:
+        return {"global": global_stats.get(), "user": user_stats(user_token['uid'])}
+    except Exception as e:
+        print(f"Stats Error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,36 @@
+"""
+Backfill width, height, orientation and BlurHash for images uploaded before
+uploads recorded them. Uses the same GCS_BUCKET_NAME / FIRESTORE_COLLECTION
+configuration (and credentials) as the server. Safe to re-run; images that
+already have the fields are skipped.
+
+    python scripts/backfill_image_info.py
+    python scripts/backfill_image_info.py --workers 32 --batch-size 200 --limit 1000
+"""
+import os
+import sys
+import argparse
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from services.image_info import backfill_image_info, BACKFILL_BATCH_SIZE, BACKFILL_WORKERS
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=BACKFILL_BATCH_SIZE, help="docs per Firestore WriteBatch (max 500)")
+    parser.add_argument("--workers", type=int, default=BACKFILL_WORKERS, help="images downloaded and decoded at once")
+    parser.add_argument("--limit", type=int, default=None, help="stop after this many images")
+    args = parser.parse_args()
+    if not 1 <= args.batch_size <= 500:
+        parser.error("--batch-size must be between 1 and 500")
+
+    result = backfill_image_info(args.batch_size, args.workers, args.limit)
+    print(f"Done: {result['updated']} updated, {result['failed']} failed, {result['users']} users")
+    if result["failed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+"""
+Rebuild the usage statistics (image and user counts, tag histograms) from
+the image docs, correcting any drift in the incrementally kept counters.
+Uses the same FIRESTORE_COLLECTION configuration (and credentials) as the
+server. Uploads and deletes made while it runs can be missed, so run it
+when traffic is low.
+
+    python scripts/reconcile_stats.py
+    python scripts/reconcile_stats.py --partitions 64 --workers 16
+"""
+import os
+import sys
+import argparse
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from services.stats import rebuild_stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--partitions", type=int, default=16, help="created_at ranges the images are read in")
+    parser.add_argument("--workers", type=int, default=8, help="ranges read at once")
+    args = parser.parse_args()
+    if args.partitions < 1 or args.workers < 1:
+        parser.error("--partitions and --workers must be at least 1")
+
+    counters = rebuild_stats(args.partitions, args.workers)
+    print(f"Done: {counters['images']} images ({counters['guest_images']} guest), {counters['users']} users")
+
+
+if __name__ == "__main__":
+    main()
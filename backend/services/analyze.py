@@ -1,24 +1,194 @@
 
+import io
 import os
 import json
-from openai import OpenAI
+import math
+import time
+import base64
+import random
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from fastapi import HTTPException
 from dotenv import load_dotenv
+from services.metrics import span
+from services.circuit_breaker import CircuitBreaker, CircuitOpenError
 
 load_dotenv()
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-openai_client = OpenAI(api_key=OPENAI_API_KEY)
+_openai_client = None
+_openai_lock = threading.Lock()
+
+# Inline tagging gives up after VISION_DEADLINE_SECONDS in total; the upload is
+# then stored with tag_status "pending" and tagged by the background workers.
+# Within the deadline each request may take VISION_TIMEOUT_SECONDS, failures
+# are retried (up to VISION_MAX_ATTEMPTS, with jittered backoff), and a request
+# still running after VISION_HEDGE_AFTER_SECONDS gets a second one racing it
+# (0 disables hedging; a hedge can double the cost of the slowest calls).
+# After VISION_BREAKER_FAILURES failures in a row calls fail fast for
+# VISION_BREAKER_RESET_SECONDS, then a single probe decides whether to resume.
+VISION_TIMEOUT_SECONDS = float(os.getenv("VISION_TIMEOUT_SECONDS", 20))
+VISION_DEADLINE_SECONDS = float(os.getenv("VISION_DEADLINE_SECONDS", 30))
+VISION_MAX_ATTEMPTS = int(os.getenv("VISION_MAX_ATTEMPTS", 2))
+VISION_RETRY_BACKOFF_SECONDS = float(os.getenv("VISION_RETRY_BACKOFF_SECONDS", 0.5))
+VISION_HEDGE_AFTER_SECONDS = float(os.getenv("VISION_HEDGE_AFTER_SECONDS", 8))
+VISION_BREAKER_FAILURES = int(os.getenv("VISION_BREAKER_FAILURES", 5))
+VISION_BREAKER_RESET_SECONDS = float(os.getenv("VISION_BREAKER_RESET_SECONDS", 30))
+VISION_REQUEST_WORKERS = int(os.getenv("VISION_REQUEST_WORKERS", 16))
+
+vision_breaker = CircuitBreaker("vision", VISION_BREAKER_FAILURES, VISION_BREAKER_RESET_SECONDS)
+# Hedged calls run their requests here, so one call can have two in flight
+_request_executor = ThreadPoolExecutor(max_workers=VISION_REQUEST_WORKERS, thread_name_prefix="vision-request")
+
+
+class VisionUnavailable(Exception):
+    """The vision model didn't produce tags in time (failed, timed out or circuit open)."""
+
+def get_openai_client():
+    """Created on first use: importing openai alone takes most of a second of cold start."""
+    global _openai_client
+    if _openai_client is None:
+        with _openai_lock:
+            if _openai_client is None:
+                from openai import OpenAI
+                # Retries and timeouts are ours (see analyze_image_with_vision)
+                _openai_client = OpenAI(api_key=OPENAI_API_KEY, max_retries=0, timeout=VISION_TIMEOUT_SECONDS)
+    return _openai_client
+
+# Images are shrunk before tagging: tags don't improve past ~768px, while
+# upload time, memory and image tokens all grow with the raw photo size.
+VISION_MAX_EDGE = int(os.getenv("VISION_MAX_EDGE", 768))
+VISION_JPEG_QUALITY = int(os.getenv("VISION_JPEG_QUALITY", 85))
+# OpenAI image detail level: auto | high | low ("low" is a flat 85 tokens at 512px)
+VISION_DETAIL = os.getenv("VISION_DETAIL", "auto")
+
+def estimate_image_tokens(width: int, height: int) -> int:
+    """
+    GPT-4o "high" detail cost: fit within 2048x2048, scale the short side
+    down to 768, then 170 tokens per 512px tile plus 85 base.
+    """
+    if VISION_DETAIL == "low":
+        return 85
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    return 85 + 170 * math.ceil(width / 512) * math.ceil(height / 512)
+
+def encode_for_vision(source, extension: str):
+    """
+    Downscale to VISION_MAX_EDGE, drop metadata and re-encode as JPEG, then base64.
+    source is the image bytes or a seekable binary file, which is decoded
+    without reading it into memory first.
+    Returns (base64_image, extension, stats). Content Pillow can't decode is sent as-is.
+    """
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    stats = {"original_bytes": source.seek(0, io.SEEK_END)}
+    source.seek(0)
+    from PIL import Image, ImageOps
+    try:
+        image = Image.open(source)
+        width, height = image.size
+        # JPEG can decode straight to a 1/2..1/8 scale, skipping most of the work
+        image.draft("RGB", (VISION_MAX_EDGE, VISION_MAX_EDGE))
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        image.thumbnail((VISION_MAX_EDGE, VISION_MAX_EDGE), Image.LANCZOS)
+        out = io.BytesIO()
+        image.save(out, format="JPEG", quality=VISION_JPEG_QUALITY)
+        payload, extension = out.getvalue(), "jpeg"
+        stats["original_tokens"] = estimate_image_tokens(width, height)
+        stats["sent_tokens"] = estimate_image_tokens(*image.size)
+    except Exception as e:
+        print(f"Vision Preprocess Error: {e}")
+        source.seek(0)
+        payload = source.read()
+
+    stats["sent_bytes"] = len(payload)
+    return base64.b64encode(payload).decode('utf-8'), extension, stats
 
 def analyze_image_with_vision(base64_image: str, extension: str) -> list:
     """
-    Sends base64 image to OpenAI Vision model and returns a list of tags.
+    Sends base64 image to OpenAI Vision model and returns a list of tags,
+    within VISION_DEADLINE_SECONDS. Raises VisionUnavailable otherwise.
     """
     if not OPENAI_API_KEY:
         raise HTTPException(status_code=500, detail="OpenAI API Key not configured")
 
+    deadline = time.monotonic() + VISION_DEADLINE_SECONDS
+    error = None
+    for attempt in range(VISION_MAX_ATTEMPTS):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            return _hedged_request(base64_image, extension, min(VISION_TIMEOUT_SECONDS, remaining))
+        except CircuitOpenError as e:
+            error = e
+            break  # retrying can't help until the circuit closes
+        except VisionUnavailable as e:
+            error = e
+        delay = random.uniform(0, VISION_RETRY_BACKOFF_SECONDS * 2 ** attempt)
+        if time.monotonic() + delay >= deadline:
+            break
+        time.sleep(delay)
+
+    print(f"OpenAI Error: {error or 'deadline exceeded'}")
+    if isinstance(error, VisionUnavailable):
+        raise error
+    raise VisionUnavailable(str(error or "Vision deadline exceeded")) from error
+
+def _hedged_request(base64_image: str, extension: str, timeout: float) -> list:
+    """request_tags(), plus a second racing request if the first is still running after VISION_HEDGE_AFTER_SECONDS."""
+    if VISION_HEDGE_AFTER_SECONDS <= 0 or VISION_HEDGE_AFTER_SECONDS >= timeout:
+        return request_tags(base64_image, extension, timeout)
+
+    started = time.monotonic()
+
+    def submit(timeout):
+        return _request_executor.submit(contextvars.copy_context().run, request_tags, base64_image, extension, timeout)
+
+    first = submit(timeout)
+    done, _ = wait([first], timeout=VISION_HEDGE_AFTER_SECONDS)
+    if done:
+        return first.result()
+
+    pending = {first}
+    # Don't add load to an upstream that is already failing
+    if vision_breaker.state == "closed":
+        pending.add(submit(timeout - (time.monotonic() - started)))
+
+    error = None
+    while pending:
+        done, pending = wait(pending, timeout=max(0, started + timeout - time.monotonic()), return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for future in done:
+            if future.exception() is None:
+                return future.result()
+            error = future.exception()
+    # Requests still running finish on their own timeout; their results are dropped
+    raise error or VisionUnavailable(f"Vision request timed out after {timeout:.1f}s")
+
+def request_tags(base64_image: str, extension: str, timeout: float = VISION_TIMEOUT_SECONDS) -> list:
+    """
+    A single vision request through the circuit breaker, for callers that do
+    their own retries. Raises CircuitOpenError or VisionUnavailable on failure.
+    """
+    vision_breaker.before_call()
     try:
-        response = openai_client.chat.completions.create(
+        tags = _request_tags(base64_image, extension, timeout)
+    except Exception as e:
+        vision_breaker.record_failure()
+        raise VisionUnavailable(f"{type(e).__name__}: {e}") from e
+    vision_breaker.record_success()
+    return tags
+
+def _request_tags(base64_image: str, extension: str, timeout: float) -> list:
+    client = get_openai_client()
+    with span("vision", "request_tags", backend="openai"):
+        response = client.chat.completions.create(
             model="gpt-4o",
             messages=[
                 {
@@ -28,7 +198,8 @@ def analyze_image_with_vision(base64_image: str, extension: str) -> list:
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/{extension};base64,{base64_image}"
+                                "url": f"data:image/{extension};base64,{base64_image}",
+                                "detail": VISION_DETAIL,
                             },
                         },
                     ],
@@ -36,11 +207,9 @@ def analyze_image_with_vision(base64_image: str, extension: str) -> list:
             ],
             response_format={"type": "json_object"},
             max_tokens=300,
+            timeout=timeout,
         )
-        
-        analysis_content = response.choices[0].message.content
-        analysis_json = json.loads(analysis_content)
-        return analysis_json.get("tags", [])
-    except Exception as e:
-        print(f"OpenAI Error: {e}")
-        return [] # Fallback to empty tags on error
+    
+    analysis_content = response.choices[0].message.content
+    analysis_json = json.loads(analysis_content)
+    return analysis_json.get("tags", [])
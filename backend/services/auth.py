@@ -1,16 +1,9 @@
 
 import os
-import firebase_admin
-from firebase_admin import credentials, auth
 from fastapi import HTTPException, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-
-# Initialize Firebase Admin
-if not firebase_admin._apps:
-    try:
-        firebase_admin.initialize_app()
-    except Exception as e:
-        print(f"Warning: Firebase Admin failed to initialize: {e}")
+from services.token_cache import token_cache
+from services.firebase_app import get_firebase_app
 
 security = HTTPBearer()
 security_optional = HTTPBearer(auto_error=False)
@@ -22,7 +15,7 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """
     token = credentials.credentials
     try:
-        decoded_token = auth.verify_id_token(token)
+        decoded_token = token_cache.verify_id_token(token)
         return decoded_token
     except Exception as e:
         # print(f"Auth Error: {e}") # Debug log
@@ -37,7 +30,7 @@ def get_current_user_optional(credentials: HTTPAuthorizationCredentials = Depend
         return None
     try:
         token = credentials.credentials
-        decoded_token = auth.verify_id_token(token)
+        decoded_token = token_cache.verify_id_token(token)
         return decoded_token
     except:
         return None
@@ -46,7 +39,9 @@ def check_user_exists(email: str) -> bool:
     """
     Checks if a user with the given email already exists in Firebase Auth.
     """
+    from firebase_admin import auth
     try:
+        get_firebase_app()
         auth.get_user_by_email(email)
         return True
     except auth.UserNotFoundError:
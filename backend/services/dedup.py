@@ -0,0 +1,142 @@
+
+import os
+import time
+import hashlib
+import datetime
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from services.gcs import get_firestore_client, FIRESTORE_COLLECTION
+
+# Digest-keyed memory of earlier uploads, so re-uploading the same file
+# neither stores another object nor pays for another vision call.
+#
+#   {DIGEST_COLLECTION}/{sha256}  { "tags": [..], "expires_at": ts, "blobs": {owner_hash: blob_name} }
+#
+# Tags are reused for anyone uploading identical bytes; a stored blob is only
+# reused for the same owner (user id, or guest IP) so deleting one user's image
+# never breaks another user's. Configure a Firestore TTL policy on expires_at to
+# have stale entries removed server-side; reads ignore them either way.
+DIGEST_COLLECTION = os.getenv("DIGEST_COLLECTION", f"{FIRESTORE_COLLECTION}_digests")
+DIGEST_CACHE_TTL_SECONDS = int(os.getenv("DIGEST_CACHE_TTL_SECONDS", 30 * 24 * 3600))
+DIGEST_CACHE_MAX_ENTRIES = int(os.getenv("DIGEST_CACHE_MAX_ENTRIES", 10000))
+HASH_CHUNK_BYTES = 1024 * 1024
+
+
+@dataclass
+class DigestEntry:
+    tags: list = None
+    blobs: dict = field(default_factory=dict)  # owner_hash -> blob_name
+    expires_at: float = 0
+
+    def blob_for(self, owner: str):
+        return self.blobs.get(owner_hash(owner))
+
+
+def owner_hash(owner: str) -> str:
+    # Owner keys (e.g. "guest:1.2.3.4") aren't valid Firestore field names
+    return hashlib.sha1(owner.encode("utf-8")).hexdigest()[:16]
+
+
+async def sha256_upload(file) -> str:
+    """Hash an UploadFile in chunks from its spool, leaving it rewound."""
+    digest = hashlib.sha256()
+    await file.seek(0)
+    while True:
+        chunk = await file.read(HASH_CHUNK_BYTES)
+        if not chunk:
+            break
+        digest.update(chunk)
+    await file.seek(0)
+    return digest.hexdigest()
+
+
+class DigestCache:
+    """In-process TTL/LRU layer over the Firestore digest collection."""
+
+    def __init__(self, max_entries: int = DIGEST_CACHE_MAX_ENTRIES, ttl: int = DIGEST_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _collection(self):
+        return get_firestore_client().collection(DIGEST_COLLECTION)
+
+    def _get_local(self, digest: str):
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return None
+            if entry.expires_at <= time.time():
+                del self._entries[digest]
+                return None
+            self._entries.move_to_end(digest)
+            return entry
+
+    def _put_local(self, digest: str, entry: DigestEntry):
+        with self._lock:
+            self._entries[digest] = entry
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def lookup(self, digest: str):
+        """Known entry for this content, or None."""
+        entry = self._get_local(digest)
+        if entry is not None:
+            return entry
+
+        doc = self._collection().document(digest).get()
+        if not doc.exists:
+            return None
+        data = doc.to_dict()
+        expires_at = data.get("expires_at")
+        if expires_at is None or expires_at.timestamp() <= time.time():
+            return None
+        entry = DigestEntry(tags=data.get("tags"), blobs=data.get("blobs", {}), expires_at=expires_at.timestamp())
+        self._put_local(digest, entry)
+        return entry
+
+    def remember(self, digest: str, tags: list = None, owner: str = None, blob_name: str = None):
+        """Record successful vision tags and/or the blob stored for an owner."""
+        expires_at = time.time() + self.ttl
+        data = {"expires_at": datetime.datetime.fromtimestamp(expires_at, datetime.timezone.utc)}
+        if tags:
+            data["tags"] = tags
+        if owner and blob_name:
+            data["blobs"] = {owner_hash(owner): blob_name}
+        self._collection().document(digest).set(data, merge=True)
+
+        with self._lock:
+            entry = self._entries.pop(digest, None) or DigestEntry()
+        if owner and blob_name:
+            entry.blobs = {**entry.blobs, owner_hash(owner): blob_name}
+        entry.tags = tags or entry.tags
+        entry.expires_at = expires_at
+        self._put_local(digest, entry)
+
+    def clear(self):
+        """Drop the in-process layer only."""
+        with self._lock:
+            self._entries.clear()
+
+    def forget_blob(self, digest: str, owner: str):
+        """Called when the owner's blob is deleted; cached tags stay valid."""
+        from google.cloud import firestore
+        key = owner_hash(owner)
+        try:
+            self._collection().document(digest).update({f"blobs.{key}": firestore.DELETE_FIELD})
+        except Exception as e:
+            print(f"Digest Update Error: {e}")
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None:
+                entry.blobs = {k: v for k, v in entry.blobs.items() if k != key}
+
+
+digest_cache = DigestCache()
+
+
+def upload_owner(user_id: str = None, ip: str = None) -> str:
+    return user_id if user_id else f"guest:{ip}"
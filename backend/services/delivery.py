@@ -0,0 +1,189 @@
+
+import os
+import queue
+import threading
+from email.utils import format_datetime, parsedate_to_datetime
+
+# Fallback when the blob itself has no Cache-Control metadata.
+# Images belong to one user and can be deleted, so only the browser may keep
+# them, and only briefly.
+IMAGE_CACHE_CONTROL = os.getenv("IMAGE_CACHE_CONTROL", "private, max-age=300")
+# Bytes handed to the response per yield, and how many of those may queue up
+# ahead of a slow client before the GCS download is paused.
+STREAM_CHUNK_BYTES = int(os.getenv("IMAGE_STREAM_CHUNK_BYTES", 256 * 1024))
+STREAM_QUEUE_CHUNKS = int(os.getenv("IMAGE_STREAM_QUEUE_CHUNKS", 4))
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def blob_etag(blob) -> str:
+    return f'"{blob.etag}"' if blob.etag else None
+
+
+def blob_headers(blob) -> dict:
+    """Validator/caching headers derived from blob metadata (no body download needed)."""
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Cache-Control": blob.cache_control or IMAGE_CACHE_CONTROL,
+    }
+    etag = blob_etag(blob)
+    if etag:
+        headers["ETag"] = etag
+    if blob.updated:
+        headers["Last-Modified"] = format_datetime(blob.updated, usegmt=True)
+    return headers
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if not etag:
+        return False
+    if header.strip() == "*":
+        return True
+    # Weak comparison, as RFC 9110 requires for If-None-Match
+    strip_weak = lambda t: t.strip()[2:] if t.strip().startswith("W/") else t.strip()
+    return any(strip_weak(t) == etag for t in header.split(","))
+
+
+def is_not_modified(request_headers, blob) -> bool:
+    """Evaluate If-None-Match / If-Modified-Since against blob metadata."""
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-None-Match takes precedence; If-Modified-Since is then ignored
+        return _etag_matches(if_none_match, blob_etag(blob))
+
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since and blob.updated:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        # HTTP dates have second precision
+        return blob.updated.replace(microsecond=0) <= since
+    return False
+
+
+def parse_range(request_headers, blob):
+    """
+    Returns (start, end) inclusive for a satisfiable single `bytes=` range,
+    or None to serve the whole object. Raises RangeNotSatisfiable.
+    Multi-range requests are answered with the full object (allowed by RFC 9110).
+    """
+    header = request_headers.get("range")
+    size = blob.size
+    if not header or size is None:
+        return None
+
+    if_range = request_headers.get("if-range")
+    if if_range and if_range.strip() != blob_etag(blob):
+        return None
+
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+
+    first, _, last = spec.strip().partition("-")
+    try:
+        if first == "":
+            # Suffix range: the last N bytes
+            length = int(last)
+            if length <= 0:
+                raise RangeNotSatisfiable()
+            start, end = max(size - length, 0), size - 1
+        else:
+            start = int(first)
+            end = int(last) if last else size - 1
+    except ValueError:
+        return None
+
+    if start >= size or start > end:
+        raise RangeNotSatisfiable()
+    return start, min(end, size - 1)
+
+
+class _QueueWriter:
+    """File-like sink for blob.download_to_file that hands coalesced chunks to a queue."""
+
+    def __init__(self, chunks: queue.Queue, cancelled: threading.Event):
+        self._chunks = chunks
+        self._cancelled = cancelled
+        self._buffer = bytearray()
+
+    def write(self, data) -> int:
+        self._buffer += data
+        if len(self._buffer) >= STREAM_CHUNK_BYTES:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if not self._buffer:
+            return
+        chunk = bytes(self._buffer)
+        self._buffer.clear()
+        while True:
+            if self._cancelled.is_set():
+                # Aborts the download when the client has gone away
+                raise IOError("Image stream cancelled")
+            try:
+                self._chunks.put(chunk, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+
+_DONE = object()
+
+
+class BlobStream:
+    """
+    A single GET streamed by a background thread into a small bounded queue,
+    started as soon as this is created. Memory stays at a few chunks
+    regardless of object size, and a slow reader applies backpressure to the
+    download. Iterate for the chunks; close() (or leaving the loop) aborts it.
+    """
+
+    def __init__(self, blob, start: int = None, end: int = None):
+        self._chunks = queue.Queue(maxsize=STREAM_QUEUE_CHUNKS)
+        self._cancelled = threading.Event()
+        threading.Thread(target=self._download, args=(blob, start, end), daemon=True).start()
+
+    def _download(self, blob, start, end):
+        writer = _QueueWriter(self._chunks, self._cancelled)
+        try:
+            # Ranged downloads can't be checksummed against the whole-object hash
+            checksum = None if start is not None else "md5"
+            blob.download_to_file(writer, start=start, end=end, checksum=checksum)
+            writer.flush()
+            result = _DONE
+        except Exception as e:
+            result = e
+        while not self._cancelled.is_set():
+            try:
+                self._chunks.put(result, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def __iter__(self):
+        try:
+            while True:
+                item = self._chunks.get()
+                if item is _DONE:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self.close()
+
+    def close(self):
+        self._cancelled.set()
+
+
+def iter_blob(blob, start: int = None, end: int = None):
+    """
+    Yield the blob (or the inclusive byte range start..end) as it arrives from
+    GCS (see BlobStream). The download starts on the first iteration.
+    """
+    yield from BlobStream(blob, start, end)
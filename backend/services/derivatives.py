@@ -0,0 +1,124 @@
+
+import io
+import os
+import re
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+# Downscaled copies stored next to each original:
+#   images/{id}.{ext}  ->  images/{id}.w{width}.{DERIVATIVE_FORMAT}
+DERIVATIVE_WIDTHS = tuple(sorted(int(w) for w in os.getenv("IMAGE_DERIVATIVE_WIDTHS", "256,768,1600").split(",")))
+DERIVATIVE_FORMAT = os.getenv("IMAGE_DERIVATIVE_FORMAT", "webp").lower()  # webp | jpeg
+DERIVATIVE_QUALITY = int(os.getenv("IMAGE_DERIVATIVE_QUALITY", 80))
+# Width the gallery grid asks for by default
+THUMBNAIL_WIDTH = int(os.getenv("IMAGE_THUMBNAIL_WIDTH", 768))
+
+_EXTENSIONS = {"webp": "webp", "jpeg": "jpg"}
+_CONTENT_TYPES = {"webp": "image/webp", "jpeg": "image/jpeg"}
+_DERIVATIVE_NAME = re.compile(r"\.w\d+\.(?:webp|jpg)$")
+
+
+def nearest_width(requested: int) -> int:
+    """Smallest derivative at least as wide as requested (the largest if none is)."""
+    for width in DERIVATIVE_WIDTHS:
+        if width >= requested:
+            return width
+    return DERIVATIVE_WIDTHS[-1]
+
+
+def derivative_blob_name(blob_name: str, width: int) -> str:
+    stem = blob_name.rsplit(".", 1)[0]
+    return f"{stem}.w{width}.{_EXTENSIONS[DERIVATIVE_FORMAT]}"
+
+
+def is_derivative(blob_name: str) -> bool:
+    """Derivatives are never resized again (that would chain names without end)."""
+    return bool(_DERIVATIVE_NAME.search(blob_name))
+
+
+def _open_image(source, max_width: int) -> "Image.Image":
+    from PIL import Image, ImageOps
+    image = Image.open(io.BytesIO(source) if isinstance(source, bytes) else source)
+    # Let the JPEG decoder downscale by 1/2..1/8 while decoding; much cheaper than a full decode
+    image.draft("RGB", (max_width, max_width))
+    image = ImageOps.exif_transpose(image)
+    if DERIVATIVE_FORMAT == "jpeg":
+        image = image.convert("RGB")
+    elif image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if image.mode in ("P", "PA", "LA") else "RGB")
+    return image
+
+
+def _resize(image: "Image.Image", width: int) -> "Image.Image":
+    from PIL import Image
+    if image.width <= width:
+        return image  # never upscale
+    height = max(1, round(image.height * width / image.width))
+    return image.resize((width, height), Image.LANCZOS)
+
+
+def _encode(image: "Image.Image") -> bytes:
+    out = io.BytesIO()
+    # Re-encoding without exif= also strips metadata (GPS etc.) from derivatives
+    image.save(out, format=DERIVATIVE_FORMAT.upper(), quality=DERIVATIVE_QUALITY)
+    return out.getvalue()
+
+
+def render_derivatives(source, widths=DERIVATIVE_WIDTHS) -> dict:
+    """
+    Decode once and return {width: encoded bytes}, resizing largest to smallest.
+    source is the image bytes or a seekable binary file.
+    """
+    image = _open_image(source, max(widths))
+    rendered = {}
+    for width in sorted(widths, reverse=True):
+        image = _resize(image, width)
+        rendered[width] = _encode(image)
+    return rendered
+
+
+def _store(bucket, blob_name: str, width: int, data: bytes):
+    """Upload a derivative unless one already exists. Returns (blob, created)."""
+    from google.api_core.exceptions import PreconditionFailed
+    blob = bucket.blob(derivative_blob_name(blob_name, width))
+    try:
+        # Create-only: derivatives are immutable once written, which keeps cached copies valid
+        blob.upload_from_string(data, content_type=_CONTENT_TYPES[DERIVATIVE_FORMAT], if_generation_match=0)
+    except PreconditionFailed:
+        return bucket.get_blob(blob.name), False
+    return blob, True
+
+
+def generate_derivatives(bucket, blob_name: str, source):
+    """Upload-path hook: store every configured size. Never raises."""
+    try:
+        for width, data in render_derivatives(source).items():
+            _store(bucket, blob_name, width, data)
+    except Exception as e:
+        print(f"Derivative Error ({blob_name}): {e}")
+
+
+def create_derivative(bucket, blob_name: str, width: int):
+    """
+    Lazily build one size for an image uploaded before derivatives existed.
+    Returns (blob, content), or None if the original is missing or isn't a decodable image.
+    content is None when a concurrent request stored the size first.
+    """
+    if is_derivative(blob_name):
+        return None
+    original = bucket.get_blob(blob_name)
+    if original is None:
+        return None
+    try:
+        data = render_derivatives(original.download_as_bytes(), widths=(width,))[width]
+    except Exception as e:
+        print(f"Derivative Error ({blob_name}): {e}")
+        return None
+    blob, created = _store(bucket, blob_name, width, data)
+    return blob, data if created else None
+
+
+def derivative_blob_names(blob_name: str) -> list:
+    return [derivative_blob_name(blob_name, width) for width in DERIVATIVE_WIDTHS]
@@ -0,0 +1,138 @@
+
+import os
+import random
+import threading
+from dataclasses import dataclass
+from services.job_queue import InMemoryJobQueue
+
+# Outgoing email is sent by a few background threads, so the request that
+# triggers a message only enqueues it. The threads share one SendGrid client;
+# failed sends are retried with backoff unless SendGrid rejected the message
+# itself (4xx other than 429). Messages are process-local and lost on restart.
+SENDGRID_API_KEY = os.getenv("SENDGRID_API_KEY")
+FROM_EMAIL = os.getenv("SENDGRID_FROM_EMAIL", "test@example.com")
+EMAIL_WORKERS = int(os.getenv("EMAIL_WORKERS", 4))
+EMAIL_QUEUE_MAX = int(os.getenv("EMAIL_QUEUE_MAX", 1000))
+EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", 4))
+EMAIL_BACKOFF_SECONDS = float(os.getenv("EMAIL_BACKOFF_SECONDS", 1))
+EMAIL_SEND_TIMEOUT_SECONDS = float(os.getenv("EMAIL_SEND_TIMEOUT_SECONDS", 10))
+
+
+@dataclass
+class EmailMessage:
+    to: str
+    subject: str
+    html: str
+    attempts: int = 0
+
+
+_sendgrid_client = None
+_sendgrid_lock = threading.Lock()
+
+
+def get_sendgrid_client():
+    """Shared SendGridAPIClient; each send builds its own request objects, so threads can share it."""
+    global _sendgrid_client
+    if _sendgrid_client is None:
+        with _sendgrid_lock:
+            if _sendgrid_client is None:
+                # Deferred: only the signup path needs SendGrid
+                from sendgrid import SendGridAPIClient
+                client = SendGridAPIClient(SENDGRID_API_KEY)
+                client.client.timeout = EMAIL_SEND_TIMEOUT_SECONDS
+                _sendgrid_client = client
+    return _sendgrid_client
+
+
+def send_with_sendgrid(message: EmailMessage):
+    """One delivery attempt. Raises on failure."""
+    from sendgrid.helpers.mail import Mail
+
+    mail = Mail(from_email=FROM_EMAIL, to_emails=message.to, subject=message.subject, html_content=message.html)
+    get_sendgrid_client().send(mail)
+
+
+def is_permanent(error: Exception) -> bool:
+    """SendGrid refused the message itself; sending it again won't help."""
+    status = getattr(error, "status_code", None)
+    return isinstance(status, int) and 400 <= status < 500 and status != 429
+
+
+class EmailDispatcher:
+    """Fixed number of threads sending queued messages with bounded retries."""
+
+    def __init__(self, workers: int = EMAIL_WORKERS, max_queue: int = EMAIL_QUEUE_MAX,
+                 max_attempts: int = EMAIL_MAX_ATTEMPTS, sender=send_with_sendgrid):
+        self.queue = InMemoryJobQueue()
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_attempts = max_attempts
+        self.sender = sender
+        self._stop = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.rejected = 0  # queue full
+
+    def start(self):
+        if self._threads:
+            return
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"email-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 5):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, message: EmailMessage) -> bool:
+        """Queue a message; False (nothing queued) if the backlog is full."""
+        if self.queue.size() >= self.max_queue:
+            with self._lock:
+                self.rejected += 1
+            return False
+        self.queue.enqueue(message)
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            message = self.queue.dequeue(timeout=1)
+            if message is not None:
+                self.process(message)
+
+    def process(self, message: EmailMessage):
+        try:
+            self.sender(message)
+        except Exception as e:
+            message.attempts += 1
+            if message.attempts >= self.max_attempts or is_permanent(e):
+                print(f"Email to {message.to} failed after {message.attempts} attempts: {e}")
+                with self._lock:
+                    self.failed += 1
+            else:
+                with self._lock:
+                    self.retried += 1
+                delay = EMAIL_BACKOFF_SECONDS * 2 ** (message.attempts - 1)
+                self.queue.retry(message, random.uniform(delay / 2, delay))
+            return
+        with self._lock:
+            self.sent += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "queued": self.queue.size(),
+                "sent": self.sent,
+                "failed": self.failed,
+                "retried": self.retried,
+                "rejected": self.rejected,
+            }
+
+
+email_dispatcher = EmailDispatcher()
@@ -0,0 +1,24 @@
+
+import os
+import asyncio
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+# Blocking SDK calls (Firestore, GCS, OpenAI) must not run on the event loop.
+# Vision calls take seconds, so they get their own pool: a burst of uploads
+# can't exhaust the threads that quick Firestore/GCS calls need.
+BLOCKING_IO_WORKERS = int(os.getenv("BLOCKING_IO_WORKERS", 32))
+VISION_WORKERS = int(os.getenv("VISION_WORKERS", 8))
+
+io_executor = ThreadPoolExecutor(max_workers=BLOCKING_IO_WORKERS, thread_name_prefix="blocking-io")
+vision_executor = ThreadPoolExecutor(max_workers=VISION_WORKERS, thread_name_prefix="vision")
+
+
+async def run_blocking(func, *args, executor=io_executor, **kwargs):
+    """Await a blocking call on a bounded thread pool, in a copy of the caller's context."""
+    loop = asyncio.get_running_loop()
+    # Unlike asyncio.to_thread, run_in_executor doesn't carry contextvars over
+    # (the per-request timings in services.metrics rely on them)
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(executor, functools.partial(context.run, func, *args, **kwargs))
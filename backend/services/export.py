@@ -0,0 +1,188 @@
+
+import os
+import re
+import json
+import secrets
+import zipfile
+import datetime
+import tempfile
+from collections import deque
+from services.gcs import get_bucket, get_firestore_client, get_firestore_collection, FIRESTORE_COLLECTION, transactional
+from services.delivery import BlobStream
+from services.image_info import IMAGE_INFO_FIELDS
+
+# GET /images/export: a ZIP of all of a user's originals plus a tags.json
+# manifest, built while it is sent. Entries are stored, not deflated (the
+# images are compressed already), and written with data descriptors, so the
+# archive never has to be seeked or held anywhere. Memory per export is about
+# EXPORT_PREFETCH blob streams of STREAM_QUEUE_CHUNKS chunks each, whatever
+# the gallery size; the manifest is spooled to disk once it outgrows
+# EXPORT_MANIFEST_SPOOL_BYTES.
+EXPORT_PREFETCH = int(os.getenv("EXPORT_PREFETCH", 4))
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", 200))
+EXPORT_MANIFEST_SPOOL_BYTES = int(os.getenv("EXPORT_MANIFEST_SPOOL_BYTES", 1024 * 1024))
+# Browsers can't send the Authorization header on a plain navigation, so the
+# app asks for a one-time link first and lets the browser stream the
+# download to disk: {EXPORT_LINK_COLLECTION}/{token} { "user_id", "expires_at" }
+# Redeeming a link deletes it; links that are never redeemed are removed by
+# a Firestore TTL policy on expires_at (setup_gcp.sh creates it). TTL
+# deletion can lag by a day or so, so redeem_export_token still checks
+# expires_at itself.
+EXPORT_LINK_TTL_SECONDS = int(os.getenv("EXPORT_LINK_TTL_SECONDS", 60))
+EXPORT_LINK_COLLECTION = os.getenv("EXPORT_LINK_COLLECTION", f"{FIRESTORE_COLLECTION}_export_links")
+
+EXPORT_FIELDS = ["filename", "blob_name", "tags", "created_at"] + IMAGE_INFO_FIELDS
+MANIFEST_NAME = "tags.json"
+
+
+class _ZipSink:
+    """Unseekable file for zipfile; the generator drains what was written after every step."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def write(self, data) -> int:
+        self._buffer += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+def _iter_docs(user_id: str, page_size: int = EXPORT_PAGE_SIZE):
+    """The user's image docs, newest first, a page per query so no stream stays open for the whole export."""
+    from google.cloud import firestore
+    query = (
+        get_firestore_collection()
+        .where("user_id", "==", user_id)
+        .order_by("created_at", direction=firestore.Query.DESCENDING)
+        .order_by("__name__", direction=firestore.Query.DESCENDING)
+        .select(EXPORT_FIELDS)
+    )
+    position = None
+    while True:
+        page = query.start_after(position) if position else query
+        docs = list(page.limit(page_size).stream())
+        yield from docs
+        if len(docs) < page_size:
+            return
+        last = docs[-1]
+        position = {"created_at": last.get("created_at"), "__name__": last.id}
+
+
+def create_export_token(user_id: str) -> str:
+    """A random token that redeem_export_token turns into user_id once, within EXPORT_LINK_TTL_SECONDS."""
+    token = secrets.token_urlsafe(32)
+    expires_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=EXPORT_LINK_TTL_SECONDS)
+    get_firestore_client().collection(EXPORT_LINK_COLLECTION).document(token).set({"user_id": user_id, "expires_at": expires_at})
+    return token
+
+
+@transactional
+def _consume_token(transaction, doc_ref):
+    doc = doc_ref.get(transaction=transaction)
+    if not doc.exists:
+        return None
+    transaction.delete(doc_ref)
+    data = doc.to_dict()
+    if datetime.datetime.now(datetime.timezone.utc) > data["expires_at"]:
+        return None
+    return data["user_id"]
+
+
+def redeem_export_token(token: str):
+    """The user an export token was issued to, or None if it is unknown, used or expired."""
+    db = get_firestore_client()
+    return _consume_token(db.transaction(), db.collection(EXPORT_LINK_COLLECTION).document(token))
+
+
+def archive_name(image_id: str, filename: str) -> str:
+    """Path of an image inside the archive: unique, and safe to extract anywhere."""
+    safe = re.sub(r"[^\w.\- ]+", "_", os.path.basename(filename or "")).strip(" .") or "image"
+    return f"images/{image_id}_{safe}"
+
+
+def _manifest_entry(doc, data: dict, path: str) -> dict:
+    entry = {"id": doc.id, "file": path, "filename": data.get("filename"), "tags": data.get("tags", [])}
+    if data.get("created_at") is not None:
+        entry["created_at"] = data["created_at"].isoformat()
+    for field in IMAGE_INFO_FIELDS:
+        if field in data:
+            entry[field] = data[field]
+    return entry
+
+
+def iter_export(user_id: str, prefetch: int = EXPORT_PREFETCH, page_size: int = EXPORT_PAGE_SIZE):
+    """
+    Yield the export ZIP for a user. Blobs are downloaded `prefetch` at a
+    time ahead of the one being written; images whose blob is gone are
+    listed in the manifest with "file": null.
+    """
+    bucket = get_bucket()
+    sink = _ZipSink()
+    pending = deque()  # (doc, BlobStream), started in archive order
+    current = None
+    docs = _iter_docs(user_id, page_size)
+
+    def fill():
+        while len(pending) < prefetch:
+            doc = next(docs, None)
+            if doc is None:
+                return
+            blob_name = doc.get("blob_name")
+            pending.append((doc, BlobStream(bucket.blob(blob_name)) if blob_name else None))
+
+    with tempfile.SpooledTemporaryFile(max_size=EXPORT_MANIFEST_SPOOL_BYTES, mode="w+t", encoding="utf-8") as manifest:
+        try:
+            with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED) as archive:
+                count = 0
+                fill()
+                while pending:
+                    doc, current = pending.popleft()
+                    stream = current
+                    fill()
+                    data = doc.to_dict()
+                    path = archive_name(doc.id, data.get("filename")) if stream else None
+
+                    if stream is not None:
+                        chunks = iter(stream)
+                        try:
+                            # Nothing is written for a blob that no longer exists
+                            first = next(chunks, b"")
+                        except Exception as e:
+                            print(f"Export Error ({data.get('blob_name')}): {e}")
+                            path = None
+                        if path:
+                            with archive.open(path, "w") as entry:
+                                entry.write(first)
+                                yield sink.drain()
+                                for chunk in chunks:
+                                    entry.write(chunk)
+                                    yield sink.drain()
+                        current = None
+
+                    manifest.write(("[\n" if count == 0 else ",\n") + json.dumps(_manifest_entry(doc, data, path)))
+                    count += 1
+
+                manifest.write("[\n" if count == 0 else "\n")
+                manifest.write("]\n")
+                manifest.seek(0)
+                with archive.open(MANIFEST_NAME, "w") as entry:
+                    while True:
+                        text = manifest.read(64 * 1024)
+                        if not text:
+                            break
+                        entry.write(text.encode("utf-8"))
+                        yield sink.drain()
+            # Central directory
+            yield sink.drain()
+        finally:
+            # Client went away (or an error): stop the downloads still running
+            for stream in [current] + [stream for _, stream in pending]:
+                if stream is not None:
+                    stream.close()
@@ -0,0 +1,22 @@
+
+import threading
+
+_lock = threading.Lock()
+
+def get_firebase_app():
+    """
+    The default Firebase Admin app, initialized on first use rather than at
+    import so it stays out of the cold start. Returns None if it can't be
+    initialized (retried next time); firebase_admin calls then raise.
+    """
+    import firebase_admin
+    if firebase_admin._apps:
+        return firebase_admin.get_app()
+    with _lock:
+        if not firebase_admin._apps:
+            try:
+                firebase_admin.initialize_app()
+            except Exception as e:
+                print(f"Warning: Firebase Admin failed to initialize: {e}")
+                return None
+        return firebase_admin.get_app()
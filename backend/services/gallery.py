@@ -1,5 +1,22 @@
-from google.cloud import firestore
-from services.gcs import get_firestore_collection
+import json
+import base64
+from services.gcs import get_firestore_collection, get_firestore_client, get_bucket
+from services.tag_index import index_state, set_index_ready, index_images, remove_image_tags, load_tag_matrix
+from services.tag_search import TagMatrix
+from services.similarity import similarity_indexes, SIMILAR_MAX_DISTANCE, FINGERPRINT_FIELDS
+from services.image_info import IMAGE_INFO_FIELDS
+from services.image_cache import image_cache
+from services.dedup import digest_cache
+from services.derivatives import derivative_blob_names, THUMBNAIL_WIDTH
+from services.listing_cache import listing_cache
+from services.stats import record_delete
+from services.signed_urls import signed_urls, IMAGE_DELIVERY_MODE
+from services.metrics import span
+from services.executor import io_executor
+
+# What the gallery grid needs, including what it lays out with before images
+# load; listings read only these fields
+LISTING_FIELDS = ["id", "filename", "blob_name", "url", "tags", "tag_status", "created_at"] + IMAGE_INFO_FIELDS
 
 def construct_proxy_url(data: dict) -> dict:
     """Helper to reconstruct the proxy URL from blob_name or existing url"""
@@ -12,40 +29,264 @@ def construct_proxy_url(data: dict) -> dict:
                 data["url"] = f"/images/{filename}"
             except:
                 pass
+    if data.get("url", "").startswith("/images/"):
+        data["thumbnail_url"] = f"{data['url']}?w={THUMBNAIL_WIDTH}"
     return data
 
-def get_recent_images_for_user(user_id: str, limit: int = 20) -> list:
+def sign_listing_urls(image_list: list) -> list:
+    """
+    In "signed" delivery mode, point each item's url at a signed URL of the
+    original. Originals always exist; thumbnails may not yet, so those keep
+    going through /images/{filename}, which redirects once they do. A page's
+    missing signatures are made concurrently (each is an IAM call on Cloud Run).
+    """
+    if IMAGE_DELIVERY_MODE != "signed":
+        return image_list
+    blob_names = {
+        item["url"]: f"images/{item['url'].split('/')[-1]}"
+        for item in image_list if item.get("url", "").startswith("/images/")
+    }
+    with span("listing", "sign_url"):
+        signed = signed_urls.urls(blob_names.values(), executor=io_executor)
+    for item in image_list:
+        url = signed.get(blob_names.get(item.get("url")))
+        if url is not None:
+            item["url"] = url
+    return image_list
+
+def encode_cursor(position: dict) -> str:
+    """Opaque page token for a query position."""
+    raw = json.dumps(position, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> dict:
+    """Inverse of encode_cursor. Raises ValueError for tokens we didn't issue."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        position = json.loads(raw)
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(position, dict):
+        raise ValueError("Invalid cursor")
+    return position
+
+def _listing_item(doc) -> dict:
+    data = doc.to_dict()
+    data.setdefault("id", doc.id)
+    return construct_proxy_url(data)
+
+def get_recent_images_for_user(user_id: str, limit: int = 20, cursor: str = None):
     """
-    Fetch recent images for a specific user from Firestore.
+    Fetch a page of the user's images from Firestore, newest first.
+    Returns (images, next_cursor); next_cursor is None on the last page.
     """
+    from google.cloud import firestore
+    from google.api_core.datetime_helpers import DatetimeWithNanoseconds
     # Firestore requires a composite index for equality filter + inequality sort (where user_id == X AND order_by created_at)
-    query = get_firestore_collection().where("user_id", "==", user_id).order_by("created_at", direction=firestore.Query.DESCENDING).limit(limit)
-    
-    results = query.stream()
-    
-    image_list = []
-    for doc in results:
+    # Ordering by document id as well makes the cursor exact when created_at ties;
+    # it uses the same index, as Firestore appends __name__ in the last sort direction.
+    query = (
+        get_firestore_collection()
+        .where("user_id", "==", user_id)
+        .order_by("created_at", direction=firestore.Query.DESCENDING)
+        .order_by("__name__", direction=firestore.Query.DESCENDING)  # document id
+        .select(LISTING_FIELDS)
+    )
+    if cursor:
+        position = decode_cursor(cursor)
+        try:
+            created_at = DatetimeWithNanoseconds.from_rfc3339(position["created_at"])
+            query = query.start_after({"created_at": created_at, "__name__": position["id"]})
+        except (KeyError, TypeError, ValueError):
+            raise ValueError("Invalid cursor")
+
+    # One extra doc tells us whether there is another page
+    with span("recent_images", "firestore_query", backend="firestore"):
+        docs = list(query.limit(limit + 1).stream())
+    image_list = sign_listing_urls([_listing_item(doc) for doc in docs[:limit]])
+
+    next_cursor = None
+    if len(docs) > limit:
+        last = docs[limit - 1]
+        next_cursor = encode_cursor({"created_at": last.get("created_at").rfc3339(), "id": last.id})
+    return image_list, next_cursor
+
+def _page_offset(cursor: str = None) -> int:
+    """Rank offset a search cursor points at."""
+    if not cursor:
+        return 0
+    offset = decode_cursor(cursor).get("offset")
+    if not isinstance(offset, int) or isinstance(offset, bool) or offset < 0:
+        raise ValueError("Invalid cursor")
+    return offset
+
+def _next_page_cursor(offset: int, limit: int, has_more: bool):
+    return encode_cursor({"offset": offset + limit}) if has_more else None
+
+def search_images_for_user(user_id: str, tag: str, limit: int = 50, cursor: str = None):
+    """
+    Ranked search of a user's images by tags. Every word of the query counts
+    and may match a tag word partially or with a typo (see services.tag_search).
+    Results are best match first. Returns (images, next_cursor).
+    """
+    offset = _page_offset(cursor)
+    ready, version = index_state(user_id)
+    if not ready:
+        return _search_and_build_index(user_id, tag, limit, offset)
+
+    with span("search", "rank"):
+        matrix = load_tag_matrix(user_id, version)
+        ranked, has_more = matrix.search(tag, limit, offset)
+    if not ranked:
+        return [], None
+
+    collection = get_firestore_collection()
+    refs = [collection.document(image_id) for image_id, _ in ranked]
+    with span("search", "firestore_get_all", backend="firestore"):
+        docs = list(get_firestore_client().get_all(refs, field_paths=LISTING_FIELDS + ["user_id"]))
+
+    found = {}
+    for doc in docs:
+        if not doc.exists:
+            continue
         data = doc.to_dict()
-        data = construct_proxy_url(data)
-        image_list.append(data)
+        # The matrix is per user already, but never leak another user's image
+        if data.pop("user_id", None) != user_id:
+            continue
+        data.setdefault("id", doc.id)
+        found[doc.id] = construct_proxy_url(data)
 
-    return image_list
+    # get_all doesn't keep request order
+    image_list = [found[image_id] for image_id, _ in ranked if image_id in found]
+    return sign_listing_urls(image_list), _next_page_cursor(offset, limit, has_more)
 
-def search_images_for_user(user_id: str, tag: str) -> list:
+def _search_and_build_index(user_id: str, tag: str, limit: int, offset: int = 0):
     """
-    Search images for a specific user by tag (In-memory filtering).
+    Legacy full scan, used once per user: the docs it reads anyway are used to
+    build that user's tag index so later searches go through the index.
     """
-    # Filter by user_id
-    docs = get_firestore_collection().where("user_id", "==", user_id).stream()
-    search_term = tag.lower()
-    
+    with span("search", "full_scan", backend="firestore"):
+        docs = list(get_firestore_collection().where("user_id", "==", user_id).stream())
+
+    all_data = {}
+    all_tags = {}
+    for doc in docs:
+        data = doc.to_dict()
+        all_data[doc.id] = data
+        all_tags[doc.id] = data.get("tags", [])
+
+    try:
+        index_images(user_id, all_tags)
+        set_index_ready(user_id, True)
+    except Exception as e:
+        print(f"Tag Index Build Error: {e}")
+
+    # Ranked the same way as indexed searches; the matrix itself is loaded from the index next time
+    ranked, has_more = TagMatrix.from_images(all_tags).search(tag, limit, offset)
     image_list = []
+    for image_id, _ in ranked:
+        data = {field: all_data[image_id][field] for field in LISTING_FIELDS if field in all_data[image_id]}
+        data.setdefault("id", image_id)
+        image_list.append(construct_proxy_url(data))
+    return sign_listing_urls(image_list), _next_page_cursor(offset, limit, has_more)
+
+def similar_images_for_user(user_id: str, image_id: str, limit: int = 20):
+    """
+    The user's images that look most like one of theirs, closest first, each
+    with its hash "distance" (bits of 64) and "color_similarity" (0..1).
+    Returns None if the image isn't the user's or has no fingerprint.
+    """
+    with span("similar", "index"):
+        index = similarity_indexes.get(user_id)
+        fingerprint = index.fingerprint(image_id)
+    if fingerprint is None:
+        # Not in this process's index yet, or uploaded before fingerprints existed
+        doc = get_firestore_collection().document(image_id).get(field_paths=FINGERPRINT_FIELDS + ["user_id"])
+        fingerprint = doc.to_dict() if doc.exists else {}
+        if fingerprint.get("user_id") != user_id or not fingerprint.get("phash"):
+            return None
+    with span("similar", "query"):
+        ranked = index.query(fingerprint, limit, SIMILAR_MAX_DISTANCE, exclude=image_id)
+    if not ranked:
+        return []
+
+    collection = get_firestore_collection()
+    refs = [collection.document(similar_id) for similar_id, _, _ in ranked]
+    with span("similar", "firestore_get_all", backend="firestore"):
+        docs = list(get_firestore_client().get_all(refs, field_paths=LISTING_FIELDS + ["user_id"]))
+
+    found = {}
     for doc in docs:
+        if not doc.exists:
+            continue
         data = doc.to_dict()
-        tags = [t.lower() for t in data.get("tags", [])]
-        
-        if any(search_term in t for t in tags):
-            data = construct_proxy_url(data)
-            image_list.append(data)
-            
-    return image_list
+        if data.pop("user_id", None) != user_id:
+            continue
+        data.setdefault("id", doc.id)
+        found[doc.id] = construct_proxy_url(data)
+
+    image_list = []
+    for similar_id, distance, color_similarity in ranked:
+        if similar_id in found:
+            image_list.append({**found[similar_id], "distance": distance, "color_similarity": color_similarity})
+    return sign_listing_urls(image_list)
+
+def get_image_status_for_user(user_id: str, image_id: str):
+    """
+    Tagging status of an image the caller owns (guest uploads have user_id None).
+    Returns None if it doesn't exist or belongs to someone else.
+    """
+    doc = get_firestore_collection().document(image_id).get(field_paths=["user_id", "tags", "tag_status"])
+    if not doc.exists:
+        return None
+    data = doc.to_dict()
+    if data.get("user_id") != user_id:
+        return None
+    return {
+        "id": image_id,
+        # Images uploaded before background tagging existed were always tagged inline
+        "tag_status": data.get("tag_status", "done"),
+        "tags": data.get("tags", []),
+    }
+
+def _blob_shared(blob_name: str, image_id: str) -> bool:
+    """True if another image doc references the same blob."""
+    docs = get_firestore_collection().where("blob_name", "==", blob_name).limit(2).stream()
+    return any(doc.id != image_id for doc in docs)
+
+def delete_image_for_user(user_id: str, image_id: str):
+    """
+    Delete an image (blob, metadata, index postings, cached bytes) owned by the user.
+    Returns the deleted metadata, or None if no such image belongs to the user.
+    """
+    from google.api_core.exceptions import NotFound
+    doc_ref = get_firestore_collection().document(image_id)
+    doc = doc_ref.get()
+    if not doc.exists:
+        return None
+    data = doc.to_dict()
+    if data.get("user_id") != user_id:
+        return None
+
+    blob_name = data.get("blob_name")
+    if blob_name and _blob_shared(blob_name, image_id):
+        # Deduplicated uploads point at the same blob; keep it for the others
+        blob_name = None
+    if blob_name:
+        if data.get("sha256"):
+            digest_cache.forget_blob(data["sha256"], user_id)
+        bucket = get_bucket()
+        for name in [blob_name] + derivative_blob_names(blob_name):
+            try:
+                bucket.blob(name).delete()
+            except NotFound:
+                pass
+            image_cache.invalidate(name)
+            signed_urls.forget(name)
+
+    doc_ref.delete()
+    remove_image_tags(user_id, image_id, data.get("tags", []))
+    similarity_indexes.remove(user_id, image_id)
+    record_delete(user_id, data.get("tags", []))
+    listing_cache.bump(user_id)
+    return data
@@ -1,7 +1,6 @@
-
 import os
-from google.cloud import storage
-from google.cloud import firestore
+import functools
+import threading
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -11,27 +10,63 @@ GCS_BUCKET_NAME = os.getenv("GCS_BUCKET_NAME")
 # Handle Dev/Prod isolation for Firestore
 FIRESTORE_COLLECTION = os.getenv("FIRESTORE_COLLECTION", "images")
 
-# Initialize Clients
-# Cloud Run injects credentials automatically
-try:
-    storage_client = storage.Client()
-    firestore_client = firestore.Client()
-except Exception as e:
-    print(f"Warning: Could not init GCP clients (Local dev without creds?): {e}")
-    storage_client = None
-    firestore_client = None
+# Clients are created on first use, not at import: finding credentials can
+# take seconds (metadata server lookups), which would otherwise all land in
+# the cold start before the first request. Cloud Run injects credentials automatically.
+_clients = {}
+_clients_lock = threading.Lock()
+
+def _create_storage_client():
+    from google.cloud import storage
+    return storage.Client()
+
+def _create_firestore_client():
+    from google.cloud import firestore
+    return firestore.Client()
+
+def transactional(func):
+    """
+    firestore.transactional, applied when called rather than at import so
+    modules with transactional helpers don't pull google.cloud.firestore
+    into the cold start. A fresh wrapper per call also keeps its retry state
+    per transaction.
+    """
+    @functools.wraps(func)
+    def call(transaction, *args, **kwargs):
+        from google.cloud import firestore
+        return firestore.transactional(func)(transaction, *args, **kwargs)
+    return call
+
+def _get_client(name: str, factory):
+    """Thread-safe lazy singleton. Returns None (and retries next time) if it can't be created."""
+    client = _clients.get(name)
+    if client is not None:
+        return client
+    with _clients_lock:
+        client = _clients.get(name)
+        if client is None:
+            try:
+                client = factory()
+            except Exception as e:
+                print(f"Warning: Could not init {name} client (Local dev without creds?): {e}")
+                return None
+            _clients[name] = client
+    return client
+
+def get_storage_client():
+    return _get_client("storage", _create_storage_client)
 
 def get_bucket():
+    storage_client = get_storage_client()
     if not storage_client or not GCS_BUCKET_NAME:
         raise Exception("GCS Client or Bucket Name not configured")
     return storage_client.bucket(GCS_BUCKET_NAME)
 
 def get_firestore_collection():
-    if not firestore_client:
-         raise Exception("Firestore Client not configured")
-    return firestore_client.collection(FIRESTORE_COLLECTION)
+    return get_firestore_client().collection(FIRESTORE_COLLECTION)
 
 def get_firestore_client():
+    firestore_client = _get_client("firestore", _create_firestore_client)
     if not firestore_client:
          raise Exception("Firestore Client not configured")
     return firestore_client
@@ -0,0 +1,145 @@
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+# Byte budget for the in-process hot image cache (0 disables it), and the
+# largest single object worth caching; bigger objects are always streamed.
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+IMAGE_CACHE_MAX_ITEM_BYTES = int(os.getenv("IMAGE_CACHE_MAX_ITEM_BYTES", 4 * 1024 * 1024))
+# Blobs can be deleted through another instance, so an entry not checked
+# against GCS for this long is revalidated (a metadata call, no download)
+# before it is served again.
+IMAGE_CACHE_REVALIDATE_SECONDS = float(os.getenv("IMAGE_CACHE_REVALIDATE_SECONDS", 30))
+
+
+@dataclass
+class CachedImage:
+    """Object content plus the blob metadata needed to answer a request (see services.delivery)."""
+    name: str
+    generation: int
+    content: bytes
+    content_type: str
+    etag: str
+    updated: object
+    cache_control: str
+    checked_at: float = 0.0  # time.monotonic() of the last GCS check
+
+    @property
+    def size(self) -> int:
+        return len(self.content)
+
+    @classmethod
+    def from_blob(cls, blob, content: bytes) -> "CachedImage":
+        return cls(
+            name=blob.name,
+            generation=blob.generation,
+            content=content,
+            content_type=blob.content_type,
+            etag=blob.etag,
+            updated=blob.updated,
+            cache_control=blob.cache_control,
+        )
+
+
+class ImageCache:
+    """
+    Byte-budgeted LRU keyed by (blob_name, generation).
+
+    Image blobs are written once under random names, so the newest cached
+    generation of a name is served without asking GCS for up to `max_age`
+    seconds after it was last checked; `invalidate` must be called whenever
+    a blob is deleted or overwritten.
+    """
+
+    def __init__(self, max_bytes: int, max_item_bytes: int, max_age: float = IMAGE_CACHE_REVALIDATE_SECONDS):
+        self.max_bytes = max_bytes
+        self.max_item_bytes = min(max_item_bytes, max_bytes)
+        self.max_age = max_age
+        self._entries = OrderedDict()  # (name, generation) -> CachedImage
+        self._latest = {}  # name -> generation
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.revalidations = 0
+
+    def accepts(self, size) -> bool:
+        return size is not None and 0 < size <= self.max_item_bytes
+
+    def get(self, name: str, generation: int = None):
+        """
+        The newest generation of a name if it was checked within max_age, or
+        the given generation (which the caller just read from GCS).
+        """
+        now = time.monotonic()
+        with self._lock:
+            confirmed = generation is not None
+            if not confirmed:
+                generation = self._latest.get(name)
+            entry = self._entries.get((name, generation))
+            if entry is None:
+                self.misses += 1
+                return None
+            if confirmed:
+                entry.checked_at = now
+            elif now - entry.checked_at >= self.max_age:
+                self.revalidations += 1
+                return None
+            self._entries.move_to_end((name, generation))
+            self.hits += 1
+            return entry
+
+    def put(self, entry: CachedImage):
+        if not self.accepts(entry.size):
+            return
+        key = (entry.name, entry.generation)
+        entry.checked_at = time.monotonic()
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.size
+            self._entries[key] = entry
+            self._bytes += entry.size
+            if entry.generation >= self._latest.get(entry.name, entry.generation):
+                self._latest[entry.name] = entry.generation
+            while self._bytes > self.max_bytes:
+                (name, generation), evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+                self.evictions += 1
+                if self._latest.get(name) == generation:
+                    del self._latest[name]
+
+    def invalidate(self, name: str):
+        """Drop every cached generation of a blob."""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == name]:
+                self._bytes -= self._entries.pop(key).size
+                self.invalidations += 1
+            self._latest.pop(name, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._latest.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "revalidations": self.revalidations,
+                "items": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+image_cache = ImageCache(IMAGE_CACHE_MAX_BYTES, IMAGE_CACHE_MAX_ITEM_BYTES)
@@ -0,0 +1,160 @@
+
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
+from services.gcs import get_bucket, get_firestore_client, get_firestore_collection
+
+if TYPE_CHECKING:
+    from PIL import Image  # imported where used, so Pillow stays out of the cold start
+
+# What the gallery grid needs before an image arrives, stored with its metadata:
+#   { "width": 4032, "height": 3024, "orientation": "landscape", "blurhash": "LEHV6nWB2yk8..." }
+# width/height are as displayed (EXIF rotation applied). The BlurHash
+# (https://blurha.sh) is a ~30 character placeholder the client decodes
+# into a blurred preview.
+IMAGE_INFO_FIELDS = ["width", "height", "orientation", "blurhash"]
+BLURHASH_X_COMPONENTS = int(os.getenv("BLURHASH_X_COMPONENTS", 4))
+BLURHASH_Y_COMPONENTS = int(os.getenv("BLURHASH_Y_COMPONENTS", 3))
+# Decoding stops at about this size; the fingerprint and BlurHash need no more
+PREVIEW_SIZE = 64
+BLURHASH_SAMPLE_SIZE = 32
+
+# Backfill of images uploaded before these fields existed
+BACKFILL_BATCH_SIZE = int(os.getenv("IMAGE_INFO_BACKFILL_BATCH_SIZE", 100))
+BACKFILL_WORKERS = int(os.getenv("IMAGE_INFO_BACKFILL_WORKERS", 16))
+
+_ORIENTATION_TAG = 0x0112
+_BASE83 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+
+
+def open_preview(source, size: int = PREVIEW_SIZE):
+    """
+    Decode image bytes or a seekable binary file at reduced scale, upright
+    and RGB. Returns (preview, (width, height)) with the full upright size.
+    Raises if it isn't an image Pillow can decode.
+    """
+    from PIL import Image, ImageOps
+    image = Image.open(io.BytesIO(source) if isinstance(source, bytes) else source)
+    width, height = image.size
+    if image.getexif().get(_ORIENTATION_TAG) in (5, 6, 7, 8):
+        width, height = height, width  # rotated by 90 degrees
+    # Let the JPEG decoder downscale by 1/2..1/8 while decoding
+    image.draft("RGB", (size, size))
+    return ImageOps.exif_transpose(image).convert("RGB"), (width, height)
+
+
+def orientation(width: int, height: int) -> str:
+    if width > height:
+        return "landscape"
+    if height > width:
+        return "portrait"
+    return "square"
+
+
+def _base83(value: int, length: int) -> str:
+    return "".join(_BASE83[(value // 83 ** (length - i)) % 83] for i in range(1, length + 1))
+
+
+def blurhash(image: "Image.Image", x_components: int = BLURHASH_X_COMPONENTS, y_components: int = BLURHASH_Y_COMPONENTS) -> str:
+    """BlurHash of an RGB image, per the reference encoder."""
+    import numpy as np
+    from PIL import Image
+
+    scale = BLURHASH_SAMPLE_SIZE / max(image.size)
+    if scale < 1:
+        image = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))), Image.BOX)
+    srgb = np.asarray(image, dtype=np.float64) / 255
+    linear = np.where(srgb <= 0.04045, srgb / 12.92, ((srgb + 0.055) / 1.055) ** 2.4)
+    height, width = linear.shape[:2]
+
+    basis_x = np.cos(np.pi * np.arange(x_components)[:, None] * np.arange(width)[None, :] / width)
+    basis_y = np.cos(np.pi * np.arange(y_components)[:, None] * np.arange(height)[None, :] / height)
+    factors = np.einsum("jy,ix,yxc->jic", basis_y, basis_x, linear) / (width * height)
+    factors[1:] *= 2
+    factors[0, 1:] *= 2
+    factors = factors.reshape(-1, 3)  # row by row, as the format orders them
+    dc, ac = factors[0], factors[1:]
+
+    def to_srgb(value):
+        value = min(max(value, 0.0), 1.0)
+        if value <= 0.0031308:
+            return int(value * 12.92 * 255 + 0.5)
+        return int((1.055 * value ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+    encoded = _base83((x_components - 1) + (y_components - 1) * 9, 1)
+    if len(ac):
+        quantised_max = int(max(0, min(82, np.floor(np.abs(ac).max() * 166 - 0.5))))
+        max_value = (quantised_max + 1) / 166
+    else:
+        quantised_max, max_value = 0, 1
+    encoded += _base83(quantised_max, 1)
+    encoded += _base83((to_srgb(dc[0]) << 16) + (to_srgb(dc[1]) << 8) + to_srgb(dc[2]), 4)
+
+    scaled = ac / max_value
+    quantised = np.clip(np.floor(np.sign(scaled) * np.abs(scaled) ** 0.5 * 9 + 9.5), 0, 18).astype(int)
+    for r, g, b in quantised.tolist():
+        encoded += _base83(r * 19 * 19 + g * 19 + b, 2)
+    return encoded
+
+
+def describe_preview(preview: "Image.Image", size) -> dict:
+    """IMAGE_INFO_FIELDS from open_preview's result."""
+    width, height = size
+    return {"width": width, "height": height, "orientation": orientation(width, height), "blurhash": blurhash(preview)}
+
+
+def image_info(source) -> dict:
+    """IMAGE_INFO_FIELDS of image bytes or a seekable binary file. Raises if it can't be decoded."""
+    return describe_preview(*open_preview(source))
+
+
+def _describe_blob(bucket, blob_name: str):
+    try:
+        return image_info(bucket.blob(blob_name).download_as_bytes())
+    except Exception as e:
+        print(f"Image Info Backfill Error ({blob_name}): {e}")
+        return None
+
+
+def backfill_image_info(batch_size: int = BACKFILL_BATCH_SIZE, workers: int = BACKFILL_WORKERS, limit: int = None) -> dict:
+    """
+    Add IMAGE_INFO_FIELDS to image docs that lack them. Originals are
+    downloaded and decoded `workers` at a time; each batch of `batch_size`
+    docs is committed with one WriteBatch. Safe to re-run: done docs are skipped.
+    Returns {"updated", "failed", "users"}.
+    """
+    from services.listing_cache import listing_cache
+
+    bucket = get_bucket()
+    docs = get_firestore_collection().select(["blob_name", "user_id", "blurhash"]).stream()
+    pending = []
+    for doc in docs:
+        data = doc.to_dict()
+        if data.get("blob_name") and not data.get("blurhash"):
+            pending.append((doc.reference, data["blob_name"], data.get("user_id")))
+    if limit is not None:
+        pending = pending[:limit]
+
+    updated = failed = 0
+    users = set()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for start in range(0, len(pending), batch_size):
+            chunk = pending[start:start + batch_size]
+            infos = list(executor.map(lambda item: _describe_blob(bucket, item[1]), chunk))
+            batch = get_firestore_client().batch()
+            for (ref, _, user_id), info in zip(chunk, infos):
+                if info is None:
+                    failed += 1
+                    continue
+                batch.update(ref, info)
+                updated += 1
+                if user_id:
+                    users.add(user_id)
+            batch.commit()
+            print(f"Image info: {updated} updated, {failed} failed, {len(pending) - start - len(chunk)} to go")
+
+    # Cached listing pages were built without the new fields
+    for user_id in users:
+        listing_cache.bump(user_id)
+    return {"updated": updated, "failed": failed, "users": len(users)}
@@ -0,0 +1,74 @@
+
+import time
+import heapq
+import threading
+from abc import ABC, abstractmethod
+
+# Job queues shared by the background workers (tagging, email). Jobs are any
+# object; backends that need to ack a job keep what they need on it.
+
+
+class JobQueue(ABC):
+    """
+    Queue backend interface. dequeue() leases a job; the worker must then call
+    complete() or retry(). Implementations must be safe to call from many threads.
+    """
+
+    @abstractmethod
+    def enqueue(self, job, delay: float = 0):
+        ...
+
+    @abstractmethod
+    def dequeue(self, timeout: float):
+        """Next due job, or None if none became due within timeout seconds."""
+
+    @abstractmethod
+    def complete(self, job):
+        ...
+
+    @abstractmethod
+    def retry(self, job, delay: float):
+        ...
+
+    @abstractmethod
+    def size(self) -> int:
+        ...
+
+
+class InMemoryJobQueue(JobQueue):
+    """Process-local queue. Jobs are lost on restart."""
+
+    def __init__(self):
+        self._heap = []  # (due_at, seq, job)
+        self._seq = 0
+        self._cond = threading.Condition()
+
+    def enqueue(self, job, delay=0):
+        with self._cond:
+            self._seq += 1
+            heapq.heappush(self._heap, (time.monotonic() + delay, self._seq, job))
+            self._cond.notify()
+
+    def dequeue(self, timeout):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if self._heap and self._heap[0][0] <= now:
+                    return heapq.heappop(self._heap)[2]
+                if now >= deadline:
+                    return None
+                wait = deadline - now
+                if self._heap:
+                    wait = min(wait, self._heap[0][0] - now)
+                self._cond.wait(wait)
+
+    def complete(self, job):
+        pass
+
+    def retry(self, job, delay):
+        self.enqueue(job, delay)
+
+    def size(self):
+        with self._cond:
+            return len(self._heap)
@@ -1,78 +1,262 @@
+import os
+import time
+import threading
 from datetime import datetime
 from fastapi import HTTPException
-from google.cloud import firestore
-from services.gcs import get_firestore_client
+from services.gcs import get_firestore_client, transactional
 
 # Constants
 DAILY_LIMIT_USER = 25
 LIFETIME_LIMIT_GUEST = 10
 
+# Users well under their daily limit lease a block of uploads in one
+# transaction and spend it locally, so most uploads need no Firestore call.
+# The lease is added to daily_count up front (other instances can never push
+# a user over the limit); whatever is left unspent is written back after
+# QUOTA_LEASE_IDLE_SECONDS. Leases are only taken while the user stays at
+# least QUOTA_LEASE_HEADROOM uploads below the limit.
+QUOTA_LEASE_SIZE = int(os.getenv("QUOTA_LEASE_SIZE", 5))
+QUOTA_LEASE_HEADROOM = int(os.getenv("QUOTA_LEASE_HEADROOM", 5))
+QUOTA_LEASE_IDLE_SECONDS = float(os.getenv("QUOTA_LEASE_IDLE_SECONDS", 30))
+# Exhausted guests (and users, for the rest of the day) are rejected from memory
+QUOTA_EXHAUSTED_TTL_SECONDS = float(os.getenv("QUOTA_EXHAUSTED_TTL_SECONDS", 3600))
+QUOTA_EXHAUSTED_MAX_ENTRIES = int(os.getenv("QUOTA_EXHAUSTED_MAX_ENTRIES", 100000))
+
 def get_current_date_str():
     return datetime.utcnow().strftime("%Y-%m-%d")
 
-def check_guest_limit(ip_address: str):
+def _guest_limit_error(used: int) -> HTTPException:
+    if used:
+        return HTTPException(status_code=429, detail=f"Guest limit exceeded. You have used {used}/{LIFETIME_LIMIT_GUEST} free uploads. Please sign up to continue.")
+    return HTTPException(status_code=429, detail=f"Guest limit exceeded. You can upload {LIFETIME_LIMIT_GUEST} images for free. Please sign up to continue.")
+
+def _user_limit_error(used: int) -> HTTPException:
+    return HTTPException(status_code=429, detail=f"Daily limit exceeded. You have used {used}/{DAILY_LIMIT_USER} uploads today.")
+
+
+class QuotaLeases:
+    """Uploads leased from Firestore per (user, day), spent without a round trip."""
+
+    def __init__(self, idle_seconds: float = QUOTA_LEASE_IDLE_SECONDS):
+        self.idle_seconds = idle_seconds
+        self._leases = {}  # (user_id, date) -> [tokens, last_used]
+        self._lock = threading.Lock()
+
+    def take(self, user_id: str, date_str: str, count: int) -> bool:
+        with self._lock:
+            lease = self._leases.get((user_id, date_str))
+            if lease is None or lease[0] < count:
+                return False
+            lease[0] -= count
+            lease[1] = time.monotonic()
+            return True
+
+    def add(self, user_id: str, date_str: str, tokens: int):
+        if tokens <= 0:
+            return
+        with self._lock:
+            lease = self._leases.setdefault((user_id, date_str), [0, 0])
+            lease[0] += tokens
+            lease[1] = time.monotonic()
+
+    def expired(self, date_str: str, force: bool = False) -> list:
+        """Pop and return [(user_id, tokens)] to give back for today; older days just lapse."""
+        now = time.monotonic()
+        released = []
+        with self._lock:
+            for key, (tokens, last_used) in list(self._leases.items()):
+                user_id, lease_date = key
+                if lease_date != date_str:
+                    del self._leases[key]
+                elif force or now - last_used >= self.idle_seconds:
+                    del self._leases[key]
+                    if tokens:
+                        released.append((user_id, tokens))
+        return released
+
+
+class ExhaustedCache:
+    """Bounded TTL set of quota keys known to be used up."""
+
+    def __init__(self, ttl: float = QUOTA_EXHAUSTED_TTL_SECONDS, max_entries: int = QUOTA_EXHAUSTED_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}  # key -> (expires_at, used)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Last seen usage for an exhausted key, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            return entry[1]
+
+    def add(self, key, used: int, ttl: float = None):
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                # Dicts keep insertion order: drop the oldest
+                self._entries.pop(next(iter(self._entries)))
+            self._entries[key] = (time.monotonic() + (ttl or self.ttl), used)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+_leases = QuotaLeases()
+_exhausted = ExhaustedCache()
+
+
+@transactional
+def _reserve_guest(transaction, doc_ref, count: int):
+    """Atomic check-and-increment. Returns (ok, used before this reservation)."""
+    doc = doc_ref.get(transaction=transaction)
+    used = doc.to_dict().get("count", 0) if doc.exists else 0
+    if used + count > LIFETIME_LIMIT_GUEST:
+        return False, used
+    transaction.set(doc_ref, {"count": used + count}, merge=True)
+    return True, used
+
+@transactional
+def _reserve_user(transaction, doc_ref, date_str: str, count: int):
+    """Atomic check-and-increment, plus a lease if well under the limit. Returns (ok, used, leased)."""
+    doc = doc_ref.get(transaction=transaction)
+    used = 0
+    if doc.exists:
+        data = doc.to_dict()
+        if data.get("last_upload_date") == date_str:
+            used = data.get("daily_count", 0)
+        # Otherwise the counter resets for today
+
+    if used + count > DAILY_LIMIT_USER:
+        return False, used, 0
+    leased = min(QUOTA_LEASE_SIZE, DAILY_LIMIT_USER - QUOTA_LEASE_HEADROOM - used - count)
+    leased = max(leased, 0)
+    transaction.set(doc_ref, {
+        "last_upload_date": date_str,
+        "daily_count": used + count + leased
+    }, merge=True)
+    return True, used, leased
+
+def check_guest_limit(ip_address: str, count: int = 1):
     """
-    Check if the guest (identified by IP) has exceeded lifetime limit.
+    Check if the guest (identified by IP) has room for `count` more uploads
+    within the lifetime limit, and reserve them.
     """
+    key = ("guest", ip_address)
+    used = _exhausted.get(key)
+    if used is not None:
+        raise _guest_limit_error(used)
+
     db = get_firestore_client()
-    # Normalize IP to avoid simple string mismatches? IPs are standard.
     # Collection: guest_usage, Doc: IP_Address
     # Store: { "count": int }
-    
     doc_ref = db.collection("guest_usage").document(ip_address)
-    doc = doc_ref.get()
-    
-    if doc.exists:
-        data = doc.to_dict()
-        count = data.get("count", 0)
-        
-        if count >= LIFETIME_LIMIT_GUEST:
-            raise HTTPException(status_code=429, detail=f"Guest limit exceeded. You have used {count}/{LIFETIME_LIMIT_GUEST} free uploads. Please sign up to continue.")
-        
-        # Increment
-        doc_ref.update({"count": firestore.Increment(1)})
-    else:
-        # Create
-        doc_ref.set({"count": 1})
-
-def check_user_limit(user_id: str):
+    ok, used = _reserve_guest(db.transaction(), doc_ref, count)
+    if not ok:
+        if used >= LIFETIME_LIMIT_GUEST:
+            _exhausted.add(key, used)
+        raise _guest_limit_error(used)
+
+def check_user_limit(user_id: str, count: int = 1):
     """
-    Check if the authenticated user has exceeded daily limit.
+    Check if the authenticated user has room for `count` more uploads today,
+    and reserve them.
     """
-    db = get_firestore_client()
     date_str = get_current_date_str()
-    
-    # Collection: users, Doc: user_id, Subcollection: stats, Doc: usage
-    # Actually simpler: users/{user_id}/usage
-    # Store: { "date": "2025-01-02", "daily_count": int }
-    
+    if _leases.take(user_id, date_str, count):
+        return
+    key = ("user", user_id, date_str)
+    used = _exhausted.get(key)
+    if used is not None:
+        raise _user_limit_error(used)
+
+    db = get_firestore_client()
+    # Collection: users, Doc: user_id
+    # Store: { "last_upload_date": "2025-01-02", "daily_count": int }
     doc_ref = db.collection("users").document(user_id)
-    doc = doc_ref.get()
-    
-    # Defaults
-    current_count = 0
-    needs_reset = True
-    
-    if doc.exists:
-        data = doc.to_dict()
-        last_date = data.get("last_upload_date")
-        current_count = data.get("daily_count", 0)
-        
-        if last_date == date_str:
-            needs_reset = False
-            
-    if needs_reset:
-        # Reset counter for today
-        current_count = 0
-        doc_ref.set({
-            "last_upload_date": date_str,
-            "daily_count": 1 # This is the first one
-        }, merge=True)
-    else:
-        if current_count >= DAILY_LIMIT_USER:
-            raise HTTPException(status_code=429, detail=f"Daily limit exceeded. You have used {current_count}/{DAILY_LIMIT_USER} uploads today.")
-            
-        doc_ref.update({
-            "daily_count": firestore.Increment(1),
-            "last_upload_date": date_str # Ensure date is kept
-        })
+    ok, used, leased = _reserve_user(db.transaction(), doc_ref, date_str, count)
+    if not ok:
+        if used >= DAILY_LIMIT_USER:
+            # Part of that count may be another instance's lease, given back within its idle time
+            _exhausted.add(key, used, ttl=min(QUOTA_EXHAUSTED_TTL_SECONDS, 2 * QUOTA_LEASE_IDLE_SECONDS))
+        raise _user_limit_error(used)
+    _leases.add(user_id, date_str, leased)
+
+def refund_guest_uploads(ip_address: str, count: int):
+    """Give back uploads reserved by check_guest_limit that were never stored. Never raises."""
+    try:
+        db = get_firestore_client()
+        _release_guest(db.transaction(), db.collection("guest_usage").document(ip_address), count)
+        _exhausted.discard(("guest", ip_address))
+    except Exception as e:
+        print(f"Quota Refund Error ({ip_address}): {e}")
+
+def refund_user_uploads(user_id: str, count: int):
+    """
+    Give back uploads reserved by check_user_limit that were never stored.
+    They join the user's lease: spent by the next uploads, or written back
+    by the releaser once idle.
+    """
+    _leases.add(user_id, get_current_date_str(), count)
+
+@transactional
+def _release_guest(transaction, doc_ref, count: int):
+    doc = doc_ref.get(transaction=transaction)
+    if not doc.exists:
+        return
+    used = doc.to_dict().get("count", 0)
+    transaction.update(doc_ref, {"count": max(0, used - count)})
+
+def release_unused_leases(force: bool = False):
+    """Write back idle (or, with force, all) leased uploads. Never raises."""
+    date_str = get_current_date_str()
+    for user_id, tokens in _leases.expired(date_str, force=force):
+        try:
+            doc_ref = get_firestore_client().collection("users").document(user_id)
+            _release_user(get_firestore_client().transaction(), doc_ref, date_str, tokens)
+        except Exception as e:
+            print(f"Quota Release Error ({user_id}): {e}")
+
+@transactional
+def _release_user(transaction, doc_ref, date_str: str, tokens: int):
+    doc = doc_ref.get(transaction=transaction)
+    # After midnight the counter has already reset; nothing to give back
+    if not doc.exists or doc.to_dict().get("last_upload_date") != date_str:
+        return
+    used = doc.to_dict().get("daily_count", 0)
+    transaction.update(doc_ref, {"daily_count": max(0, used - tokens)})
+
+
+class LeaseReleaser:
+    """Background thread returning idle leases; releases everything on stop."""
+
+    def __init__(self, interval: float = QUOTA_LEASE_IDLE_SECONDS):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="quota-leases", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        release_unused_leases(force=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            release_unused_leases()
+
+
+lease_releaser = LeaseReleaser()
@@ -0,0 +1,147 @@
+
+import os
+import json
+import time
+import uuid
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from services.gcs import get_firestore_client, FIRESTORE_COLLECTION
+
+# Cache of /images pages and /search results per user.
+#
+# Every user has a version stamp that changes whenever anything in their
+# listings can change (upload, delete, tagging finished). Cached pages and
+# ETags are keyed by the stamp, so a bump invalidates them exactly and an
+# entry never needs to be removed, only evicted. With several workers the
+# stamps must be shared ("firestore" backend: one point read per request
+# instead of a query); the pages themselves are immutable per stamp, so each
+# process can keep its own copies. "memory" is only correct for a single
+# worker on a single instance.
+#
+# As a backstop against a missed bump, stamps also roll over every
+# LISTING_CACHE_MAX_AGE_SECONDS, so no page or ETag outlives that.
+LISTING_CACHE_BACKEND = os.getenv("LISTING_CACHE_BACKEND", "firestore")  # memory | firestore
+LISTING_CACHE_MAX_ENTRIES = int(os.getenv("LISTING_CACHE_MAX_ENTRIES", 5000))
+LISTING_CACHE_MAX_AGE_SECONDS = int(os.getenv("LISTING_CACHE_MAX_AGE_SECONDS", 300))
+LISTING_VERSION_COLLECTION = os.getenv("LISTING_VERSION_COLLECTION", f"{FIRESTORE_COLLECTION}_listing_versions")
+
+
+class VersionStore(ABC):
+    """Per-user version stamps. Implementations must be safe to call from many threads."""
+
+    @abstractmethod
+    def get(self, user_id: str) -> str:
+        ...
+
+    @abstractmethod
+    def bump(self, user_id: str):
+        ...
+
+
+class InMemoryVersionStore(VersionStore):
+    """Single-worker stamps. The per-process epoch keeps ETags from before a restart from matching."""
+
+    def __init__(self):
+        self._epoch = uuid.uuid4().hex[:8]
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            return f"{self._epoch}.{self._versions.get(user_id, 0)}"
+
+    def bump(self, user_id):
+        with self._lock:
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+
+
+class FirestoreVersionStore(VersionStore):
+    """Shared stamps: {LISTING_VERSION_COLLECTION}/{user_id} { "version": int }."""
+
+    def _ref(self, user_id):
+        return get_firestore_client().collection(LISTING_VERSION_COLLECTION).document(user_id)
+
+    def get(self, user_id):
+        doc = self._ref(user_id).get()
+        return str(doc.get("version") if doc.exists else 0)
+
+    def bump(self, user_id):
+        from google.cloud import firestore
+        self._ref(user_id).set({"version": firestore.Increment(1)}, merge=True)
+
+
+VERSION_BACKENDS = {
+    "memory": lambda: InMemoryVersionStore(),
+    "firestore": lambda: FirestoreVersionStore(),
+}
+
+
+def create_version_store(backend: str = LISTING_CACHE_BACKEND) -> VersionStore:
+    if backend not in VERSION_BACKENDS:
+        raise ValueError(f"Unknown LISTING_CACHE_BACKEND: {backend}")
+    return VERSION_BACKENDS[backend]()
+
+
+class ListingCache:
+    """LRU of listing responses keyed by (user, version, kind, params)."""
+
+    def __init__(self, versions: VersionStore, max_entries: int = LISTING_CACHE_MAX_ENTRIES,
+                 max_age: int = LISTING_CACHE_MAX_AGE_SECONDS):
+        self.versions = versions
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def etag(user_id: str, version: str, kind: str, params: dict) -> str:
+        key = json.dumps([user_id, version, kind, params], sort_keys=True, separators=(",", ":"))
+        return '"' + hashlib.sha1(key.encode("utf-8")).hexdigest()[:20] + '"'
+
+    def version(self, user_id: str) -> str:
+        """The user's stamp plus the current max_age window."""
+        return f"{self.versions.get(user_id)}.{int(time.time() // self.max_age)}"
+
+    def get(self, etag: str):
+        """Cached body for an ETag from etag(), or None."""
+        with self._lock:
+            body = self._entries.get(etag)
+            if body is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(etag)
+            self.hits += 1
+            return body
+
+    def put(self, etag: str, body: dict):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[etag] = body
+            self._entries.move_to_end(etag)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def bump(self, user_id: str):
+        """Invalidate every cached listing of this user. Never raises."""
+        if not user_id:
+            return  # guests have no listings
+        try:
+            self.versions.bump(user_id)
+        except Exception as e:
+            print(f"Listing Version Error: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+listing_cache = ListingCache(create_version_store())
@@ -0,0 +1,203 @@
+
+import os
+import json
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Process-local metrics in Prometheus text format (GET /metrics). With several
+# workers each one reports its own; scrape them individually or sum in queries.
+#
+# METRICS_TIMING_LOGS=true additionally prints one JSON line per request with
+# the time spent in each stage, e.g.
+#   {"event": "request_timing", "method": "POST", "route": "/upload", "status": 200,
+#    "duration_ms": 812.4, "stages": {"upload.gcs_write": 95.1, "upload.vision_call": 690.3, ...}}
+METRICS_TIMING_LOGS = os.getenv("METRICS_TIMING_LOGS", "false").lower() == "true"
+METRICS_PREFIX = "smartgallery"
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def count(self, *labels) -> int:
+        with self._lock:
+            series = self._series.get(labels)
+            return series[-1] if series else 0
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labelnames + ("le",)
+        with self._lock:
+            for labels, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_labels(names, labels + (_number(float(bound)),))} {cumulative}")
+                lines.append(f"{self.name}_bucket{_labels(names, labels + ('+Inf',))} {series[-1]}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(series[-2])}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {series[-1]}")
+        return lines
+
+
+request_seconds = Histogram(f"{METRICS_PREFIX}_request_seconds", "HTTP request latency.", ("method", "route", "status"))
+stage_seconds = Histogram(f"{METRICS_PREFIX}_stage_seconds", "Time spent in each stage of an operation.", ("operation", "stage"))
+outbound_calls = Counter(f"{METRICS_PREFIX}_outbound_calls_total", "Calls to external services.", ("backend", "outcome"))
+outbound_seconds = Histogram(f"{METRICS_PREFIX}_outbound_seconds", "Latency of calls to external services.", ("backend",))
+
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+@contextmanager
+def span(operation: str, stage: str, backend: str = None):
+    """
+    Time a stage of an operation. With backend set, the block is also counted
+    as an outbound call to that service, by outcome (ok | error).
+    """
+    started = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        stage_seconds.observe(elapsed, operation, stage)
+        if backend:
+            outbound_calls.inc(backend, outcome)
+            outbound_seconds.observe(elapsed, backend)
+        timings = _request_timings.get()
+        if timings is not None:
+            key = f"{operation}.{stage}"
+            timings[key] = timings.get(key, 0.0) + elapsed
+
+
+def record_outbound(backend: str, outcome: str, seconds: float = None):
+    """For calls that aren't timed with span()."""
+    outbound_calls.inc(backend, outcome)
+    if seconds is not None:
+        outbound_seconds.observe(seconds, backend)
+
+
+def render_stats(name: str, stats: dict) -> list:
+    """Gauges from a cache's stats() dict: {METRICS_PREFIX}_{name}_{key}."""
+    lines = []
+    for key, value in sorted(stats.items()):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        metric = f"{METRICS_PREFIX}_{name}_{key}"
+        lines += [f"# TYPE {metric} gauge", f"{metric} {_number(value)}"]
+    return lines
+
+
+def render(extra_lines=()) -> str:
+    lines = []
+    for metric in (request_seconds, stage_seconds, outbound_calls, outbound_seconds):
+        lines += metric.render()
+    lines += list(extra_lines)
+    return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording request latency (until the last body byte is
+    sent, so streamed images count in full) and, optionally, timing logs.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        timings = {}
+        token = _request_timings.set(timings)
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            _request_timings.reset(token)
+            route = scope.get("route")
+            # Route templates keep label cardinality bounded; unmatched paths share one label
+            route_path = getattr(route, "path", "unmatched")
+            request_seconds.observe(elapsed, scope["method"], route_path, status)
+            if METRICS_TIMING_LOGS:
+                print(json.dumps({
+                    "event": "request_timing",
+                    "method": scope["method"],
+                    "route": route_path,
+                    "status": status,
+                    "duration_ms": round(elapsed * 1000, 1),
+                    "stages": {k: round(v * 1000, 1) for k, v in timings.items()},
+                }))
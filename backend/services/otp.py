@@ -1,20 +1,16 @@
 
-import os
 import random
 import string
 import datetime
 import ssl
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail
-from services.gcs import get_firestore_client
+from services.gcs import get_firestore_client, transactional
+from services.email_dispatch import email_dispatcher, EmailMessage, SENDGRID_API_KEY
 
 # Bypass SSL verify (for Dev/Proxy environments)
 ssl._create_default_https_context = ssl._create_unverified_context
 
 # Config
 OTP_EXPIRY_MINUTES = 10
-SENDGRID_API_KEY = os.getenv("SENDGRID_API_KEY")
-FROM_EMAIL = os.getenv("SENDGRID_FROM_EMAIL", "test@example.com") 
 
 def generate_otp() -> str:
     """Generates a 6-digit random number string."""
@@ -40,50 +36,54 @@ def store_otp(email: str, otp: str):
     # Store in 'otp_codes' collection
     db.collection("otp_codes").document(email).set(data)
 
-def verify_otp_logic(email: str, otp: str) -> bool:
-    """Checks if OTP is valid and not expired."""
-    db = get_firestore_client()
-    doc_ref = db.collection("otp_codes").document(email)
-    doc = doc_ref.get()
-    
+def discard_otp(email: str):
+    """Best effort; the code expires anyway."""
+    try:
+        get_firestore_client().collection("otp_codes").document(email).delete()
+    except Exception as e:
+        print(f"Discard OTP Error: {e}")
+
+@transactional
+def _consume_otp(transaction, doc_ref, otp: str) -> bool:
+    """Check the code and delete it in the same transaction, so it verifies at most once."""
+    doc = doc_ref.get(transaction=transaction)
     if not doc.exists:
         return False
-        
+
     data = doc.to_dict()
     stored_otp = data.get("otp")
     expires_at = data.get("expires_at")
-    
+
     # Check match
     if stored_otp != otp:
         return False
-        
+
     # Check expiry (Firestore returns datetime with timezone)
     now = datetime.datetime.now(datetime.timezone.utc)
     if now > expires_at:
         return False
-        
-    # Optional: Delete after successful verify to prevent replay?
-    # db.collection("otp_codes").document(email).delete()
+
+    transaction.delete(doc_ref)
     return True
 
-def send_otp_email(email: str, otp: str):
-    """Sends the OTP via SendGrid."""
+def verify_otp_logic(email: str, otp: str) -> bool:
+    """Checks if OTP is valid and not expired, and uses it up if so."""
+    db = get_firestore_client()
+    doc_ref = db.collection("otp_codes").document(email)
+    return _consume_otp(db.transaction(), doc_ref, otp)
+
+def send_otp_email(email: str, otp: str) -> bool:
+    """
+    Queues the OTP email for the background dispatcher (SendGrid).
+    False if the dispatcher's backlog is full.
+    """
     if not SENDGRID_API_KEY:
         print("Warning: SENDGRID_API_KEY not found. Printing OTP to console.")
         print(f"--- OTP for {email}: {otp} ---")
-        return
+        return True
 
-    message = Mail(
-        from_email=FROM_EMAIL,
-        to_emails=email,
+    return email_dispatcher.submit(EmailMessage(
+        to=email,
         subject='Your SmartGallery Verification Code',
-        html_content=f'<strong>Your verification code is: {otp}</strong><br>It expires in {OTP_EXPIRY_MINUTES} minutes.'
-    )
-    
-    try:
-        sg = SendGridAPIClient(SENDGRID_API_KEY)
-        response = sg.send(message)
-        # print(f"Email sent. Status: {response.status_code}")
-    except Exception as e:
-        print(f"SendGrid Error: {e}")
-        raise e
+        html=f'<strong>Your verification code is: {otp}</strong><br>It expires in {OTP_EXPIRY_MINUTES} minutes.'
+    ))
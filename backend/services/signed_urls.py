@@ -0,0 +1,149 @@
+
+import os
+import time
+import datetime
+import threading
+from collections import OrderedDict
+from services.gcs import get_bucket, get_storage_client
+
+# How image bytes reach the browser:
+#   proxy    - /images/{filename} streams every byte through this service
+#   redirect - /images/{filename} answers with a 302 to a V4 signed GCS URL
+#   signed   - listings embed signed URLs for the originals directly;
+#              /images/{filename} (thumbnails, uploads) redirects as above
+# Signing happens locally with the service account key, or through IAM
+# signBlob when the credentials have no private key (Cloud Run's default).
+IMAGE_DELIVERY_MODE = os.getenv("IMAGE_DELIVERY_MODE", "proxy").lower()
+DELIVERY_MODES = ("proxy", "redirect", "signed")
+SIGNED_URL_TTL_SECONDS = int(os.getenv("SIGNED_URL_TTL_SECONDS", 3600))
+SIGNED_URL_CACHE_MAX_ENTRIES = int(os.getenv("SIGNED_URL_CACHE_MAX_ENTRIES", 20000))
+# A signature is reused for the first third of its lifetime, so whatever
+# handed it out (a redirect, a cached listing page) can live for another
+# third and the client still gets at least a third to fetch it.
+SIGNED_URL_REUSE_SECONDS = SIGNED_URL_TTL_SECONDS / 3
+
+if IMAGE_DELIVERY_MODE not in DELIVERY_MODES:
+    raise ValueError(f"Unknown IMAGE_DELIVERY_MODE: {IMAGE_DELIVERY_MODE}")
+
+
+def signing_epoch(now: float = None) -> int:
+    """Changes every SIGNED_URL_REUSE_SECONDS; key anything that embeds signed URLs by it."""
+    return int((time.time() if now is None else now) // SIGNED_URL_REUSE_SECONDS)
+
+
+_credentials_lock = threading.Lock()
+
+
+def _signing_kwargs() -> dict:
+    """
+    generate_signed_url arguments for the storage client's credentials.
+    Service account keys sign locally; token-only credentials (metadata
+    server) need the account email and an access token for IAM signBlob.
+    """
+    credentials = getattr(get_storage_client(), "_credentials", None)
+    if credentials is None:
+        return {}
+    from google.auth.credentials import Signing
+    if isinstance(credentials, Signing):
+        return {}
+    with _credentials_lock:
+        if not credentials.valid:
+            from google.auth.transport.requests import Request
+            credentials.refresh(Request())
+        return {"service_account_email": credentials.service_account_email, "access_token": credentials.token}
+
+
+def sign_blob_url(blob_name: str) -> str:
+    blob = get_bucket().blob(blob_name)
+    return blob.generate_signed_url(
+        version="v4",
+        expiration=datetime.timedelta(seconds=SIGNED_URL_TTL_SECONDS),
+        method="GET",
+        **_signing_kwargs(),
+    )
+
+
+class SignedUrlCache:
+    """LRU of blob_name -> (signed URL, signed_at), reused for SIGNED_URL_REUSE_SECONDS."""
+
+    def __init__(self, max_entries: int = SIGNED_URL_CACHE_MAX_ENTRIES, reuse_seconds: float = SIGNED_URL_REUSE_SECONDS,
+                 sign=sign_blob_url):
+        self.max_entries = max_entries
+        self.reuse_seconds = reuse_seconds
+        self.sign = sign
+        self._urls = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, blob_name: str, exists=None):
+        """
+        (url, seconds it may still be handed out), signing on a miss. With
+        exists, a miss first asks exists(blob_name) and returns None if it
+        says no, so only names known to exist get signed. Raises if signing fails.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._urls.get(blob_name)
+            if entry is not None and now - entry[1] < self.reuse_seconds:
+                self._urls.move_to_end(blob_name)
+                self.hits += 1
+                return entry[0], self.reuse_seconds - (now - entry[1])
+            self.misses += 1
+
+        if exists is not None and not exists(blob_name):
+            return None
+        signed_at = time.time()
+        url = self.sign(blob_name)
+        if self.max_entries > 0:
+            with self._lock:
+                self._urls[blob_name] = (url, signed_at)
+                self._urls.move_to_end(blob_name)
+                while len(self._urls) > self.max_entries:
+                    self._urls.popitem(last=False)
+        return url, self.reuse_seconds - (time.time() - signed_at)
+
+    def url(self, blob_name: str) -> str:
+        return self.get(blob_name)[0]
+
+    def urls(self, blob_names, executor=None) -> dict:
+        """
+        {blob_name: url} for many names. Names not reusable from the cache are
+        signed concurrently on executor; ones that fail to sign are left out.
+        """
+        names = list(dict.fromkeys(blob_names))
+        now = time.time()
+        with self._lock:
+            found = {
+                name: self._urls[name][0] for name in names
+                if name in self._urls and now - self._urls[name][1] < self.reuse_seconds
+            }
+            self.hits += len(found)
+        missing = [name for name in names if name not in found]
+        signer = executor.map if executor is not None and len(missing) > 1 else map
+        for name, url in zip(missing, signer(self._try_url, missing)):
+            if url is not None:
+                found[name] = url
+        return found
+
+    def _try_url(self, blob_name: str):
+        try:
+            return self.url(blob_name)
+        except Exception as e:
+            print(f"URL Signing Error: {e}")
+            return None
+
+    def forget(self, blob_name: str):
+        with self._lock:
+            self._urls.pop(blob_name, None)
+
+    def clear(self):
+        with self._lock:
+            self._urls.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._urls), "hits": self.hits, "misses": self.misses}
+
+
+signed_urls = SignedUrlCache()
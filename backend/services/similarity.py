@@ -0,0 +1,284 @@
+
+import os
+import threading
+from array import array
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+from services.gcs import get_firestore_collection
+from services.image_info import open_preview
+from services.listing_cache import listing_cache
+from services.executor import io_executor
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+# Visual similarity without the vision model.
+#
+# Every upload stores a 64-bit perceptual hash (DCT of a 32x32 grayscale
+# thumbnail) and a 64-bin color histogram with its metadata:
+#   { "phash": "<16 hex digits>", "color_hist": "<128 hex digits>" }
+# Per user, the hashes live in an in-memory index that answers by Hamming
+# distance over all of them at once, with histogram overlap breaking ties.
+# The index is loaded with one projected query and kept current by this
+# process's own uploads and deletes. It is stamped with the user's listing
+# version (services.listing_cache) at load time, the same way TagMatrix
+# carries the tag index version: /similar reloads it only when the stamp has
+# moved since. The upload path never loads it: near-duplicate checks use the
+# resident index as is, or find nothing and warm it in the background.
+SIMILAR_MAX_DISTANCE = int(os.getenv("SIMILAR_MAX_DISTANCE", 20))  # of 64 bits
+NEAR_DUPLICATE_DISTANCE = int(os.getenv("NEAR_DUPLICATE_DISTANCE", 6))
+SIMILAR_INDEX_MAX_USERS = int(os.getenv("SIMILAR_INDEX_MAX_USERS", 1000))
+# Bits of Hamming distance a complete color mismatch is worth when ranking
+HISTOGRAM_WEIGHT = 8.0
+
+HASH_SIZE = 32
+HISTOGRAM_BINS = 64  # 4 levels per RGB channel
+FINGERPRINT_FIELDS = ["phash", "color_hist"]
+
+_dct = None
+
+
+def _dct_matrix():
+    """Orthogonal DCT-II basis for HASH_SIZE points."""
+    global _dct
+    if _dct is None:
+        import numpy as np
+        k = np.arange(HASH_SIZE)[:, None]
+        n = np.arange(HASH_SIZE)[None, :]
+        _dct = np.cos(np.pi * (2 * n + 1) * k / (2 * HASH_SIZE))
+    return _dct
+
+
+def image_fingerprint(source) -> dict:
+    """
+    {"phash", "color_hist"} of image bytes or a seekable binary file.
+    Raises if it isn't an image Pillow can decode.
+    """
+    preview, _ = open_preview(source, HASH_SIZE * 2)
+    return fingerprint_preview(preview)
+
+
+def fingerprint_preview(image: "Image.Image") -> dict:
+    """image_fingerprint of an already decoded, upright RGB preview (see services.image_info)."""
+    import numpy as np
+    from PIL import Image
+
+    gray = np.asarray(image.convert("L").resize((HASH_SIZE, HASH_SIZE), Image.BOX), dtype=np.float64)
+    dct = _dct_matrix()
+    low = (dct @ gray @ dct.T)[:8, :8].flatten()
+    # The DC term is the mean brightness; leave it out of the threshold
+    bits = low > np.median(low[1:])
+    phash = np.packbits(bits).tobytes().hex()
+
+    pixels = np.asarray(image.resize((HASH_SIZE * 2, HASH_SIZE * 2), Image.BOX), dtype=np.uint8) >> 6
+    bins = (pixels[..., 0].astype(np.intp) << 4) | (pixels[..., 1] << 2) | pixels[..., 2]
+    counts = np.bincount(bins.ravel(), minlength=HISTOGRAM_BINS)
+    histogram = np.round(counts * 255 / counts.sum()).astype(np.uint8)
+    return {"phash": phash, "color_hist": histogram.tobytes().hex()}
+
+
+def _popcount_table(np):
+    return np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+class SimilarityIndex:
+    """One user's image fingerprints. Thread-safe; removed images are masked, not compacted."""
+
+    def __init__(self, version: str = None):
+        self.version = version
+        self.lock = threading.Lock()
+        self.image_ids = []
+        self._index = {}
+        self._hashes = array("Q")
+        self._histograms = bytearray()
+        self._alive = array("b")
+
+    def __len__(self):
+        return len(self._index)
+
+    def add(self, image_id: str, fingerprint: dict):
+        try:
+            phash = int(fingerprint["phash"], 16)
+            histogram = bytes.fromhex(fingerprint["color_hist"])
+        except (KeyError, TypeError, ValueError):
+            return  # uploaded before fingerprints, or not an image
+        if len(histogram) != HISTOGRAM_BINS:
+            return
+        with self.lock:
+            if image_id in self._index:
+                return
+            self._index[image_id] = len(self.image_ids)
+            self.image_ids.append(image_id)
+            self._hashes.append(phash)
+            self._histograms += histogram
+            self._alive.append(1)
+
+    def remove(self, image_id: str):
+        with self.lock:
+            index = self._index.pop(image_id, None)
+            if index is not None:
+                self._alive[index] = 0
+
+    def fingerprint(self, image_id: str):
+        with self.lock:
+            index = self._index.get(image_id)
+            if index is None:
+                return None
+            start = index * HISTOGRAM_BINS
+            return {
+                "phash": f"{self._hashes[index]:016x}",
+                "color_hist": bytes(self._histograms[start:start + HISTOGRAM_BINS]).hex(),
+            }
+
+    def query(self, fingerprint: dict, limit: int, max_distance: int = SIMILAR_MAX_DISTANCE, exclude: str = None) -> list:
+        """
+        Closest images within max_distance bits, best first:
+        [(image_id, distance, color_similarity)].
+        """
+        import numpy as np
+
+        phash = np.uint64(int(fingerprint["phash"], 16))
+        histogram = np.frombuffer(bytes.fromhex(fingerprint["color_hist"]), dtype=np.uint8)
+        with self.lock:
+            hashes = np.array(self._hashes, dtype=np.uint64)
+            alive = np.array(self._alive, dtype=bool)
+            histograms = np.frombuffer(bytes(self._histograms), dtype=np.uint8).reshape(-1, HISTOGRAM_BINS)
+            image_ids = self.image_ids
+            excluded = self._index.get(exclude)
+        if not len(hashes):
+            return []
+
+        distances = _popcount_table(np)[(hashes ^ phash).view(np.uint8)].reshape(-1, 8).sum(axis=1, dtype=np.int32)
+        within = alive & (distances <= max_distance)
+        if excluded is not None:
+            within[excluded] = False
+        candidates = np.flatnonzero(within)
+        overlap = np.minimum(histograms[candidates], histogram).sum(axis=1) / 255.0
+        rank = distances[candidates] + (1 - overlap) * HISTOGRAM_WEIGHT
+        order = np.lexsort((candidates, rank))[:limit]
+        return [
+            (image_ids[candidates[i]], int(distances[candidates[i]]), round(float(overlap[i]), 3))
+            for i in order.tolist()
+        ]
+
+
+def load_similarity_index(user_id: str, version: str = None) -> SimilarityIndex:
+    """Fingerprints of all the user's images, in one projected query."""
+    index = SimilarityIndex(version)
+    docs = get_firestore_collection().where("user_id", "==", user_id).select(FINGERPRINT_FIELDS).stream()
+    for doc in docs:
+        index.add(doc.id, doc.to_dict())
+    return index
+
+
+class SimilarityIndexCache:
+    """LRU of per-user SimilarityIndex objects, reloaded when the user's listing version moves."""
+
+    def __init__(self, max_users: int = SIMILAR_INDEX_MAX_USERS, loader=load_similarity_index,
+                 version_of=None, executor=io_executor):
+        self.max_users = max_users
+        self.loader = loader
+        self.version_of = version_of or listing_cache.versions.get
+        self.executor = executor
+        self._indexes = OrderedDict()
+        self._loading = {}  # user_id -> [changes made while the index was being read]
+        self._lock = threading.Lock()
+
+    def peek(self, user_id: str):
+        """The resident index, whatever its version, or None. Never loads."""
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if index is not None:
+                self._indexes.move_to_end(user_id)
+            return index
+
+    def get(self, user_id: str) -> SimilarityIndex:
+        """The user's index at their current listing version, loading it if needed."""
+        index = self.peek(user_id)
+        try:
+            version = self.version_of(user_id)
+        except Exception as e:
+            print(f"Similarity Version Error: {e}")
+            return index or self._load(user_id, None)
+        if index is not None and index.version == version:
+            return index
+        return self._load(user_id, version)
+
+    def _load(self, user_id: str, version) -> SimilarityIndex:
+        with self._lock:
+            self._loading.setdefault(user_id, [])
+        try:
+            index = self.loader(user_id, version)
+        finally:
+            with self._lock:
+                changes = self._loading.pop(user_id, [])
+        # Uploads and deletes that landed while the query ran may be missing from it
+        for change in changes:
+            change(index)
+        if self.max_users > 0:
+            with self._lock:
+                self._indexes[user_id] = index
+                self._indexes.move_to_end(user_id)
+                while len(self._indexes) > self.max_users:
+                    self._indexes.popitem(last=False)
+        return index
+
+    def warm(self, user_id: str):
+        """Load the user's index on the executor unless it is resident or loading. Returns the Future, or None."""
+        with self._lock:
+            if user_id in self._indexes or user_id in self._loading:
+                return None
+            self._loading[user_id] = []
+        return self.executor.submit(self._warm, user_id)
+
+    def _warm(self, user_id: str):
+        try:
+            version = self.version_of(user_id)
+        except Exception as e:
+            print(f"Similarity Version Error: {e}")
+            version = None
+        try:
+            self._load(user_id, version)
+        except Exception as e:
+            print(f"Similarity Warm Error: {e}")
+
+    def _apply(self, user_id: str, change):
+        with self._lock:
+            index = self._indexes.get(user_id)
+            if user_id in self._loading:
+                self._loading[user_id].append(change)
+        if index is not None:
+            change(index)
+
+    def add(self, user_id: str, image_id: str, fingerprint: dict):
+        """Write-path hook; a no-op unless the user's index is loaded or loading."""
+        self._apply(user_id, lambda index: index.add(image_id, fingerprint))
+
+    def remove(self, user_id: str, image_id: str):
+        self._apply(user_id, lambda index: index.remove(image_id))
+
+    def clear(self):
+        with self._lock:
+            self._indexes.clear()
+
+
+similarity_indexes = SimilarityIndexCache()
+
+
+def find_near_duplicates(user_id: str, fingerprint: dict, limit: int = 5) -> list:
+    """
+    Upload-path check: the user's images within NEAR_DUPLICATE_DISTANCE, from
+    the resident index only. Never loads it (that's a query over the whole
+    gallery) or raises; if it isn't resident, warms it and finds nothing.
+    """
+    if not user_id or not fingerprint:
+        return []
+    try:
+        index = similarity_indexes.peek(user_id)
+        if index is None:
+            similarity_indexes.warm(user_id)
+            return []
+        return index.query(fingerprint, limit, max_distance=NEAR_DUPLICATE_DISTANCE)
+    except Exception as e:
+        print(f"Near Duplicate Check Error: {e}")
+        return []
@@ -0,0 +1,302 @@
+
+import os
+import time
+import random
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from services.gcs import get_firestore_client, get_firestore_collection, FIRESTORE_COLLECTION, transactional
+from services.tag_index import normalize_tag, MAX_BATCH_WRITES
+
+# Usage statistics kept up to date by uploads, tagging and deletes, so reading
+# them never scans the images collection.
+#
+# Layout:
+#   {STATS_COLLECTION}/global/shards/{0..STATS_SHARDS-1}  { "images", "guest_images", "users", "tags": {tag: int} }
+#   {STATS_COLLECTION}_users/{user_id}                      { "images": int, "tags": {tag: int} }
+#
+# Changes are collected in memory and applied by a background thread every
+# STATS_FLUSH_SECONDS, never on the request path. A flush updates each
+# changed user's doc in a transaction (which is how "users", the users with
+# at least one image, learns that a count crossed zero) and then adds
+# everything to one random global shard; reads sum the shards. The global
+# tag histogram is a map in the shards, one field per distinct tag, so
+# exempt "tags" from indexing on the shards collection group.
+#
+# Counters can drift (changes not yet flushed when an instance stops, a
+# failed write); scripts/reconcile_stats.py rebuilds them from the images.
+STATS_COLLECTION = os.getenv("STATS_COLLECTION", f"{FIRESTORE_COLLECTION}_stats")
+STATS_SHARDS = int(os.getenv("STATS_SHARDS", 10))
+STATS_TOP_TAGS = int(os.getenv("STATS_TOP_TAGS", 20))
+STATS_FLUSH_SECONDS = float(os.getenv("STATS_FLUSH_SECONDS", 2))
+# Global numbers may be this stale on a given worker
+STATS_CACHE_SECONDS = float(os.getenv("STATS_CACHE_SECONDS", 30))
+
+GLOBAL_COUNTERS = ["images", "guest_images", "users"]
+
+
+def _shards():
+    return get_firestore_client().collection(STATS_COLLECTION).document("global").collection("shards")
+
+
+def _users():
+    return get_firestore_client().collection(f"{STATS_COLLECTION}_users")
+
+
+def _tag_counts(tag_lists) -> Counter:
+    counts = Counter()
+    for tags in tag_lists:
+        counts.update(tag for tag in {normalize_tag(t) for t in tags or []} if tag)
+    return counts
+
+
+def _increments(counts: Counter) -> dict:
+    from google.cloud import firestore
+    return {tag: firestore.Increment(count) for tag, count in counts.items() if count}
+
+
+@transactional
+def _apply_user_change(transaction, user_id: str, images: int, tags: Counter) -> int:
+    """Update the user's doc; returns the change in the global "users" count (-1, 0 or 1)."""
+    user_ref = _users().document(user_id)
+    doc = user_ref.get(transaction=transaction)
+    before = doc.to_dict().get("images", 0) if doc.exists else 0
+    after = before + images
+    transaction.set(user_ref, {"images": after, "tags": _increments(tags)}, merge=True)
+    return int(after > 0) - int(before > 0)
+
+
+class StatsRecorder:
+    """Changes to the aggregates, summed in memory and written by a background thread."""
+
+    def __init__(self, interval: float = STATS_FLUSH_SECONDS):
+        self.interval = interval
+        self._pending = {}  # user_id (None for guests) -> [images, Counter of tags]
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add(self, user_id: str, images: int, tags: Counter):
+        with self._lock:
+            entry = self._pending.setdefault(user_id, [0, Counter()])
+            entry[0] += images
+            entry[1].update(tags)
+
+    def flush(self):
+        """Write everything added so far. Never raises; what fails to write is dropped (see reconcile)."""
+        from google.cloud import firestore
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return
+            totals = Counter()
+            tags = Counter()
+            db = get_firestore_client()
+            for user_id, (images, user_tags) in pending.items():
+                user_tags = Counter({tag: count for tag, count in user_tags.items() if count})
+                if not images and not user_tags:
+                    continue
+                if user_id:
+                    try:
+                        totals["users"] += _apply_user_change(db.transaction(), user_id, images, user_tags)
+                    except Exception as e:
+                        print(f"Stats Update Error ({user_id}): {e}")
+                        continue
+                else:
+                    totals["guest_images"] += images
+                totals["images"] += images
+                tags.update(user_tags)
+
+            update = {counter: firestore.Increment(totals[counter]) for counter in GLOBAL_COUNTERS if totals[counter]}
+            if tags:
+                update["tags"] = _increments(tags)
+            if update:
+                try:
+                    _shards().document(str(random.randrange(STATS_SHARDS))).set(update, merge=True)
+                except Exception as e:
+                    print(f"Stats Update Error: {e}")
+            global_stats.invalidate()
+
+    def start(self):
+        if self._thread:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="stats-recorder", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def clear(self):
+        with self._lock:
+            self._pending = {}
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+
+stats_recorder = StatsRecorder()
+
+
+def record_uploads(user_id: str, tag_lists: list):
+    """New images (one tag list each; empty while tagging is pending)."""
+    stats_recorder.add(user_id, len(tag_lists), _tag_counts(tag_lists))
+
+
+def record_tags(user_id: str, tags: list):
+    """Tags added to an image that was already counted (background tagging)."""
+    stats_recorder.add(user_id, 0, _tag_counts([tags]))
+
+
+def record_delete(user_id: str, tags: list):
+    stats_recorder.add(user_id, -1, Counter({tag: -count for tag, count in _tag_counts([tags]).items()}))
+
+
+def _top(counts: dict, limit: int) -> list:
+    ranked = sorted(((tag, count) for tag, count in counts.items() if count > 0), key=lambda item: (-item[1], item[0]))
+    return [{"tag": tag, "count": count} for tag, count in ranked[:limit]]
+
+
+def load_global_stats(limit: int = STATS_TOP_TAGS) -> dict:
+    """Sum of the shards: STATS_SHARDS document reads."""
+    totals = dict.fromkeys(GLOBAL_COUNTERS, 0)
+    tags = Counter()
+    for shard in _shards().stream():
+        data = shard.to_dict()
+        for counter in GLOBAL_COUNTERS:
+            totals[counter] += data.get(counter, 0)
+        tags.update(data.get("tags", {}))
+    totals["top_tags"] = _top(tags, limit)
+    return totals
+
+
+def user_stats(user_id: str, limit: int = STATS_TOP_TAGS) -> dict:
+    """One document read."""
+    doc = _users().document(user_id).get()
+    data = doc.to_dict() if doc.exists else {}
+    return {"images": data.get("images", 0), "top_tags": _top(data.get("tags", {}), limit)}
+
+
+class GlobalStatsCache:
+    """The global numbers, reloaded at most every STATS_CACHE_SECONDS per process."""
+
+    def __init__(self, max_age: float = STATS_CACHE_SECONDS, loader=load_global_stats):
+        self.max_age = max_age
+        self.loader = loader
+        self._value = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> dict:
+        with self._lock:
+            if self._value is not None and time.monotonic() - self._loaded_at < self.max_age:
+                return self._value
+        value = self.loader()
+        with self._lock:
+            self._value, self._loaded_at = value, time.monotonic()
+        return value
+
+    def invalidate(self):
+        """This process's own writes show up on its next read."""
+        with self._lock:
+            self._value = None
+
+    def clear(self):
+        self.invalidate()
+
+
+global_stats = GlobalStatsCache()
+
+
+def _created_at_bounds():
+    from google.cloud import firestore
+    collection = get_firestore_collection()
+    first = list(collection.order_by("created_at").limit(1).select(["created_at"]).stream())
+    last = list(collection.order_by("created_at", direction=firestore.Query.DESCENDING).limit(1).select(["created_at"]).stream())
+    if not first:
+        return None
+    return first[0].get("created_at"), last[0].get("created_at")
+
+
+def _count_partition(start, end, inclusive: bool):
+    """Aggregates of the images created in [start, end) (or [start, end])."""
+    query = (
+        get_firestore_collection()
+        .where("created_at", ">=", start)
+        .where("created_at", "<=" if inclusive else "<", end)
+        .select(["user_id", "tags"])
+    )
+    totals = Counter()
+    user_images = Counter()
+    user_tags = {}
+    tags = Counter()
+    for doc in query.stream():
+        data = doc.to_dict()
+        image_tags = _tag_counts([data.get("tags")])
+        user_id = data.get("user_id")
+        totals["images"] += 1
+        tags.update(image_tags)
+        if user_id:
+            user_images[user_id] += 1
+            user_tags.setdefault(user_id, Counter()).update(image_tags)
+        else:
+            totals["guest_images"] += 1
+    return totals, user_images, user_tags, tags
+
+
+def _commit(writes: list):
+    """writes: (op, ref, data) applied with WriteBatches of up to MAX_BATCH_WRITES."""
+    db = get_firestore_client()
+    for start in range(0, len(writes), MAX_BATCH_WRITES):
+        batch = db.batch()
+        for op, ref, data in writes[start:start + MAX_BATCH_WRITES]:
+            if op == "delete":
+                batch.delete(ref)
+            else:
+                batch.set(ref, data)
+        batch.commit()
+
+
+def rebuild_stats(partitions: int = 16, workers: int = 8) -> dict:
+    """
+    Recompute every aggregate from the image docs and overwrite the stored
+    ones. The images are read in `partitions` created_at ranges, `workers`
+    at a time. Uploads and deletes while it runs (or not yet flushed by a
+    StatsRecorder) can be missed; run it when traffic is low. Returns the
+    new global counters.
+    """
+    bounds = _created_at_bounds()
+    results = []
+    if bounds is not None:
+        first, last = bounds
+        span_seconds = (last - first).total_seconds()
+        partitions = max(1, partitions if span_seconds > 0 else 1)
+        edges = [first + (last - first) * i / partitions for i in range(partitions)] + [last]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(
+                lambda i: _count_partition(edges[i], edges[i + 1], i == partitions - 1), range(partitions)
+            ))
+
+    totals, user_images, user_tags, tags = Counter(), Counter(), {}, Counter()
+    for part_totals, part_images, part_user_tags, part_tags in results:
+        totals.update(part_totals)
+        user_images.update(part_images)
+        tags.update(part_tags)
+        for user_id, counts in part_user_tags.items():
+            user_tags.setdefault(user_id, Counter()).update(counts)
+
+    counters = {"images": totals["images"], "guest_images": totals["guest_images"], "users": len(user_images)}
+    empty = {**dict.fromkeys(GLOBAL_COUNTERS, 0), "tags": {}}
+    writes = [("set", _shards().document(str(i)), {**counters, "tags": dict(tags)} if i == 0 else empty) for i in range(STATS_SHARDS)]
+    writes += [("set", _users().document(user_id), {"images": count, "tags": dict(user_tags[user_id])}) for user_id, count in user_images.items()]
+    writes += [("delete", doc.reference, None) for doc in _users().select([]).stream() if doc.id not in user_images]
+    _commit(writes)
+    global_stats.invalidate()
+    return counters
@@ -0,0 +1,130 @@
+
+import os
+from services.gcs import get_firestore_client, FIRESTORE_COLLECTION
+from services.tag_search import TagMatrix, tag_matrices
+
+# Inverted tag index, kept per user so /search never scans a whole gallery.
+#
+# Layout (one root doc per user):
+#   {TAG_INDEX_COLLECTION}/{user_id}                  { "ready": bool, "version": int }
+#   {TAG_INDEX_COLLECTION}/{user_id}/tags/{hex(tag)}  { "tag": str, "image_ids": [..] }
+#
+# Ranked search (services.tag_search) runs on an in-memory matrix built from
+# the tag postings. Every write bumps the root doc's version; this process
+# applies its own writes to its matrix as well, and a search that finds a
+# version it hasn't seen (another worker wrote) reloads the matrix.
+TAG_INDEX_COLLECTION = os.getenv("TAG_INDEX_COLLECTION", f"{FIRESTORE_COLLECTION}_tag_index")
+MAX_BATCH_WRITES = 500  # Firestore WriteBatch limit
+
+
+def normalize_tag(tag) -> str:
+    return str(tag).strip().lower()
+
+
+def _doc_id(value: str) -> str:
+    """Tags may contain '/' or be '.', neither of which is a valid doc id."""
+    return value.encode("utf-8").hex()
+
+
+def _user_ref(user_id: str):
+    return get_firestore_client().collection(TAG_INDEX_COLLECTION).document(user_id)
+
+
+def _commit_in_chunks(writes: list):
+    """writes: list of (doc_ref, data) merged via WriteBatch, chunked to the batch limit."""
+    db = get_firestore_client()
+    for start in range(0, len(writes), MAX_BATCH_WRITES):
+        batch = db.batch()
+        for ref, data in writes[start:start + MAX_BATCH_WRITES]:
+            batch.set(ref, data, merge=True)
+        batch.commit()
+
+
+def index_state(user_id: str):
+    """(ready, version) of the user's index, in one read."""
+    doc = _user_ref(user_id).get()
+    data = doc.to_dict() if doc.exists else {}
+    return bool(data.get("ready")), data.get("version", 0)
+
+
+def set_index_ready(user_id: str, ready: bool):
+    _user_ref(user_id).set({"ready": ready}, merge=True)
+
+
+def index_images(user_id: str, images: dict):
+    """Add postings for {image_id: [tags]}, bumping the version once for all of them."""
+    from google.cloud import firestore
+    user_ref = _user_ref(user_id)
+    tags_col = user_ref.collection("tags")
+
+    tag_to_ids = {}
+    for image_id, tags in images.items():
+        for tag in {normalize_tag(t) for t in tags or []}:
+            if tag:
+                tag_to_ids.setdefault(tag, []).append(image_id)
+    if not tag_to_ids:
+        return
+
+    writes = [
+        (tags_col.document(_doc_id(tag)), {"tag": tag, "image_ids": firestore.ArrayUnion(image_ids)})
+        for tag, image_ids in tag_to_ids.items()
+    ]
+    writes.append((user_ref, {"version": firestore.Increment(1)}))
+
+    _commit_in_chunks(writes)
+
+    def add(matrix):
+        for image_id, tags in images.items():
+            matrix.add(image_id, tags)
+    tag_matrices.apply(user_id, add)
+
+
+def index_image_tags(user_id: str, image_id: str, tags: list):
+    """Write-path hook for a single uploaded image. Never raises."""
+    index_uploads(user_id, {image_id: tags})
+
+
+def index_uploads(user_id: str, images: dict):
+    """
+    Write-path hook for {image_id: [tags]} of new uploads. Never raises: on
+    failure the index is marked not ready so the next search rebuilds it from a scan.
+    """
+    try:
+        index_images(user_id, images)
+    except Exception as e:
+        print(f"Tag Index Update Error: {e}")
+        try:
+            set_index_ready(user_id, False)
+        except Exception as e:
+            print(f"Tag Index Reset Error: {e}")
+
+
+def remove_image_tags(user_id: str, image_id: str, tags: list):
+    """Drop an image from its tag postings (emptied postings are left as-is)."""
+    from google.cloud import firestore
+    user_ref = _user_ref(user_id)
+    tags_col = user_ref.collection("tags")
+    writes = [
+        (tags_col.document(_doc_id(tag)), {"image_ids": firestore.ArrayRemove([image_id])})
+        for tag in {normalize_tag(t) for t in tags or []} if tag
+    ]
+    writes.append((user_ref, {"version": firestore.Increment(1)}))
+    _commit_in_chunks(writes)
+    tag_matrices.apply(user_id, lambda matrix: matrix.remove(image_id))
+
+
+def load_tag_matrix(user_id: str, version: int) -> TagMatrix:
+    """The user's search matrix at `version`: the cached one if current, else rebuilt from the tag postings."""
+    matrix = tag_matrices.get(user_id)
+    if matrix is not None and matrix.version == version:
+        return matrix
+
+    images = {}
+    for snap in _user_ref(user_id).collection("tags").stream():
+        data = snap.to_dict()
+        for image_id in data.get("image_ids", []):
+            images.setdefault(image_id, []).append(data.get("tag", ""))
+    # Writes landing during the read bump the version past `version`, so the next search reloads
+    matrix = TagMatrix.from_images(images, version)
+    tag_matrices.put(user_id, matrix)
+    return matrix
@@ -0,0 +1,272 @@
+
+import os
+import re
+import zlib
+import threading
+from array import array
+from collections import OrderedDict
+
+# Ranked tag search over an in-memory matrix of one user's images x tag words.
+#
+# Each query term is matched against the user's word vocabulary: exactly,
+# as a substring, by trigram similarity or within one edit (typos). Images
+# score the sum of sim(term, word) * idf(word) over their matching words,
+# scaled by the share of query terms they match and damped by how many words
+# they have. Postings and trigram postings are append-only arrays, so an
+# upload adds to the matrix in place; a query is a handful of NumPy
+# concatenations and one bincount per term.
+TAG_SEARCH_MIN_SIMILARITY = float(os.getenv("TAG_SEARCH_MIN_SIMILARITY", 0.4))
+TAG_SEARCH_MAX_TERMS = int(os.getenv("TAG_SEARCH_MAX_TERMS", 8))
+TAG_SEARCH_MAX_USERS = int(os.getenv("TAG_SEARCH_MAX_USERS", 1000))
+
+# Term/word similarities; trigram similarity is scaled by FUZZY_WEIGHT
+EXACT_WEIGHT = 1.0
+TYPO_WEIGHT = 0.6
+FUZZY_WEIGHT = 0.8
+
+_SEPARATORS = re.compile(r"[\s,;]+")
+
+
+def split_words(text) -> list:
+    """Lowercased words of a tag or query, in order, without repeats."""
+    words = []
+    for word in _SEPARATORS.split(str(text).strip().lower()):
+        if word and word not in words:
+            words.append(word)
+    return words
+
+
+def word_trigrams(word: str) -> set:
+    """Trigrams of the word padded as "  word ", so short words and word edges count too."""
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def within_one_edit(a: str, b: str) -> bool:
+    """True if one insertion, deletion, substitution or adjacent swap turns a into b."""
+    if a == b:
+        return True
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    if len(a) == len(b):
+        return a[i + 1:] == b[i + 1:] or (a[i + 1:i + 2] == b[i:i + 1] and a[i:i + 1] == b[i + 1:i + 2] and a[i + 2:] == b[i + 2:])
+    return a[i:] == b[i + 1:]
+
+
+class TagMatrix:
+    """
+    One user's images x words postings. Thread-safe. version is the index
+    version the matrix reflects (None if unknown), see services.tag_index.
+    """
+
+    def __init__(self, version=None):
+        self.version = version
+        self.lock = threading.RLock()
+        self.image_ids = []
+        self._image_index = {}
+        self._image_words = []        # per image: set of word indices
+        self._alive = array("b")      # 0 once removed; indices are never reused
+        self._lengths = array("i")    # words per image
+        self._tiebreak = array("I")   # crc32 of the id: equal scores rank the same on every worker
+        self.words = []
+        self._word_index = {}
+        self._postings = []           # per word: array of image indices
+        self._df = array("i")         # live images per word
+        self._word_lengths = array("i")
+        self._gram_counts = array("i")
+        self._gram_words = {}         # trigram -> array of word indices
+        self._live = 0
+
+    @classmethod
+    def from_images(cls, images: dict, version=None) -> "TagMatrix":
+        """Matrix for {image_id: [tags]}."""
+        matrix = cls(version)
+        for image_id in sorted(images):
+            matrix.add(image_id, images[image_id])
+        return matrix
+
+    def __len__(self):
+        return self._live
+
+    def _word(self, word: str) -> int:
+        index = self._word_index.get(word)
+        if index is None:
+            index = self._word_index[word] = len(self.words)
+            self.words.append(word)
+            self._postings.append(array("i"))
+            self._df.append(0)
+            self._word_lengths.append(len(word))
+            grams = word_trigrams(word)
+            self._gram_counts.append(len(grams))
+            for gram in grams:
+                self._gram_words.setdefault(gram, array("i")).append(index)
+        return index
+
+    def add(self, image_id: str, tags: list):
+        """Add an image, or more tags to one already in the matrix."""
+        with self.lock:
+            index = self._image_index.get(image_id)
+            if index is None or not self._alive[index]:
+                index = self._image_index[image_id] = len(self.image_ids)
+                self.image_ids.append(image_id)
+                self._image_words.append(set())
+                self._alive.append(1)
+                self._lengths.append(0)
+                self._tiebreak.append(zlib.crc32(image_id.encode("utf-8")))
+                self._live += 1
+            words = self._image_words[index]
+            for tag in tags or []:
+                for word in split_words(tag):
+                    word_index = self._word(word)
+                    if word_index in words:
+                        continue
+                    words.add(word_index)
+                    self._postings[word_index].append(index)
+                    self._df[word_index] += 1
+                    self._lengths[index] += 1
+
+    def remove(self, image_id: str):
+        with self.lock:
+            index = self._image_index.pop(image_id, None)
+            if index is None or not self._alive[index]:
+                return
+            self._alive[index] = 0
+            self._live -= 1
+            # Its postings stay behind; removed images are masked out when scoring
+            for word_index in self._image_words[index]:
+                self._df[word_index] -= 1
+
+    def _match_words(self, term: str, np):
+        """(word indices, similarities) of vocabulary words matching the term."""
+        word_lengths = np.array(self._word_lengths, dtype=np.int32)
+        if len(term) < 3:
+            # Too short for trigrams to say anything; substring matches only
+            indices = np.array([i for i, word in enumerate(self.words) if term in word], dtype=np.intp)
+            return indices, 0.5 + 0.4 * len(term) / word_lengths[indices]
+
+        grams = word_trigrams(term)
+        postings = [self._gram_words[g] for g in grams if g in self._gram_words]
+        if not postings:
+            return np.zeros(0, dtype=np.intp), np.zeros(0)
+        shared = np.bincount(np.concatenate([np.frombuffer(p, dtype=np.int32) for p in postings]), minlength=len(self.words))
+        candidates = np.flatnonzero(shared)
+        shared = shared[candidates]
+        lengths = word_lengths[candidates]
+        similarity = shared / (np.array(self._gram_counts, dtype=np.int32)[candidates] + len(grams) - shared)
+        weights = np.where(similarity >= TAG_SEARCH_MIN_SIMILARITY, FUZZY_WEIGHT * similarity, 0.0)
+
+        # A word containing the term has every inner trigram of it
+        possible = np.flatnonzero((shared >= len(term) - 2) & (lengths >= len(term)))
+        contains = possible[[term in self.words[w] for w in candidates[possible].tolist()]]
+        weights[contains] = np.maximum(weights[contains], 0.5 + 0.4 * len(term) / lengths[contains])
+        # One edit (a swap counts as one) changes at most four padded trigrams
+        typo = (weights == 0) & (np.abs(lengths - len(term)) <= 1) & (shared >= len(grams) - 4)
+        typo = np.flatnonzero(typo)
+        weights[typo[[within_one_edit(term, self.words[w]) for w in candidates[typo].tolist()]]] = TYPO_WEIGHT
+
+        exact = self._word_index.get(term)
+        if exact is not None:
+            weights[np.searchsorted(candidates, exact)] = EXACT_WEIGHT
+        keep = weights > 0
+        return candidates[keep], weights[keep]
+
+    def search(self, query: str, limit: int, offset: int = 0):
+        """
+        Images ranked by relevance to the query, best first (ties in a fixed
+        order). Returns ([(image_id, score)], has_more).
+        """
+        import numpy as np
+
+        terms = split_words(query)[:TAG_SEARCH_MAX_TERMS]
+        with self.lock:
+            count = len(self.image_ids)
+            if not terms or not self._live:
+                return [], False
+            live = self._live
+            total = np.zeros(count)
+            matched_terms = np.zeros(count)
+            for term in terms:
+                word_indices, similarity = self._match_words(term, np)
+                if not len(word_indices):
+                    continue
+                word_indices = word_indices.tolist()
+                # Views of the posting arrays must be gone before the lock is released:
+                # an array can't grow while exporting its buffer
+                postings = [np.frombuffer(self._postings[w], dtype=np.int32) for w in word_indices]
+                images = np.concatenate(postings)
+                sizes = [len(p) for p in postings]
+                del postings
+                df = np.array(self._df, dtype=np.float64)[word_indices]
+                idf = np.log((live + 1) / (df + 1)) + 1
+                weights = similarity * idf
+                term_scores = np.bincount(images, weights=np.repeat(weights, sizes), minlength=count)
+                total += term_scores
+                matched_terms += term_scores > 0
+            alive = np.array(self._alive, dtype=bool)
+            lengths = np.array(self._lengths, dtype=np.float64)
+            tiebreak = np.array(self._tiebreak, dtype=np.uint32)
+            image_ids = self.image_ids
+
+        scores = total * (matched_terms / len(terms)) / np.sqrt(np.maximum(lengths, 1))
+        scores[~alive] = 0
+        candidates = np.flatnonzero(scores > 0)
+        # Rounded so float summation order can't reorder ties between workers
+        ranked_scores = np.round(scores[candidates], 9)
+        order = candidates[np.lexsort((tiebreak[candidates], -ranked_scores))]
+        page = order[offset:offset + limit]
+        results = [(image_ids[i], float(scores[i])) for i in page.tolist()]
+        return results, len(order) > offset + limit
+
+
+class TagMatrixCache:
+    """LRU of per-user TagMatrix objects."""
+
+    def __init__(self, max_users: int = TAG_SEARCH_MAX_USERS):
+        self.max_users = max_users
+        self._matrices = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: str):
+        with self._lock:
+            matrix = self._matrices.get(user_id)
+            if matrix is not None:
+                self._matrices.move_to_end(user_id)
+            return matrix
+
+    def put(self, user_id: str, matrix: TagMatrix):
+        if self.max_users <= 0:
+            return
+        with self._lock:
+            self._matrices[user_id] = matrix
+            self._matrices.move_to_end(user_id)
+            while len(self._matrices) > self.max_users:
+                self._matrices.popitem(last=False)
+
+    def apply(self, user_id: str, change):
+        """
+        change(matrix) on the user's matrix if one is loaded, counted as one
+        index version (the caller has just bumped the stored version once).
+        """
+        matrix = self.get(user_id)
+        if matrix is None:
+            return
+        with matrix.lock:
+            change(matrix)
+            if matrix.version is not None:
+                matrix.version += 1
+
+    def pop(self, user_id: str):
+        with self._lock:
+            self._matrices.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._matrices.clear()
+
+
+tag_matrices = TagMatrixCache()
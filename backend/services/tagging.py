@@ -0,0 +1,323 @@
+
+import os
+import time
+import json
+import random
+import sqlite3
+import threading
+from contextlib import closing
+from dataclasses import dataclass, asdict
+from datetime import datetime, timedelta, timezone
+from services.job_queue import JobQueue, InMemoryJobQueue
+from services.gcs import get_bucket, get_firestore_client, get_firestore_collection, transactional
+from services.analyze import request_tags, encode_for_vision
+from services.circuit_breaker import CircuitOpenError
+from services.tag_index import index_image_tags
+from services.dedup import digest_cache
+from services.listing_cache import listing_cache
+from services.stats import record_tags
+
+# Background tagging: /upload?async_tagging=true stores the image with
+# tag_status "pending" and returns; a worker pool fills the tags in later.
+#
+# Note for Cloud Run: workers only make progress while the instance has CPU,
+# so deploy with CPU always allocated (or min instances) when using this mode.
+ASYNC_TAGGING = os.getenv("ASYNC_TAGGING", "false").lower() == "true"  # default for /upload
+TAGGING_QUEUE_BACKEND = os.getenv("TAGGING_QUEUE_BACKEND", "memory")  # memory | sqlite
+TAGGING_QUEUE_PATH = os.getenv("TAGGING_QUEUE_PATH", "tagging_queue.sqlite3")
+TAGGING_WORKERS = int(os.getenv("TAGGING_WORKERS", 4))
+TAGGING_MAX_ATTEMPTS = int(os.getenv("TAGGING_MAX_ATTEMPTS", 5))
+TAGGING_BACKOFF_SECONDS = float(os.getenv("TAGGING_BACKOFF_SECONDS", 2))
+TAGGING_BACKOFF_MAX_SECONDS = float(os.getenv("TAGGING_BACKOFF_MAX_SECONDS", 300))
+# Jobs in the memory queue are lost when an instance stops. Docs still
+# "pending" TAGGING_STALE_SECONDS after upload (or after they were last
+# requeued) are queued again by a sweeper every TAGGING_SWEEP_INTERVAL_SECONDS;
+# a transaction on the doc keeps two instances from both requeueing it.
+# Needs a composite index on (tag_status, created_at).
+TAGGING_STALE_SECONDS = float(os.getenv("TAGGING_STALE_SECONDS", 1800))
+TAGGING_SWEEP_INTERVAL_SECONDS = float(os.getenv("TAGGING_SWEEP_INTERVAL_SECONDS", 600))
+TAGGING_SWEEP_LIMIT = int(os.getenv("TAGGING_SWEEP_LIMIT", 200))
+
+# Values stored in the image doc's "tag_status" field
+TAG_STATUS_PENDING = "pending"
+TAG_STATUS_DONE = "done"
+TAG_STATUS_FAILED = "failed"
+
+
+@dataclass
+class TaggingJob:
+    image_id: str
+    blob_name: str
+    extension: str
+    user_id: str = None
+    digest: str = None  # sha256 of the content, to cache the tags by
+    attempts: int = 0
+    job_id: int = None  # set by queues that need it to ack
+
+
+class SQLiteJobQueue(JobQueue):
+    """
+    Durable single-host queue. Dequeued jobs are leased; a job whose worker died
+    becomes visible again once its lease expires.
+    """
+
+    LEASE_SECONDS = 600
+    POLL_SECONDS = 0.5
+
+    def __init__(self, path: str):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS tagging_jobs ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                " payload TEXT NOT NULL,"
+                " due_at REAL NOT NULL,"
+                " leased_until REAL)"
+            )
+
+    def _connect(self):
+        # Autocommit; explicit BEGIN IMMEDIATE where a read must be atomic with a write
+        return closing(sqlite3.connect(self.path, timeout=30, isolation_level=None))
+
+    def enqueue(self, job, delay=0):
+        payload = asdict(job)
+        payload.pop("job_id")
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO tagging_jobs (payload, due_at) VALUES (?, ?)",
+                (json.dumps(payload), time.time() + delay),
+            )
+
+    def dequeue(self, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self._lease()
+            if job is not None or time.monotonic() >= deadline:
+                return job
+            time.sleep(self.POLL_SECONDS)
+
+    def _lease(self):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    "SELECT id, payload FROM tagging_jobs"
+                    " WHERE due_at <= ? AND (leased_until IS NULL OR leased_until < ?)"
+                    " ORDER BY due_at LIMIT 1",
+                    (now, now),
+                ).fetchone()
+                if row is not None:
+                    conn.execute("UPDATE tagging_jobs SET leased_until = ? WHERE id = ?", (now + self.LEASE_SECONDS, row[0]))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        return TaggingJob(job_id=row[0], **json.loads(row[1]))
+
+    def complete(self, job):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM tagging_jobs WHERE id = ?", (job.job_id,))
+
+    def retry(self, job, delay):
+        payload = asdict(job)
+        payload.pop("job_id")
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE tagging_jobs SET payload = ?, due_at = ?, leased_until = NULL WHERE id = ?",
+                (json.dumps(payload), time.time() + delay, job.job_id),
+            )
+
+    def size(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM tagging_jobs").fetchone()[0]
+
+
+QUEUE_BACKENDS = {
+    "memory": lambda: InMemoryJobQueue(),
+    "sqlite": lambda: SQLiteJobQueue(TAGGING_QUEUE_PATH),
+}
+
+
+def create_queue(backend: str = TAGGING_QUEUE_BACKEND) -> JobQueue:
+    if backend not in QUEUE_BACKENDS:
+        raise ValueError(f"Unknown TAGGING_QUEUE_BACKEND: {backend}")
+    return QUEUE_BACKENDS[backend]()
+
+
+def backoff_delay(attempts: int) -> float:
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(TAGGING_BACKOFF_MAX_SECONDS, TAGGING_BACKOFF_SECONDS * 2 ** attempts))
+
+
+@transactional
+def _store_tags(transaction, doc_ref, tags: list, vision_stats: dict) -> bool:
+    """Store the result; True only for the call that took the image from pending to done."""
+    from google.api_core.exceptions import NotFound
+    doc = doc_ref.get(transaction=transaction)
+    if not doc.exists:
+        raise NotFound(f"Image {doc_ref.id} was deleted")
+    first = doc.to_dict().get("tag_status") == TAG_STATUS_PENDING
+    transaction.update(doc_ref, {"tags": tags, "tag_status": TAG_STATUS_DONE, "vision_stats": vision_stats})
+    return first
+
+
+def tag_job(job: TaggingJob):
+    """Run the vision model for one queued image and store the result. Raises on failure."""
+    doc_ref = get_firestore_collection().document(job.image_id)
+    content = get_bucket().blob(job.blob_name).download_as_bytes()
+    base64_image, extension, vision_stats = encode_for_vision(content, job.extension)
+    tags = request_tags(base64_image, extension)
+
+    if _store_tags(get_firestore_client().transaction(), doc_ref, tags, vision_stats):
+        # Once per image, however often the job is retried or requeued
+        record_tags(job.user_id, tags)
+    if job.user_id:
+        index_image_tags(job.user_id, job.image_id, tags)
+        listing_cache.bump(job.user_id)
+    if job.digest:
+        try:
+            digest_cache.remember(job.digest, tags=tags)
+        except Exception as e:
+            print(f"Digest Update Error: {e}")
+
+
+class TaggingWorkerPool:
+    """Fixed number of threads draining a JobQueue with bounded retries."""
+
+    def __init__(self, queue: JobQueue, workers: int = TAGGING_WORKERS, max_attempts: int = TAGGING_MAX_ATTEMPTS, handler=tag_job):
+        self.queue = queue
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.handler = handler
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        if self._threads:
+            return
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"tagging-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 5):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                job = self.queue.dequeue(timeout=1)
+            except Exception as e:
+                print(f"Tagging Queue Error: {e}")
+                time.sleep(1)
+                continue
+            if job is not None:
+                self.process(job)
+
+    def process(self, job: TaggingJob):
+        from google.api_core.exceptions import NotFound
+        try:
+            self.handler(job)
+            self.queue.complete(job)
+        except NotFound:
+            # Image was deleted before it was tagged
+            self.queue.complete(job)
+        except CircuitOpenError as e:
+            # Upstream is down; wait it out without using up the job's attempts
+            self.queue.retry(job, e.retry_after + random.uniform(0, TAGGING_BACKOFF_SECONDS))
+        except Exception as e:
+            job.attempts += 1
+            if job.attempts >= self.max_attempts:
+                print(f"Tagging failed for {job.image_id} after {job.attempts} attempts: {e}")
+                self._mark_failed(job)
+                self.queue.complete(job)
+            else:
+                self.queue.retry(job, backoff_delay(job.attempts))
+
+    def _mark_failed(self, job: TaggingJob):
+        try:
+            get_firestore_collection().document(job.image_id).update({"tag_status": TAG_STATUS_FAILED})
+        except Exception as e:
+            print(f"Tagging Status Error: {e}")
+        listing_cache.bump(job.user_id)
+
+
+tagging_queue = create_queue()
+tagging_workers = TaggingWorkerPool(tagging_queue)
+
+
+def enqueue_tagging(image_id: str, blob_name: str, extension: str, user_id: str = None, digest: str = None):
+    tagging_queue.enqueue(TaggingJob(image_id=image_id, blob_name=blob_name, extension=extension, user_id=user_id, digest=digest))
+
+
+@transactional
+def _claim_stale(transaction, doc_ref, cutoff):
+    """The doc's data if it is still pending and wasn't queued since cutoff; marks it queued now."""
+    from google.cloud import firestore
+    doc = doc_ref.get(transaction=transaction)
+    if not doc.exists:
+        return None
+    data = doc.to_dict()
+    queued_at = data.get("tag_queued_at") or data.get("created_at")
+    if data.get("tag_status") != TAG_STATUS_PENDING or queued_at is None or queued_at >= cutoff:
+        return None
+    transaction.update(doc_ref, {"tag_queued_at": firestore.SERVER_TIMESTAMP})
+    return data
+
+
+def requeue_stale_pending(stale_seconds: float = TAGGING_STALE_SECONDS, limit: int = TAGGING_SWEEP_LIMIT) -> int:
+    """Queue tagging again for up to `limit` images stuck in "pending". Returns how many were queued."""
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=stale_seconds)
+    collection = get_firestore_collection()
+    query = collection.where("tag_status", "==", TAG_STATUS_PENDING).where("created_at", "<", cutoff)
+    db = get_firestore_client()
+    requeued = 0
+    for doc in query.stream():
+        if requeued >= limit:
+            break
+        data = _claim_stale(db.transaction(), doc.reference, cutoff)
+        if data is None or not data.get("blob_name"):
+            continue
+        blob_name = data["blob_name"]
+        enqueue_tagging(doc.id, blob_name, blob_name.rsplit(".", 1)[-1], data.get("user_id"), data.get("sha256"))
+        requeued += 1
+    return requeued
+
+
+class PendingSweeper:
+    """Background thread running requeue_stale_pending periodically."""
+
+    def __init__(self, interval: float = TAGGING_SWEEP_INTERVAL_SECONDS):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="tagging-sweeper", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                requeue_stale_pending()
+            except Exception as e:
+                print(f"Tagging Sweep Error: {e}")
+
+
+pending_sweeper = PendingSweeper()
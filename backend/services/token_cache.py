@@ -0,0 +1,162 @@
+
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from services.firebase_app import get_firebase_app
+from services.metrics import span
+
+# Decoded claims of recently verified ID tokens, so a page load that sends the
+# same token with every request verifies its signature once. Entries expire at
+# the token's own exp, which is all verify_id_token() checks without
+# check_revoked. Keys are SHA-256 digests; raw tokens are never held.
+TOKEN_CACHE_MAX_ENTRIES = int(os.getenv("TOKEN_CACHE_MAX_ENTRIES", 10000))
+# Google rotates the signing certs every few hours and serves them with a
+# max-age of about that; re-fetching them well before then keeps the fetch
+# off the request path.
+AUTH_CERT_REFRESH_SECONDS = float(os.getenv("AUTH_CERT_REFRESH_SECONDS", 1800))
+
+
+def _verify_with_firebase(token: str) -> dict:
+    # firebase_admin is imported on first use (here and in _cert_request):
+    # importing it takes ~180ms, which would otherwise land in the cold start
+    from firebase_admin import auth
+    get_firebase_app()
+    return auth.verify_id_token(token)
+
+
+def token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+class TokenCache:
+    """Bounded LRU of token digest -> claims, with hit/miss counters."""
+
+    def __init__(self, max_entries: int = TOKEN_CACHE_MAX_ENTRIES, verify=None):
+        self.max_entries = max_entries
+        self.verify = verify or _verify_with_firebase
+        self._entries = OrderedDict()  # digest -> (expires_at, claims)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+        self.verify_seconds = 0.0  # time spent in verify() on misses
+
+    def _get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] <= time.time():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def verify_id_token(self, token: str) -> dict:
+        """Cached auth.verify_id_token(); raises whatever it raises. Failures aren't cached."""
+        key = token_digest(token)
+        claims = self._get(key)
+        if claims is not None:
+            return claims
+
+        started = time.perf_counter()
+        try:
+            with span("auth", "verify_token", backend="firebase_auth"):
+                claims = self.verify(token)
+        except Exception:
+            with self._lock:
+                self.failures += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.verify_seconds += elapsed
+
+        with self._lock:
+            self._entries[key] = (claims["exp"], claims)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return claims
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            avg_verify = self.verify_seconds / self.misses if self.misses else 0.0
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "failures": self.failures,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "verify_seconds": self.verify_seconds,
+                # Rough: every hit would otherwise have cost an average verify
+                "verify_seconds_saved": self.hits * avg_verify,
+            }
+
+
+token_cache = TokenCache()
+
+
+def _cert_request(app=None):
+    # firebase_admin fetches certs through a cachecontrol session on its
+    # TokenVerifier; refreshing through the same session updates that cache.
+    # There's no public hook for this: _token_gen.ID_TOKEN_CERT_URI,
+    # auth._get_client and TokenVerifier.request are private as of
+    # firebase-admin==6.4.0 (pinned in requirements.txt).
+    # test_token_cache.test_cert_refresh_internals_exist fails if an upgrade
+    # moves them; re-check this when bumping the pin.
+    from firebase_admin import auth
+    client = auth._get_client(app or get_firebase_app())
+    return client._token_verifier.request
+
+
+def refresh_signing_certs():
+    """Re-fetch the ID token signing certs into firebase_admin's HTTP cache. Never raises."""
+    try:
+        from firebase_admin._token_gen import ID_TOKEN_CERT_URI
+        response = _cert_request()(ID_TOKEN_CERT_URI, method="GET", headers={"Cache-Control": "no-cache"})
+        if response.status != 200:
+            print(f"Cert Refresh Error: HTTP {response.status}")
+    except Exception as e:
+        print(f"Cert Refresh Error: {e}")
+
+
+class CertRefresher:
+    """Background thread keeping the signing certs fresh."""
+
+    def __init__(self, interval: float = AUTH_CERT_REFRESH_SECONDS):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="auth-certs", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        # First fetch right away so the first request doesn't pay for it
+        refresh_signing_certs()
+        while not self._stop.wait(self.interval):
+            refresh_signing_certs()
+
+
+cert_refresher = CertRefresher()
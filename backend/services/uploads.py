@@ -0,0 +1,398 @@
+
+import io
+import os
+import uuid
+import asyncio
+import threading
+from dataclasses import dataclass, field
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from services.gcs import get_firestore_client, get_firestore_collection
+from services.analyze import analyze_image_with_vision, encode_for_vision, VisionUnavailable
+from services.executor import run_blocking, vision_executor
+from services.tagging import enqueue_tagging, TAG_STATUS_PENDING, TAG_STATUS_DONE
+from services.tag_index import index_image_tags, index_uploads
+from services.dedup import digest_cache, sha256_upload, upload_owner
+from services.derivatives import THUMBNAIL_WIDTH, generate_derivatives
+from services.listing_cache import listing_cache
+from services.metrics import span
+from services.similarity import fingerprint_preview, find_near_duplicates, similarity_indexes
+from services.image_info import open_preview, describe_preview, IMAGE_INFO_FIELDS
+from services.stats import record_uploads
+
+# /upload/batch: files processed at once, and image docs per Firestore WriteBatch commit
+BATCH_UPLOAD_CONCURRENCY = int(os.getenv("BATCH_UPLOAD_CONCURRENCY", 4))
+BATCH_UPLOAD_MAX_FILES = int(os.getenv("BATCH_UPLOAD_MAX_FILES", 200))
+BATCH_WRITE_SIZE = int(os.getenv("BATCH_WRITE_SIZE", 20))
+# How long a finished file waits for others so their docs share one commit
+BATCH_LINGER_SECONDS = float(os.getenv("BATCH_LINGER_SECONDS", 0.25))
+
+# Largest image accepted, and largest /upload/batch request body. Bodies are
+# refused by Content-Length before they're read, or as soon as a chunked body
+# goes over. Starlette spools form files to disk past 1 MiB and uploads are
+# streamed from there, so these bound disk use rather than memory.
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 20 * 1024 * 1024))
+MAX_BATCH_UPLOAD_BYTES = int(os.getenv("MAX_BATCH_UPLOAD_BYTES", 200 * 1024 * 1024))
+# Room for the multipart boundaries and headers around a single file
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+# Files larger than this go to GCS as a resumable upload sent in chunks of
+# this size (a multiple of 256 KiB); smaller ones in a single request.
+GCS_UPLOAD_CHUNK_BYTES = int(os.getenv("GCS_UPLOAD_CHUNK_BYTES", 8 * 1024 * 1024))
+
+
+@dataclass
+class Uploader:
+    user_id: str = None  # None for guests
+    user_email: str = "guest"
+    ip: str = None
+
+    @property
+    def owner(self) -> str:
+        return upload_owner(self.user_id, self.ip)
+
+
+@dataclass
+class StoredUpload:
+    """An image whose bytes are in GCS and tags are known (or queued), before its doc is written."""
+    file_id: str
+    blob_name: str
+    extension: str
+    digest: str
+    doc_data: dict
+    reused_blob: bool = False
+    near_duplicates: list = field(default_factory=list)  # [(image_id, distance, color_similarity)]
+
+    @property
+    def tags(self) -> list:
+        return self.doc_data["tags"]
+
+    @property
+    def tag_status(self) -> str:
+        return self.doc_data["tag_status"]
+
+
+def _tag_image(source, extension: str):
+    """
+    Shrink, encode and tag in one blocking call (image decoding is CPU work too).
+    Tags are None if the vision model is unavailable; the image is tagged later.
+    """
+    with span("upload", "vision_encode"):
+        base64_image, extension, vision_stats = encode_for_vision(source, extension)
+    try:
+        with span("upload", "vision_call"):
+            tags = analyze_image_with_vision(base64_image, extension)
+    except VisionUnavailable:
+        return None, vision_stats
+    return tags, vision_stats
+
+
+def _write_blob(blob, source, size: int, content_type: str):
+    if size > GCS_UPLOAD_CHUNK_BYTES:
+        blob.chunk_size = GCS_UPLOAD_CHUNK_BYTES
+    with span("upload", "gcs_write", backend="gcs"):
+        blob.upload_from_file(source, size=size, content_type=content_type)
+
+
+def _blob_exists(blob) -> bool:
+    with span("upload", "gcs_exists", backend="gcs"):
+        return blob.exists()
+
+
+def _describe_image(source, user_id: str):
+    """
+    Dimensions, BlurHash and perceptual fingerprint from one reduced-scale
+    decode, and the user's near-duplicates; (None, []) if it can't be decoded.
+    """
+    with span("upload", "describe"):
+        try:
+            preview, size = open_preview(source)
+            fields = {**describe_preview(preview, size), **fingerprint_preview(preview)}
+        except Exception as e:
+            print(f"Image Describe Error: {e}")
+            return None, []
+    with span("upload", "near_duplicates"):
+        return fields, find_near_duplicates(user_id, fields)
+
+
+def _lookup_digest(digest: str):
+    with span("upload", "digest_lookup"):
+        return digest_cache.lookup(digest)
+
+
+async def store_upload(file, uploader: Uploader, bucket, async_tagging: bool) -> StoredUpload:
+    """
+    Upload to GCS and tag, reusing the owner's blob and cached tags when the
+    content (by SHA-256) has been seen before. GCS write and vision run concurrently.
+    """
+    from google.cloud import firestore
+    file_id = str(uuid.uuid4())
+    extension = file.filename.split(".")[-1]
+    blob_name = f"images/{file_id}.{extension}"
+    blob = bucket.blob(blob_name)
+
+    # Have we seen these exact bytes before?
+    with span("upload", "hash"):
+        digest = await sha256_upload(file)
+    try:
+        known = await run_blocking(_lookup_digest, digest)
+    except Exception as e:
+        print(f"Digest Lookup Error: {e}")
+        known = None
+    reused_blob = known.blob_for(uploader.owner) if known else None
+    cached_tags = known.tags if known else None
+    # Another instance may have deleted it since we cached the mapping
+    if reused_blob and not await run_blocking(_blob_exists, bucket.blob(reused_blob)):
+        reused_blob = None
+    if reused_blob:
+        blob_name = reused_blob
+
+    # GCS, vision and the image description read the spool concurrently, each at its own position
+    lock = threading.Lock()
+    size = upload_size(file)
+    described = asyncio.ensure_future(run_blocking(_describe_image, spool_reader(file, lock), uploader.user_id))
+    store = None if reused_blob else asyncio.ensure_future(
+        run_blocking(_write_blob, blob, spool_reader(file, lock), size, file.content_type)
+    )
+    analyze = None
+    vision_stats = None
+    try:
+        if cached_tags is not None:
+            # Tags come from the digest cache
+            if store:
+                await store
+            tags = cached_tags
+            tag_status = TAG_STATUS_DONE
+        elif async_tagging:
+            # Tagging is queued once the doc exists
+            if store:
+                await store
+            tags = []
+            tag_status = TAG_STATUS_PENDING
+        else:
+            # Upload to GCS and analyze with OpenAI Vision concurrently (independent of each other)
+            analyze = asyncio.ensure_future(
+                run_blocking(_tag_image, spool_reader(file, lock), extension, executor=vision_executor)
+            )
+            if store:
+                _, (tags, vision_stats) = await asyncio.gather(store, analyze)
+            else:
+                tags, vision_stats = await analyze
+            tag_status = TAG_STATUS_DONE
+            if tags is None:
+                # Degraded: store it untagged and let the tagging workers retry
+                tags = []
+                tag_status = TAG_STATUS_PENDING
+        image_fields, near_duplicates = await described
+    except BaseException:
+        # Don't leave the others running (or their errors unretrieved) once one has failed
+        pending = [task for task in (described, store, analyze) if task is not None]
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        raise
+
+    doc_data = {
+        "id": file_id,
+        "filename": file.filename,
+        "blob_name": blob_name,
+        "tags": tags,
+        "tag_status": tag_status,
+        "vision_stats": vision_stats,
+        "sha256": digest,
+        "created_at": firestore.SERVER_TIMESTAMP,
+        "uploaded_by": uploader.user_email,
+        "user_id": uploader.user_id, # None for guests
+        **(image_fields or {}),
+    }
+    return StoredUpload(
+        file_id=file_id,
+        blob_name=blob_name,
+        extension=extension,
+        digest=digest,
+        doc_data=doc_data,
+        reused_blob=bool(reused_blob),
+        near_duplicates=near_duplicates,
+    )
+
+
+def upload_size(file) -> int:
+    if file.size is not None:
+        return file.size
+    position = file.file.tell()
+    size = file.file.seek(0, io.SEEK_END)
+    file.file.seek(position)
+    return size
+
+
+def check_upload_size(file):
+    """413 for a form file over MAX_UPLOAD_BYTES."""
+    if upload_size(file) > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"{file.filename} is larger than {MAX_UPLOAD_BYTES} bytes")
+
+
+class SpoolReader(io.RawIOBase):
+    """
+    Read-only view of an upload's spool with its own position, so several
+    threads can stream the same file at once. Readers of one spool share a lock.
+    """
+
+    def __init__(self, spool, lock: threading.Lock):
+        self._spool = spool
+        self._lock = lock
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            with self._lock:
+                offset += self._spool.seek(0, io.SEEK_END)
+        self._position = max(0, offset)
+        return self._position
+
+    def readinto(self, buffer):
+        with self._lock:
+            self._spool.seek(self._position)
+            data = self._spool.read(len(buffer))
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+
+def spool_reader(file, lock: threading.Lock):
+    return io.BufferedReader(SpoolReader(file.file, lock), buffer_size=256 * 1024)
+
+
+def derive_from_upload(bucket, blob_name: str, file):
+    """Store derivatives from an upload's spool, then close it. Blocking; never raises."""
+    try:
+        file.file.seek(0)
+        generate_derivatives(bucket, blob_name, file.file)
+    finally:
+        file.file.close()
+
+
+def _body_limit(scope):
+    if scope["type"] != "http" or scope["method"] != "POST":
+        return None
+    if scope["path"] == "/upload":
+        return MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES
+    if scope["path"] == "/upload/batch":
+        return MAX_BATCH_UPLOAD_BYTES
+    return None
+
+
+class UploadSizeLimitMiddleware:
+    """ASGI middleware refusing upload bodies over their limit with 413."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        limit = _body_limit(scope)
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        detail = f"Upload is larger than {limit} bytes"
+        length = dict(scope["headers"]).get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > limit:
+            await JSONResponse({"detail": detail}, status_code=413)(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Raised inside the form parsing, so the route answers 413
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+def save_metadata(stored: StoredUpload):
+    with span("upload", "firestore_write", backend="firestore"):
+        get_firestore_collection().document(stored.file_id).set(stored.doc_data)
+
+
+def save_metadata_batch(stored_uploads: list):
+    """One WriteBatch commit for many image docs (at most 500)."""
+    collection = get_firestore_collection()
+    batch = get_firestore_client().batch()
+    for stored in stored_uploads:
+        batch.set(collection.document(stored.file_id), stored.doc_data)
+    with span("upload", "firestore_batch_write", backend="firestore"):
+        batch.commit()
+
+
+def after_metadata_saved(stored: StoredUpload, uploader: Uploader, batched: bool = False):
+    """
+    Index the tags (or queue tagging), remember the digest, count the image in
+    the usage stats and invalidate the uploader's cached listings. Blocking.
+    Batches pass batched=True and call after_batch_saved once per commit for
+    the indexing, stats and invalidation.
+    """
+    if stored.tag_status == TAG_STATUS_PENDING:
+        enqueue_tagging(stored.file_id, stored.blob_name, stored.extension, uploader.user_id, stored.digest)
+    elif uploader.user_id and not batched:
+        # Guests can't search, so they aren't indexed
+        with span("upload", "index"):
+            index_image_tags(uploader.user_id, stored.file_id, stored.tags)
+
+    try:
+        # Empty tags mean the vision call failed; remember() doesn't cache those
+        digest_cache.remember(stored.digest, tags=stored.tags, owner=uploader.owner, blob_name=stored.blob_name)
+    except Exception as e:
+        print(f"Digest Update Error: {e}")
+
+    if uploader.user_id:
+        similarity_indexes.add(uploader.user_id, stored.file_id, stored.doc_data)
+
+    if not batched:
+        record_uploads(uploader.user_id, [stored.tags])
+        listing_cache.bump(uploader.user_id)
+
+
+def after_batch_saved(stored_uploads: list, uploader: Uploader):
+    """The per-commit part of after_metadata_saved: one index write, stats update and listing bump. Blocking."""
+    tagged = {stored.file_id: stored.tags for stored in stored_uploads if stored.tag_status != TAG_STATUS_PENDING}
+    if uploader.user_id and tagged:
+        with span("upload", "index"):
+            index_uploads(uploader.user_id, tagged)
+    record_uploads(uploader.user_id, [stored.tags for stored in stored_uploads])
+    listing_cache.bump(uploader.user_id)
+
+
+def upload_result(stored: StoredUpload) -> dict:
+    # Return Proxy URL
+    proxy_url = f"/images/{stored.blob_name.split('/')[-1]}"
+    return {
+        "success": True,
+        "image_url": proxy_url,
+        "thumbnail_url": f"{proxy_url}?w={THUMBNAIL_WIDTH}",
+        "tags": stored.tags,
+        "tag_status": stored.tag_status,
+        "deduplicated": stored.reused_blob,
+        # Earlier uploads of the user that look the same (resized, recompressed, ...)
+        "near_duplicates": [
+            {"id": image_id, "distance": distance, "color_similarity": color}
+            for image_id, distance, color in stored.near_duplicates
+        ],
+        # width, height, orientation, blurhash (absent if it couldn't be decoded)
+        **{field: stored.doc_data[field] for field in IMAGE_INFO_FIELDS if field in stored.doc_data},
+        "id": stored.file_id
+    }
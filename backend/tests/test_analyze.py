@@ -0,0 +1,108 @@
+import io
+import time
+import base64
+import pytest
+from types import SimpleNamespace
+from PIL import Image
+from services import analyze
+from services.circuit_breaker import CircuitBreaker, CircuitOpenError
+from services.analyze import encode_for_vision, estimate_image_tokens, VISION_MAX_EDGE
+
+def test_estimate_image_tokens_matches_tile_formula():
+    assert estimate_image_tokens(512, 512) == 85 + 170 * 1
+    assert estimate_image_tokens(4032, 3024) == 85 + 170 * 4
+    assert estimate_image_tokens(4000, 1000) == 85 + 170 * 4
+    assert estimate_image_tokens(768, 192) == 85 + 170 * 2
+
+def test_encode_for_vision_downscales_and_strips_metadata():
+    out = io.BytesIO()
+    exif = Image.Exif()
+    exif[0x010F] = "PhoneMaker"
+    Image.new("RGB", (4000, 1000), (10, 20, 30)).save(out, format="JPEG", exif=exif)
+
+    base64_image, extension, stats = encode_for_vision(out.getvalue(), "jpg")
+    image = Image.open(io.BytesIO(base64.b64decode(base64_image)))
+
+    assert extension == "jpeg"
+    assert max(image.size) == VISION_MAX_EDGE
+    assert not image.getexif()
+    assert stats["sent_bytes"] < stats["original_bytes"]
+    assert stats["sent_tokens"] < stats["original_tokens"]
+
+def test_encode_for_vision_passes_through_undecodable_content():
+    base64_image, extension, stats = encode_for_vision(b"not an image", "png")
+    assert base64.b64decode(base64_image) == b"not an image"
+    assert extension == "png"
+    assert stats["sent_bytes"] == stats["original_bytes"]
+
+def test_circuit_breaker_opens_and_probes():
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_seconds=0.05)
+    breaker.record_failure()
+    breaker.before_call()
+    breaker.record_failure()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    time.sleep(0.06)
+    breaker.before_call()  # the probe
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()  # only one at a time
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+@pytest.fixture
+def vision(monkeypatch):
+    """Replaces the OpenAI request with calls to the handler set on the returned namespace."""
+    calls = SimpleNamespace(handler=None, count=0)
+
+    def fake_request(base64_image, extension, timeout):
+        calls.count += 1
+        return calls.handler(calls.count, timeout)
+
+    monkeypatch.setattr(analyze, "_request_tags", fake_request)
+    monkeypatch.setattr(analyze, "OPENAI_API_KEY", "test")
+    monkeypatch.setattr(analyze, "vision_breaker", CircuitBreaker("vision", 3, 60))
+    return calls
+
+def test_slow_request_is_hedged(vision, monkeypatch):
+    monkeypatch.setattr(analyze, "VISION_HEDGE_AFTER_SECONDS", 0.05)
+
+    def handler(count, timeout):
+        if count == 1:
+            time.sleep(0.5)
+            return ["slow"]
+        return ["fast"]
+    vision.handler = handler
+
+    started = time.perf_counter()
+    assert analyze.analyze_image_with_vision("", "jpeg") == ["fast"]
+    assert time.perf_counter() - started < 0.3
+
+def test_failures_retry_then_trip_the_breaker(vision, monkeypatch):
+    monkeypatch.setattr(analyze, "VISION_HEDGE_AFTER_SECONDS", 0)
+    monkeypatch.setattr(analyze, "VISION_RETRY_BACKOFF_SECONDS", 0.001)
+
+    def handler(count, timeout):
+        raise RuntimeError("upstream 503")
+    vision.handler = handler
+
+    with pytest.raises(analyze.VisionUnavailable):
+        analyze.analyze_image_with_vision("", "jpeg")
+    assert vision.count == analyze.VISION_MAX_ATTEMPTS
+    with pytest.raises(analyze.VisionUnavailable):
+        analyze.analyze_image_with_vision("", "jpeg")
+    # Breaker is open now: no more requests go out
+    count = vision.count
+    with pytest.raises(analyze.VisionUnavailable):
+        analyze.analyze_image_with_vision("", "jpeg")
+    assert vision.count == count
+
+def test_deadline_bounds_a_hanging_upstream(vision, monkeypatch):
+    monkeypatch.setattr(analyze, "VISION_DEADLINE_SECONDS", 0.2)
+    monkeypatch.setattr(analyze, "VISION_HEDGE_AFTER_SECONDS", 0.05)
+    vision.handler = lambda count, timeout: time.sleep(1)
+
+    started = time.perf_counter()
+    with pytest.raises(analyze.VisionUnavailable):
+        analyze.analyze_image_with_vision("", "jpeg")
+    assert time.perf_counter() - started < 0.5
@@ -0,0 +1,42 @@
+import io
+import asyncio
+import hashlib
+from unittest.mock import patch, MagicMock
+from starlette.datastructures import UploadFile
+from services.dedup import DigestCache, sha256_upload
+
+def test_sha256_upload_hashes_in_chunks_and_rewinds():
+    data = b"x" * (3 * 1024 * 1024 + 7)
+    upload = UploadFile(file=io.BytesIO(data), filename="a.jpg")
+    digest = asyncio.run(sha256_upload(upload))
+    assert digest == hashlib.sha256(data).hexdigest()
+    assert asyncio.run(upload.read()) == data
+
+def test_remembered_entries_are_served_locally_per_owner():
+    db = MagicMock()
+    with patch("services.dedup.get_firestore_client", return_value=db):
+        cache = DigestCache(max_entries=10, ttl=60)
+        cache.remember("d1", tags=["cat"], owner="user-1", blob_name="images/a.jpg")
+        entry = cache.lookup("d1")
+        assert entry.tags == ["cat"]
+        assert entry.blob_for("user-1") == "images/a.jpg"
+        assert entry.blob_for("user-2") is None
+
+        cache.forget_blob("d1", "user-1")
+        assert cache.lookup("d1").blob_for("user-1") is None
+        assert cache.lookup("d1").tags == ["cat"]
+    db.collection.return_value.document.return_value.get.assert_not_called()
+
+def test_local_entries_expire_and_evict():
+    db = MagicMock()
+    db.collection.return_value.document.return_value.get.return_value.exists = False
+    with patch("services.dedup.get_firestore_client", return_value=db):
+        cache = DigestCache(max_entries=1, ttl=60)
+        cache.remember("d1", tags=["cat"])
+        cache.remember("d2", tags=["dog"])
+        assert cache.lookup("d1") is None
+        assert cache.lookup("d2").tags == ["dog"]
+
+        expired = DigestCache(max_entries=10, ttl=-1)
+        expired.remember("d3", tags=["cow"])
+        assert expired.lookup("d3") is None
@@ -0,0 +1,44 @@
+import datetime
+import pytest
+from types import SimpleNamespace
+from services.delivery import parse_range, is_not_modified, iter_blob, RangeNotSatisfiable
+
+UPDATED = datetime.datetime(2025, 1, 2, 3, 4, 5, 678000, tzinfo=datetime.timezone.utc)
+
+class FakeBlob(SimpleNamespace):
+    def download_to_file(self, file_obj, start=None, end=None, checksum="md5"):
+        data = self.data[start or 0:(end + 1) if end is not None else None]
+        for i in range(0, len(data), 1000):
+            file_obj.write(data[i:i + 1000])
+
+def make_blob(size=1000):
+    return FakeBlob(size=size, etag="abc", updated=UPDATED, data=(bytes(range(256)) * (size // 256 + 1))[:size])
+
+def test_parse_range_variants():
+    blob = make_blob()
+    assert parse_range({}, blob) is None
+    assert parse_range({"range": "bytes=0-99"}, blob) == (0, 99)
+    assert parse_range({"range": "bytes=900-"}, blob) == (900, 999)
+    assert parse_range({"range": "bytes=-100"}, blob) == (900, 999)
+    assert parse_range({"range": "bytes=990-5000"}, blob) == (990, 999)
+    assert parse_range({"range": "bytes=0-1,5-6"}, blob) is None
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range({"range": "bytes=1000-"}, blob)
+
+def test_if_range_mismatch_serves_full_object():
+    blob = make_blob()
+    assert parse_range({"range": "bytes=0-9", "if-range": '"old"'}, blob) is None
+    assert parse_range({"range": "bytes=0-9", "if-range": '"abc"'}, blob) == (0, 9)
+
+def test_conditional_requests():
+    blob = make_blob()
+    assert is_not_modified({"if-none-match": '"abc"'}, blob)
+    assert is_not_modified({"if-none-match": 'W/"abc", "x"'}, blob)
+    assert not is_not_modified({"if-none-match": '"x"'}, blob)
+    assert is_not_modified({"if-modified-since": "Thu, 02 Jan 2025 03:04:05 GMT"}, blob)
+    assert not is_not_modified({"if-modified-since": "Thu, 02 Jan 2025 03:04:04 GMT"}, blob)
+
+def test_iter_blob_streams_whole_object_and_ranges():
+    blob = make_blob(size=300_000)
+    assert b"".join(iter_blob(blob)) == blob.data
+    assert b"".join(iter_blob(blob, 10, 19)) == blob.data[10:20]
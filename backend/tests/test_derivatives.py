@@ -0,0 +1,39 @@
+import io
+from PIL import Image
+from services.derivatives import nearest_width, derivative_blob_name, render_derivatives, is_derivative, DERIVATIVE_WIDTHS
+
+def make_jpeg(width, height):
+    out = io.BytesIO()
+    Image.new("RGB", (width, height), (200, 100, 50)).save(out, format="JPEG")
+    return out.getvalue()
+
+def test_nearest_width_rounds_up_and_caps():
+    assert nearest_width(1) == DERIVATIVE_WIDTHS[0]
+    assert nearest_width(DERIVATIVE_WIDTHS[0] + 1) == DERIVATIVE_WIDTHS[1]
+    assert nearest_width(10_000) == DERIVATIVE_WIDTHS[-1]
+
+def test_derivative_blob_name_sits_next_to_original():
+    assert derivative_blob_name("images/abc.jpeg", 256).startswith("images/abc.w256.")
+
+def test_derivatives_are_served_but_never_resized_again():
+    from fastapi.testclient import TestClient
+    from fakes import install_fakes
+    from main import app
+
+    client = TestClient(app)
+    with install_fakes() as fakes:
+        fakes.bucket.put("images/abc.jpg", make_jpeg(1000, 500))
+        assert client.get("/images/abc.jpg?w=256").status_code == 200
+        derivative = derivative_blob_name("images/abc.jpg", 256)
+        assert is_derivative(derivative) and not is_derivative("images/abc.jpg")
+
+        response = client.get(f"/{derivative}?w=256")
+        assert response.status_code == 200
+        assert sorted(fakes.bucket._objects) == ["images/abc.jpg", derivative]
+
+def test_render_derivatives_downscales_without_upscaling():
+    rendered = render_derivatives(make_jpeg(1000, 500))
+    sizes = {w: Image.open(io.BytesIO(data)).size for w, data in rendered.items()}
+    assert sizes[256] == (256, 128)
+    assert sizes[768] == (768, 384)
+    assert sizes[1600] == (1000, 500)
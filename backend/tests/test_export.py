@@ -0,0 +1,74 @@
+import io
+import json
+import zipfile
+import datetime
+from fastapi.testclient import TestClient
+from fakes import install_fakes
+from services.export import iter_export
+from services.delivery import STREAM_CHUNK_BYTES
+from tests.test_main import USER, make_jpeg
+
+from main import app
+
+client = TestClient(app)
+
+
+def seed(fakes, image_id, data: bytes, minute: int, filename="photo.jpg"):
+    fakes.bucket.put(f"images/{image_id}.jpg", data)
+    fakes.db.put(f"images/{image_id}", {
+        "user_id": "user-1", "filename": filename, "blob_name": f"images/{image_id}.jpg", "tags": [f"#tag{minute}"],
+        "created_at": datetime.datetime(2025, 1, 1, 12, minute, tzinfo=datetime.timezone.utc),
+    })
+
+
+def test_export_streams_images_and_manifest():
+    with install_fakes() as fakes:
+        uploaded = client.post("/upload", files={"file": ("beach.jpg", make_jpeg(), "image/jpeg")}, headers=USER).json()
+        fakes.db.put("images/gone", {
+            "user_id": "user-1", "filename": "gone.jpg", "blob_name": "images/gone.jpg",
+            "created_at": datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc),
+        })
+        fakes.db.put("images/other", {"user_id": "user-2", "filename": "x.jpg", "blob_name": "images/x.jpg"})
+
+        response = client.get("/images/export", headers=USER)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/zip"
+    archive = zipfile.ZipFile(io.BytesIO(response.content))
+    assert archive.testzip() is None
+    assert archive.namelist() == [f"images/{uploaded['id']}_beach.jpg", "tags.json"]
+    assert archive.read(f"images/{uploaded['id']}_beach.jpg") == make_jpeg()
+
+    manifest = {entry["id"]: entry for entry in json.loads(archive.read("tags.json"))}
+    assert set(manifest) == {uploaded["id"], "gone"}
+    assert manifest[uploaded["id"]]["tags"] == uploaded["tags"]
+    assert manifest["gone"]["file"] is None
+    assert client.get("/images/export").status_code in (401, 403)
+
+
+def test_export_pages_through_docs_and_streams_in_chunks():
+    large = bytes(range(256)) * (3 * STREAM_CHUNK_BYTES // 256)
+    with install_fakes() as fakes:
+        for minute in range(7):
+            seed(fakes, f"img{minute}", large if minute == 3 else make_jpeg(), minute, filename="../../etc/passwd")
+        pieces = list(iter_export("user-1", prefetch=2, page_size=3))
+
+    # Nothing close to a whole object is ever buffered
+    assert max(len(piece) for piece in pieces) <= STREAM_CHUNK_BYTES + 1024
+    archive = zipfile.ZipFile(io.BytesIO(b"".join(pieces)))
+    names = archive.namelist()
+    assert names[:-1] == [f"images/img{minute}_passwd" for minute in reversed(range(7))]
+    assert archive.read("images/img3_passwd") == large
+    assert [entry["tags"] for entry in json.loads(archive.read("tags.json"))] == [[f"#tag{m}"] for m in reversed(range(7))]
+
+
+def test_export_link_works_once_without_auth_header():
+    with install_fakes() as fakes:
+        seed(fakes, "a", make_jpeg(), 1)
+        url = client.post("/images/export/link", headers=USER).json()["url"]
+
+        response = client.get(url)
+        assert response.status_code == 200
+        assert zipfile.ZipFile(io.BytesIO(response.content)).namelist() == ["images/a_photo.jpg", "tags.json"]
+        assert client.get(url).status_code == 404
+        assert client.post("/images/export/link").status_code in (401, 403)
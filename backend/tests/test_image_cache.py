@@ -0,0 +1,62 @@
+from services.image_cache import ImageCache, CachedImage
+
+def entry(name, generation=1, size=10):
+    return CachedImage(name, generation, b"x" * size, "image/jpeg", "etag", None, None)
+
+def test_hit_miss_and_latest_generation():
+    cache = ImageCache(max_bytes=100, max_item_bytes=50)
+    assert cache.get("a") is None
+    cache.put(entry("a", 1))
+    cache.put(entry("a", 2))
+    assert cache.get("a").generation == 2
+    assert cache.get("a", 1).generation == 1
+    assert cache.stats()["hits"] == 2
+    assert cache.stats()["misses"] == 1
+
+def test_evicts_least_recently_used_by_bytes():
+    cache = ImageCache(max_bytes=30, max_item_bytes=30)
+    for name in "abc":
+        cache.put(entry(name))
+    cache.get("a")
+    cache.put(entry("d"))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] == 30
+
+def test_oversized_items_are_not_cached():
+    cache = ImageCache(max_bytes=100, max_item_bytes=5)
+    cache.put(entry("a", size=6))
+    assert cache.get("a") is None
+
+def test_invalidate_drops_all_generations():
+    cache = ImageCache(max_bytes=100, max_item_bytes=50)
+    cache.put(entry("a", 1))
+    cache.put(entry("a", 2))
+    cache.invalidate("a")
+    assert cache.get("a") is None
+    assert cache.get("a", 1) is None
+    assert cache.stats()["bytes"] == 0
+
+def test_entries_past_max_age_need_revalidation():
+    cache = ImageCache(max_bytes=100, max_item_bytes=50, max_age=0)
+    cache.put(entry("a", 3))
+    assert cache.get("a") is None
+    # Once GCS confirms generation 3 the cached bytes are used again
+    assert cache.get("a", 3).generation == 3
+    assert cache.stats()["revalidations"] == 1
+
+def test_blob_deleted_elsewhere_stops_being_served(monkeypatch):
+    from fastapi.testclient import TestClient
+    from fakes import install_fakes
+    from services.image_cache import image_cache
+    from main import app
+
+    client = TestClient(app)
+    with install_fakes() as fakes:
+        fakes.bucket.put("images/a.jpg", b"jpeg bytes")
+        assert client.get("/images/a.jpg").content == b"jpeg bytes"
+        # Another instance deletes it; this one's copy is past its max age
+        fakes.bucket.blob("images/a.jpg").delete()
+        monkeypatch.setattr(image_cache, "max_age", 0)
+        assert client.get("/images/a.jpg").status_code == 404
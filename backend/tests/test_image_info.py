@@ -0,0 +1,65 @@
+import io
+from PIL import Image
+from fastapi.testclient import TestClient
+from fakes import install_fakes
+from services.image_info import image_info, backfill_image_info, _BASE83
+from tests.test_main import USER
+
+from main import app
+
+client = TestClient(app)
+
+
+def make_jpeg(size=(640, 480), color=(200, 100, 50), orientation=None) -> bytes:
+    image = Image.new("RGB", size, color)
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    out = io.BytesIO()
+    image.save(out, format="JPEG", exif=exif.tobytes())
+    return out.getvalue()
+
+
+def decode_dc(blurhash: str) -> tuple:
+    value = 0
+    for char in blurhash[2:6]:
+        value = value * 83 + _BASE83.index(char)
+    return value >> 16, (value >> 8) & 255, value & 255
+
+
+def test_image_info_of_a_solid_image():
+    info = image_info(make_jpeg())
+
+    assert (info["width"], info["height"], info["orientation"]) == (640, 480, "landscape")
+    # 4x3 components: size, max AC, DC (4 chars), 11 ACs (2 chars each)
+    assert len(info["blurhash"]) == 28
+    assert all(abs(a - b) <= 3 for a, b in zip(decode_dc(info["blurhash"]), (200, 100, 50)))
+
+
+def test_dimensions_follow_exif_rotation():
+    info = image_info(make_jpeg(orientation=6))
+    assert (info["width"], info["height"], info["orientation"]) == (480, 640, "portrait")
+
+
+def test_upload_stores_info_and_listings_return_it():
+    with install_fakes() as fakes:
+        uploaded = client.post("/upload", files={"file": ("a.jpg", make_jpeg(), "image/jpeg")}, headers=USER).json()
+        doc = fakes.db.collection("images").document(uploaded["id"]).get().to_dict()
+        assert doc["width"] == 640 and doc["blurhash"] == uploaded["blurhash"]
+
+        item = client.get("/images", headers=USER).json()["results"][0]
+        assert {field: item[field] for field in ("width", "height", "orientation", "blurhash")} == {
+            field: doc[field] for field in ("width", "height", "orientation", "blurhash")
+        }
+
+
+def test_backfill_fills_old_images_and_skips_done_ones():
+    with install_fakes() as fakes:
+        for i in range(5):
+            fakes.bucket.put(f"images/old{i}.jpg", make_jpeg(size=(100 + i, 50)))
+            fakes.db.put(f"images/old{i}", {"user_id": "user-1", "blob_name": f"images/old{i}.jpg"})
+        fakes.db.put("images/broken", {"user_id": "user-1", "blob_name": "images/missing.jpg"})
+
+        assert backfill_image_info(batch_size=2, workers=3) == {"updated": 5, "failed": 1, "users": 1}
+        assert fakes.db.collection("images").document("old4").get().get("width") == 104
+        assert backfill_image_info(batch_size=2, workers=3)["updated"] == 0
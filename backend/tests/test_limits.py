@@ -0,0 +1,44 @@
+import pytest
+from fastapi import HTTPException
+from services import limits
+from services.limits import QuotaLeases, ExhaustedCache, check_user_limit, check_guest_limit
+
+def test_lease_is_spent_locally():
+    leases = QuotaLeases(idle_seconds=60)
+    leases.add("u1", "2025-01-02", 3)
+    assert leases.take("u1", "2025-01-02", 2)
+    assert not leases.take("u1", "2025-01-02", 2)
+    assert leases.take("u1", "2025-01-02", 1)
+    assert not leases.take("u1", "2025-01-03", 1)
+
+def test_idle_leases_are_released_and_old_days_lapse():
+    leases = QuotaLeases(idle_seconds=0)
+    leases.add("u1", "2025-01-02", 3)
+    leases.add("u2", "2025-01-01", 4)
+    assert leases.expired("2025-01-02") == [("u1", 3)]
+    assert leases.expired("2025-01-02") == []
+
+def test_exhausted_cache_expires_and_is_bounded():
+    cache = ExhaustedCache(ttl=60, max_entries=2)
+    cache.add("a", 10)
+    cache.add("b", 10)
+    cache.add("c", 10)
+    assert cache.get("a") is None
+    assert cache.get("c") == 10
+    cache.add("d", 10, ttl=-1)
+    assert cache.get("d") is None
+
+def test_leased_and_exhausted_paths_need_no_firestore(monkeypatch):
+    def no_firestore():
+        raise AssertionError("Firestore should not be called")
+    monkeypatch.setattr(limits, "get_firestore_client", no_firestore)
+    monkeypatch.setattr(limits, "_leases", QuotaLeases())
+    monkeypatch.setattr(limits, "_exhausted", ExhaustedCache())
+
+    limits._leases.add("u1", limits.get_current_date_str(), 1)
+    check_user_limit("u1")
+
+    limits._exhausted.add(("guest", "1.2.3.4"), limits.LIFETIME_LIMIT_GUEST)
+    with pytest.raises(HTTPException) as exc:
+        check_guest_limit("1.2.3.4")
+    assert exc.value.status_code == 429
@@ -0,0 +1,35 @@
+from services.listing_cache import ListingCache, InMemoryVersionStore
+
+def test_bump_changes_etag_only_for_that_user():
+    cache = ListingCache(InMemoryVersionStore())
+    before = cache.etag("u1", cache.version("u1"), "images", {"limit": 20})
+    other = cache.etag("u2", cache.version("u2"), "images", {"limit": 20})
+    cache.bump("u1")
+    assert cache.etag("u1", cache.version("u1"), "images", {"limit": 20}) != before
+    assert cache.etag("u2", cache.version("u2"), "images", {"limit": 20}) == other
+
+def test_etag_depends_on_params():
+    cache = ListingCache(InMemoryVersionStore())
+    version = cache.version("u1")
+    assert cache.etag("u1", version, "search", {"tag": "cat"}) != cache.etag("u1", version, "search", {"tag": "dog"})
+
+def test_stamps_differ_across_restarts():
+    assert InMemoryVersionStore().get("u1") != InMemoryVersionStore().get("u1")
+
+def test_entries_are_bounded_lru():
+    cache = ListingCache(InMemoryVersionStore(), max_entries=2)
+    cache.put("a", {"results": []})
+    cache.put("b", {"results": []})
+    cache.get("a")
+    cache.put("c", {"results": []})
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.stats()["entries"] == 2
+
+def test_versions_roll_over_after_max_age(monkeypatch):
+    from services import listing_cache
+    cache = ListingCache(InMemoryVersionStore(), max_age=60)
+    monkeypatch.setattr(listing_cache.time, "time", lambda: 1000.0)
+    before = cache.version("u1")
+    monkeypatch.setattr(listing_cache.time, "time", lambda: 1030.0)
+    assert cache.version("u1") != before
@@ -0,0 +1,64 @@
+import io
+import pytest
+from unittest.mock import patch
+from PIL import Image
+from fastapi.testclient import TestClient
+from fakes import install_fakes
+from services import metrics
+from routers import metrics as metrics_router
+
+from main import app
+
+client = TestClient(app)
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = metrics.Histogram("test_seconds", "Test.", ("op",), buckets=(0.1, 1))
+    histogram.observe(0.05, "a")
+    histogram.observe(0.5, "a")
+    histogram.observe(5, "a")
+
+    lines = histogram.render()
+    assert 'test_seconds_bucket{op="a",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{op="a",le="1.0"} 2' in lines
+    assert 'test_seconds_bucket{op="a",le="+Inf"} 3' in lines
+    assert 'test_seconds_count{op="a"} 3' in lines
+
+
+def test_span_counts_outbound_outcomes():
+    before_ok = metrics.outbound_calls.value("test_backend", "ok")
+    before_error = metrics.outbound_calls.value("test_backend", "error")
+
+    with metrics.span("test_op", "call", backend="test_backend"):
+        pass
+    with pytest.raises(RuntimeError):
+        with metrics.span("test_op", "call", backend="test_backend"):
+            raise RuntimeError("boom")
+
+    assert metrics.outbound_calls.value("test_backend", "ok") == before_ok + 1
+    assert metrics.outbound_calls.value("test_backend", "error") == before_error + 1
+    assert metrics.stage_seconds.count("test_op", "call") >= 2
+
+
+def test_metrics_endpoint_reports_upload_stages():
+    content = io.BytesIO()
+    Image.new("RGB", (32, 32), (1, 2, 3)).save(content, format="JPEG")
+    with install_fakes():
+        response = client.post("/upload", files={"file": ("a.jpg", content.getvalue(), "image/jpeg")},
+                               headers={"Authorization": "Bearer user-1"})
+        assert response.status_code == 200
+
+    with patch.object(metrics_router, "METRICS_TOKEN", "scrape-secret"):
+        body = client.get("/metrics", headers={"Authorization": "Bearer scrape-secret"}).text
+    assert 'smartgallery_stage_seconds_count{operation="upload",stage="gcs_write"}' in body
+    assert 'smartgallery_outbound_calls_total{backend="openai",outcome="ok"}' in body
+    assert 'smartgallery_request_seconds_count{method="POST",route="/upload",status="200"}' in body
+    assert "smartgallery_image_cache_hits" in body
+
+
+def test_metrics_are_off_without_a_token_and_need_it_when_set():
+    assert client.get("/metrics").status_code == 404
+    with patch.object(metrics_router, "METRICS_TOKEN", "scrape-secret"):
+        assert client.get("/metrics").status_code == 401
+        assert client.get("/metrics", headers={"Authorization": "Bearer user-1"}).status_code == 401
+        assert client.get("/metrics", headers={"Authorization": "Bearer scrape-secret"}).status_code == 200
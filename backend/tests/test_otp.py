@@ -0,0 +1,66 @@
+import time
+from fastapi.testclient import TestClient
+from python_http_client.exceptions import HTTPError
+from fakes import install_fakes
+from services import otp
+from services.email_dispatch import EmailDispatcher, EmailMessage
+from routers import auth
+
+from main import app
+
+client = TestClient(app)
+
+
+def message():
+    return EmailMessage(to="a@example.com", subject="Code", html="123456")
+
+
+def test_dispatcher_retries_transient_failures(monkeypatch):
+    monkeypatch.setattr("services.email_dispatch.EMAIL_BACKOFF_SECONDS", 0.01)
+    outcomes = [ConnectionError("reset"), HTTPError(429, "Too Many Requests", b"", {}), None]
+    def sender(msg):
+        outcome = outcomes.pop(0)
+        if outcome:
+            raise outcome
+    dispatcher = EmailDispatcher(workers=1, sender=sender)
+    dispatcher.start()
+    try:
+        assert dispatcher.submit(message())
+        deadline = time.monotonic() + 2
+        while dispatcher.stats()["sent"] == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        dispatcher.stop()
+    assert dispatcher.stats() == {"queued": 0, "sent": 1, "failed": 0, "retried": 2, "rejected": 0}
+
+
+def test_dispatcher_gives_up_on_rejected_messages_and_full_queue():
+    def sender(msg):
+        raise HTTPError(400, "Bad Request", b"", {})
+    dispatcher = EmailDispatcher(max_queue=1, sender=sender)
+    dispatcher.process(message())
+    assert dispatcher.stats()["failed"] == 1
+
+    assert dispatcher.submit(message())
+    assert not dispatcher.submit(message())
+    assert dispatcher.stats()["rejected"] == 1
+
+
+def test_send_otp_queues_email_and_code_verifies_once(monkeypatch):
+    dispatcher = EmailDispatcher()  # not started: the message stays queued
+    monkeypatch.setattr(otp, "SENDGRID_API_KEY", "key")
+    monkeypatch.setattr(otp, "email_dispatcher", dispatcher)
+    monkeypatch.setattr(auth, "check_user_exists", lambda email: email == "taken@example.com")
+
+    with install_fakes() as fakes:
+        response = client.post("/auth/send-otp", json={"email": "new@example.com"})
+        assert response.status_code == 200
+        assert dispatcher.stats()["queued"] == 1
+        code = fakes.db.document("otp_codes/new@example.com").get().get("otp")
+        assert code in dispatcher.queue.dequeue(timeout=0).html
+
+        assert client.post("/auth/verify-otp", json={"email": "new@example.com", "code": code}).status_code == 200
+        assert client.post("/auth/verify-otp", json={"email": "new@example.com", "code": code}).status_code == 400
+
+        assert client.post("/auth/send-otp", json={"email": "taken@example.com"}).status_code == 400
+        assert dispatcher.stats()["queued"] == 0
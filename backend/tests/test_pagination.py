@@ -0,0 +1,24 @@
+import pytest
+from services.gallery import encode_cursor, decode_cursor, _page_offset, _next_page_cursor
+
+def test_cursor_round_trips():
+    position = {"created_at": "2025-01-02T03:04:05.123456Z", "id": "abc"}
+    cursor = encode_cursor(position)
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == position
+
+@pytest.mark.parametrize("cursor", ["not-base64!", encode_cursor([1, 2])[:-1], "W10"])
+def test_foreign_cursor_is_rejected(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+def test_search_cursor_carries_the_rank_offset():
+    cursor = _next_page_cursor(20, 10, has_more=True)
+    assert _page_offset(cursor) == 30
+    assert _next_page_cursor(20, 10, has_more=False) is None
+    assert _page_offset(None) == 0
+
+@pytest.mark.parametrize("position", [{"offset": -1}, {"offset": "3"}, {"id": "abc"}])
+def test_bad_search_cursor_is_rejected(position):
+    with pytest.raises(ValueError):
+        _page_offset(encode_cursor(position))
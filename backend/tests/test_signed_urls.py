@@ -0,0 +1,94 @@
+import io
+import time
+import threading
+import pytest
+from PIL import Image
+from fastapi.testclient import TestClient
+from fakes import install_fakes
+from services import gallery
+from services.signed_urls import SignedUrlCache
+from routers import images
+
+from main import app
+
+client = TestClient(app)
+
+USER = {"Authorization": "Bearer user-1"}
+
+def make_jpeg(size=(900, 600)):
+    out = io.BytesIO()
+    Image.new("RGB", size, (40, 90, 160)).save(out, format="JPEG")
+    return out.getvalue()
+
+@pytest.fixture
+def fakes():
+    with install_fakes() as installed:
+        yield installed
+
+def upload():
+    return client.post("/upload", files={"file": ("a.jpg", make_jpeg(), "image/jpeg")}, headers=USER).json()
+
+def test_signatures_are_reused_until_the_reuse_window_ends():
+    signed = []
+    def sign(name):
+        signed.append(name)
+        return f"https://signed/{name}?n={len(signed)}"
+    cache = SignedUrlCache(reuse_seconds=0.05, sign=sign)
+
+    url, reusable_for = cache.get("images/a.jpg")
+    assert cache.get("images/a.jpg")[0] == url and 0 < reusable_for <= 0.05
+    assert cache.get("images/b.jpg", exists=lambda name: False) is None
+    time.sleep(0.06)
+    assert cache.get("images/a.jpg")[0] != url
+    assert signed == ["images/a.jpg", "images/a.jpg"]
+
+def test_a_page_of_urls_is_signed_concurrently():
+    from concurrent.futures import ThreadPoolExecutor
+    threads = set()
+    def sign(name):
+        if name == "images/bad.jpg":
+            raise RuntimeError("signBlob failed")
+        threads.add(threading.get_ident())
+        time.sleep(0.02)
+        return f"https://signed/{name}"
+    cache = SignedUrlCache(sign=sign)
+    cache.url("images/0.jpg")
+
+    names = [f"images/{i}.jpg" for i in range(8)] + ["images/bad.jpg"]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        urls = cache.urls(names, executor=executor)
+    assert sorted(urls) == sorted(names[:-1])
+    assert len(threads) > 1
+
+def test_redirect_mode_sends_clients_to_gcs(fakes, monkeypatch):
+    monkeypatch.setattr(images, "IMAGE_DELIVERY_MODE", "redirect")
+    filename = upload()["image_url"].split("/")[-1]
+
+    first = client.get(f"/images/{filename}", follow_redirects=False)
+    assert first.status_code == 302
+    assert first.headers["location"].startswith(f"https://storage.googleapis.com/fake-bucket/images/{filename}?")
+    assert first.headers["cache-control"].startswith("private, max-age=")
+    second = client.get(f"/images/{filename}", follow_redirects=False)
+    assert second.headers["location"] == first.headers["location"]
+    assert fakes.bucket.signed == 1
+
+    thumbnail = client.get(f"/images/{filename}?w=200", follow_redirects=False)
+    assert thumbnail.status_code == 302
+    assert ".w256." in thumbnail.headers["location"].split("?")[0]
+    assert client.get("/images/missing.jpg", follow_redirects=False).status_code == 404
+
+def test_signed_mode_embeds_urls_in_listings(fakes, monkeypatch):
+    monkeypatch.setattr(images, "IMAGE_DELIVERY_MODE", "signed")
+    monkeypatch.setattr(gallery, "IMAGE_DELIVERY_MODE", "signed")
+    upload()
+
+    response = client.get("/images", headers=USER)
+    item = response.json()["results"][0]
+    assert item["url"].startswith("https://storage.googleapis.com/fake-bucket/images/")
+    assert item["thumbnail_url"].startswith("/images/")
+
+    # A new signing window means a new ETag, so cached pages never hand out stale signatures
+    etag = response.headers["etag"]
+    assert client.get("/images", headers={**USER, "If-None-Match": etag}).status_code == 304
+    monkeypatch.setattr(images, "signing_epoch", lambda: 0)
+    assert client.get("/images", headers={**USER, "If-None-Match": etag}).status_code == 200
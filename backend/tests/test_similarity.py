@@ -0,0 +1,106 @@
+import io
+import time
+import random
+from PIL import Image, ImageDraw
+from fastapi.testclient import TestClient
+from fakes import install_fakes
+from services.similarity import image_fingerprint, SimilarityIndex, SimilarityIndexCache, similarity_indexes
+from tests.test_main import USER
+
+from main import app
+
+client = TestClient(app)
+
+
+def make_photo(seed: int, size=(640, 480), quality=90) -> bytes:
+    rng = random.Random(seed)
+    image = Image.new("RGB", (64, 48), tuple(rng.randrange(256) for _ in range(3)))
+    draw = ImageDraw.Draw(image)
+    for _ in range(12):
+        x, y = rng.randrange(64), rng.randrange(48)
+        draw.ellipse((x, y, x + rng.randrange(8, 30), y + rng.randrange(8, 30)), fill=tuple(rng.randrange(256) for _ in range(3)))
+    out = io.BytesIO()
+    image.resize(size, Image.BILINEAR).save(out, format="JPEG", quality=quality)
+    return out.getvalue()
+
+
+def distance(a: dict, b: dict) -> int:
+    return bin(int(a["phash"], 16) ^ int(b["phash"], 16)).count("1")
+
+
+def test_fingerprint_survives_resizing_and_recompression():
+    original = image_fingerprint(make_photo(1))
+    smaller = image_fingerprint(make_photo(1, size=(320, 240), quality=60))
+    other = image_fingerprint(make_photo(2))
+
+    assert len(original["phash"]) == 16 and len(original["color_hist"]) == 128
+    assert distance(original, smaller) <= 6
+    assert distance(original, other) > 12
+
+
+def test_index_ranks_by_distance_and_skips_removed():
+    index = SimilarityIndex()
+    prints = {f"img{i}": image_fingerprint(make_photo(i)) for i in range(5)}
+    for image_id, fingerprint in prints.items():
+        index.add(image_id, fingerprint)
+    index.add("legacy", {})  # no fingerprint: ignored
+
+    results = index.query(prints["img3"], limit=3, max_distance=64)
+    assert results[0][:2] == ("img3", 0)
+    assert index.query(prints["img3"], limit=3, max_distance=64, exclude="img3")[0][0] != "img3"
+
+    index.remove("img3")
+    assert "img3" not in [image_id for image_id, _, _ in index.query(prints["img3"], limit=5, max_distance=64)]
+    assert len(index) == 4
+
+
+def test_upload_warns_about_near_duplicates_and_lists_similar():
+    with install_fakes():
+        first = client.post("/upload", files={"file": ("a.jpg", make_photo(7), "image/jpeg")}, headers=USER).json()
+        # The index wasn't resident: nothing found, and it is loaded off the request path
+        assert first["near_duplicates"] == []
+        for _ in range(200):
+            if similarity_indexes.peek("user-1") is not None:
+                break
+            time.sleep(0.01)
+        client.post("/upload", files={"file": ("b.jpg", make_photo(8), "image/jpeg")}, headers=USER)
+        copy = client.post("/upload", files={"file": ("a-small.jpg", make_photo(7, size=(320, 240), quality=60), "image/jpeg")}, headers=USER).json()
+
+        assert [d["id"] for d in copy["near_duplicates"]] == [first["id"]]
+
+        response = client.get(f"/images/{first['id']}/similar", headers=USER)
+        assert response.status_code == 200
+        assert response.json()["results"][0]["id"] == copy["id"]
+        assert client.get("/images/unknown/similar", headers=USER).status_code == 404
+
+
+def test_index_is_reloaded_only_when_the_version_moves():
+    loads = []
+    versions = {"u1": "1"}
+
+    def loader(user_id, version):
+        loads.append(version)
+        return SimilarityIndex(version)
+
+    cache = SimilarityIndexCache(loader=loader, version_of=versions.get)
+    assert cache.peek("u1") is None
+    cache.get("u1")
+    cache.get("u1")
+    assert loads == ["1"]
+    versions["u1"] = "2"
+    assert cache.get("u1").version == "2"
+    assert loads == ["1", "2"]
+
+
+def test_changes_made_while_loading_are_applied_to_the_loaded_index():
+    prints = {"img1": image_fingerprint(make_photo(1))}
+
+    def loader(user_id, version):
+        # An upload lands after the query has read the gallery
+        cache.add(user_id, "img1", prints["img1"])
+        return SimilarityIndex(version)
+
+    cache = SimilarityIndexCache(loader=loader, version_of=lambda user_id: "1")
+    cache.warm("u1").result()
+    assert cache.peek("u1").fingerprint("img1") == prints["img1"]
+    assert cache.warm("u1") is None
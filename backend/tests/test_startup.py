@@ -0,0 +1,21 @@
+import os
+import sys
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHECK = """
+import sys
+import main
+from services import gcs, analyze
+assert not gcs._clients, gcs._clients
+assert analyze._openai_client is None
+for module in ("openai", "sendgrid", "firebase_admin", "google.cloud.storage", "google.cloud.firestore", "PIL", "numpy"):
+    assert module not in sys.modules, module
+"""
+
+def test_importing_main_builds_no_clients_and_skips_heavy_modules():
+    # Fresh interpreter: other tests may already have imported these modules
+    env = {k: v for k, v in os.environ.items() if k != "OPENAI_API_KEY"}
+    result = subprocess.run([sys.executable, "-c", CHECK], cwd=BACKEND_DIR, env=env, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,79 @@
+import datetime
+from collections import Counter
+from fastapi.testclient import TestClient
+from fakes import install_fakes
+from services.stats import rebuild_stats, record_tags, stats_recorder
+from services.tagging import tag_job, TaggingJob
+from tests.test_main import USER, GUEST, make_jpeg, upload
+
+from main import app
+
+client = TestClient(app)
+
+
+def stats():
+    stats_recorder.flush()
+    return client.get("/stats", headers=USER).json()
+
+
+def test_uploads_and_deletes_update_the_counters():
+    with install_fakes() as fakes:
+        first = upload(USER, make_jpeg(color=(10, 20, 30))).json()
+        upload(USER, make_jpeg(color=(200, 20, 30))).json()
+        upload(GUEST, make_jpeg(color=(10, 200, 30))).json()
+        # Nothing is written on the request path
+        assert not list(fakes.db.collection("images_stats_users").stream())
+
+        result = stats()
+        assert {k: result["global"][k] for k in ("images", "guest_images", "users")} == {"images": 3, "guest_images": 1, "users": 1}
+        assert result["user"]["images"] == 2
+        expected = Counter(t.lower() for t in first["tags"])
+        assert all(item["count"] >= expected[item["tag"]] for item in result["user"]["top_tags"] if item["tag"] in expected)
+        assert {item["tag"] for item in result["user"]["top_tags"]} >= set(expected)
+
+        for image in client.get("/images", headers=USER).json()["results"]:
+            assert client.delete(f"/images/{image['id']}", headers=USER).status_code == 200
+        result = stats()
+        assert {k: result["global"][k] for k in ("images", "guest_images", "users")} == {"images": 1, "guest_images": 1, "users": 0}
+        assert result["user"] == {"images": 0, "top_tags": []}
+
+
+def test_background_tags_are_added_without_counting_the_image_again():
+    with install_fakes():
+        record_tags("user-1", ["Beach", "beach ", "sunset"])
+        result = stats()
+        assert result["global"]["images"] == 0
+        assert result["user"]["top_tags"] == [{"tag": "beach", "count": 1}, {"tag": "sunset", "count": 1}]
+
+
+def test_rebuild_corrects_drift():
+    with install_fakes() as fakes:
+        start = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+        for i in range(20):
+            fakes.db.put(f"images/img{i}", {
+                "user_id": f"user-{i % 3}" if i % 5 else None,
+                "tags": ["cat"] if i % 2 else ["dog", "cat"],
+                "created_at": start + datetime.timedelta(hours=i),
+            })
+        # Counters for images that no longer exist
+        record_tags("user-9", ["ghost"])
+        stats_recorder.flush()
+
+        assert rebuild_stats(partitions=4, workers=2) == {"images": 20, "guest_images": 4, "users": 3}
+        result = stats()
+        assert result["global"]["top_tags"] == [{"tag": "cat", "count": 20}, {"tag": "dog", "count": 10}]
+        assert result["user"]["images"] == sum(1 for i in range(20) if i % 5 and i % 3 == 1)
+        assert not fakes.db.collection("images_stats_users").document("user-9").get().exists
+
+
+def test_tags_from_a_retried_tagging_job_are_counted_once():
+    with install_fakes() as fakes:
+        fakes.bucket.put("images/p.jpg", make_jpeg())
+        fakes.db.put("images/p", {"user_id": "user-1", "blob_name": "images/p.jpg", "tags": [], "tag_status": "pending"})
+        job = TaggingJob("p", "images/p.jpg", "jpg", user_id="user-1")
+        tag_job(job)
+        tag_job(job)
+
+        tags = fakes.db.collection("images").document("p").get().get("tags")
+        assert tags
+        assert all(item["count"] == 1 for item in stats()["user"]["top_tags"])
@@ -0,0 +1,14 @@
+from fakes import install_fakes
+from services.tag_index import index_uploads, index_state, load_tag_matrix, normalize_tag
+
+def test_normalize_tag():
+    assert normalize_tag("  Sunset ") == "sunset"
+
+def test_index_uploads_bumps_the_version_once_per_call():
+    with install_fakes():
+        index_uploads("user-1", {"a": ["Cat", "sofa"], "b": ["cat"], "c": ["dog"]})
+        _, version = index_state("user-1")
+        assert version == 1
+
+        matrix = load_tag_matrix("user-1", version)
+        assert sorted(image_id for image_id, _ in matrix.search("cat", 10)[0]) == ["a", "b"]
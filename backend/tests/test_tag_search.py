@@ -0,0 +1,61 @@
+from services.tag_search import TagMatrix, split_words, within_one_edit
+
+def ids(results):
+    return [image_id for image_id, _ in results]
+
+def make_matrix():
+    return TagMatrix.from_images({
+        "beach": ["sunset", "beach", "ocean"],
+        "city": ["city", "night", "skyline"],
+        "dog": ["golden retriever", "dog", "grass"],
+        "sunflower": ["sunflower", "yellow", "field"],
+    })
+
+def test_split_words_normalizes_and_dedupes():
+    assert split_words("  Golden Retriever, golden ") == ["golden", "retriever"]
+
+def test_within_one_edit():
+    assert within_one_edit("cta", "cat")
+    assert within_one_edit("retriver", "retriever")
+    assert not within_one_edit("cat", "dog")
+
+def test_exact_match_ranks_above_partial():
+    results, has_more = make_matrix().search("sun", 10)
+    assert set(ids(results)) == {"beach", "sunflower"}
+    results, _ = make_matrix().search("sunset", 10)
+    assert ids(results)[0] == "beach"
+    assert not has_more
+
+def test_typos_still_match():
+    assert ids(make_matrix().search("retreiver", 10)[0]) == ["dog"]
+    assert ids(make_matrix().search("ocaen", 10)[0]) == ["beach"]
+
+def test_images_matching_more_terms_rank_first():
+    matrix = make_matrix()
+    matrix.add("both", ["sunset", "yellow"])
+    results, _ = matrix.search("yellow sunset", 10)
+    assert ids(results)[0] == "both"
+
+def test_incremental_add_and_remove():
+    matrix = make_matrix()
+    matrix.add("cat", ["cat", "sofa"])
+    assert ids(matrix.search("cat", 10)[0]) == ["cat"]
+    matrix.remove("cat")
+    assert matrix.search("cat", 10)[0] == []
+    assert len(matrix) == 4
+
+def test_pages_are_stable_and_complete():
+    matrix = TagMatrix.from_images({f"img{i:03d}": ["dog"] for i in range(25)})
+    seen, offset = [], 0
+    while True:
+        results, has_more = matrix.search("dog", 10, offset)
+        seen += ids(results)
+        offset += 10
+        if not has_more:
+            break
+    assert sorted(seen) == sorted(f"img{i:03d}" for i in range(25))
+    # Ties rank the same regardless of insertion order
+    shuffled = TagMatrix()
+    for image_id in reversed(seen):
+        shuffled.add(image_id, ["dog"])
+    assert ids(shuffled.search("dog", 25)[0]) == seen
@@ -0,0 +1,69 @@
+import time
+import pytest
+from unittest.mock import patch
+from services.tagging import InMemoryJobQueue, SQLiteJobQueue, TaggingJob, TaggingWorkerPool
+
+@pytest.fixture(params=["memory", "sqlite"])
+def queue(request, tmp_path):
+    if request.param == "memory":
+        return InMemoryJobQueue()
+    return SQLiteJobQueue(str(tmp_path / "queue.sqlite3"))
+
+def test_queue_returns_due_jobs_and_holds_delayed_ones(queue):
+    queue.enqueue(TaggingJob("later", "images/later.jpg", "jpg"), delay=60)
+    queue.enqueue(TaggingJob("now", "images/now.jpg", "jpg", user_id="u1"))
+    job = queue.dequeue(timeout=0.1)
+    assert job.image_id == "now"
+    assert job.user_id == "u1"
+    assert queue.dequeue(timeout=0.1) is None
+    queue.complete(job)
+    assert queue.size() == 1
+
+def test_failed_jobs_retry_then_give_up(queue):
+    calls = []
+    def handler(job):
+        calls.append(job.attempts)
+        raise RuntimeError("upstream down")
+
+    pool = TaggingWorkerPool(queue, workers=1, max_attempts=3, handler=handler)
+    queue.enqueue(TaggingJob("img", "images/img.jpg", "jpg"))
+    with patch("services.tagging.backoff_delay", return_value=0), \
+         patch.object(TaggingWorkerPool, "_mark_failed") as mark_failed:
+        for _ in range(3):
+            pool.process(queue.dequeue(timeout=1))
+    assert calls == [0, 1, 2]
+    mark_failed.assert_called_once()
+    assert queue.size() == 0
+
+def test_worker_pool_drains_queue(queue):
+    done = []
+    pool = TaggingWorkerPool(queue, workers=2, handler=lambda job: done.append(job.image_id))
+    for i in range(5):
+        queue.enqueue(TaggingJob(f"img{i}", f"images/img{i}.jpg", "jpg"))
+    pool.start()
+    try:
+        deadline = time.time() + 5
+        while len(done) < 5 and time.time() < deadline:
+            time.sleep(0.05)
+    finally:
+        pool.stop()
+    assert sorted(done) == [f"img{i}" for i in range(5)]
+
+def test_stale_pending_images_are_requeued_once(monkeypatch):
+    import datetime
+    from fakes import install_fakes
+    from services import tagging
+
+    queue = tagging.InMemoryJobQueue()
+    monkeypatch.setattr(tagging, "tagging_queue", queue)
+    old = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=2)
+    with install_fakes() as fakes:
+        fakes.db.put("images/stuck", {"tag_status": "pending", "blob_name": "images/stuck.png", "user_id": "user-1", "created_at": old})
+        fakes.db.put("images/fresh", {"tag_status": "pending", "blob_name": "images/fresh.jpg", "created_at": datetime.datetime.now(datetime.timezone.utc)})
+        fakes.db.put("images/done", {"tag_status": "done", "blob_name": "images/done.jpg", "created_at": old})
+
+        assert tagging.requeue_stale_pending(stale_seconds=600) == 1
+        job = queue.dequeue(timeout=0)
+        assert (job.image_id, job.extension, job.user_id) == ("stuck", "png", "user-1")
+        # Just requeued: left alone until it goes stale again
+        assert tagging.requeue_stale_pending(stale_seconds=600) == 0
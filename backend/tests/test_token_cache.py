@@ -0,0 +1,58 @@
+import time
+import pytest
+import firebase_admin
+from firebase_admin import credentials
+from google.auth.credentials import AnonymousCredentials
+from services.token_cache import TokenCache, _cert_request
+
+def make_verify(calls):
+    def verify(token):
+        calls.append(token)
+        if token == "bad":
+            raise ValueError("invalid token")
+        exp = time.time() - 1 if token == "expired" else time.time() + 3600
+        return {"uid": token, "exp": exp}
+    return verify
+
+def test_repeated_token_is_verified_once():
+    calls = []
+    cache = TokenCache(verify=make_verify(calls))
+    assert cache.verify_id_token("a")["uid"] == "a"
+    assert cache.verify_id_token("a")["uid"] == "a"
+    assert calls == ["a"]
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+
+def test_entries_expire_at_token_exp():
+    calls = []
+    cache = TokenCache(verify=make_verify(calls))
+    cache.verify_id_token("expired")
+    cache.verify_id_token("expired")
+    assert calls == ["expired", "expired"]
+
+def test_failures_are_not_cached_and_cache_is_bounded():
+    calls = []
+    cache = TokenCache(max_entries=2, verify=make_verify(calls))
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            cache.verify_id_token("bad")
+    assert cache.stats()["failures"] == 2
+    for token in ("a", "b", "c", "a"):
+        cache.verify_id_token(token)
+    assert calls[2:] == ["a", "b", "c", "a"]
+    assert cache.stats()["entries"] == 2
+
+class _AnonymousCredential(credentials.Base):
+    def get_credential(self):
+        return AnonymousCredentials()
+
+def test_cert_refresh_internals_exist():
+    # refresh_signing_certs() leans on private firebase_admin attributes and
+    # only prints when they're gone; fail here instead after an upgrade.
+    from firebase_admin._token_gen import ID_TOKEN_CERT_URI
+    assert ID_TOKEN_CERT_URI.startswith("https://")
+    app = firebase_admin.initialize_app(_AnonymousCredential(), {"projectId": "test"}, name="cert-refresh-test")
+    try:
+        assert callable(_cert_request(app))
+    finally:
+        firebase_admin.delete_app(app)
@@ -0,0 +1,124 @@
+import gc
+import io
+import json
+import asyncio
+import threading
+from unittest.mock import patch
+from fastapi import UploadFile
+from fastapi.testclient import TestClient
+from starlette.datastructures import Headers
+from fakes import install_fakes
+from services import uploads
+from services.uploads import SpoolReader
+from tests.test_main import make_jpeg, USER, GUEST
+
+from main import app
+
+client = TestClient(app)
+
+
+def test_spool_readers_keep_their_own_positions():
+    spool = io.BytesIO(b"0123456789")
+    lock = threading.Lock()
+    first, second = SpoolReader(spool, lock), SpoolReader(spool, lock)
+
+    assert first.read(4) == b"0123"
+    assert second.read(2) == b"01"
+    assert first.read() == b"456789"
+    assert second.seek(-3, io.SEEK_END) == 7
+    assert second.read() == b"789"
+
+
+def test_upload_streams_to_gcs_and_derivatives():
+    content = make_jpeg(size=(1200, 900))
+    with install_fakes() as fakes:
+        data = client.post("/upload", files={"file": ("big.jpg", content, "image/jpeg")}, headers=USER).json()
+
+        assert fakes.bucket.get_blob(f"images/{data['id']}.jpg").download_as_bytes() == content
+        # Background task, run by TestClient before returning
+        assert fakes.bucket.get_blob(f"images/{data['id']}.w256.webp") is not None
+
+
+def test_oversized_upload_is_refused():
+    with install_fakes() as fakes, patch.object(uploads, "MAX_UPLOAD_BYTES", 1000):
+        response = client.post("/upload", files={"file": ("big.jpg", make_jpeg(size=(1200, 900)), "image/jpeg")}, headers=USER)
+
+        assert response.status_code == 413
+        assert fakes.vision.calls == 0
+        assert not list(fakes.bucket.list_blobs())
+
+
+def test_chunked_body_over_the_limit_is_refused():
+    def body():
+        yield b"x" * 2000
+
+    with install_fakes(), patch.object(uploads, "MAX_UPLOAD_BYTES", 1000), patch.object(uploads, "MULTIPART_OVERHEAD_BYTES", 0):
+        response = client.post("/upload", content=body(), headers={**USER, "Content-Type": "multipart/form-data; boundary=b"})
+
+    assert response.status_code == 413
+
+
+def test_upload_is_queued_for_tagging_when_vision_is_down():
+    with install_fakes(vision_error_rate=1.0) as fakes, patch.object(uploads, "enqueue_tagging") as enqueue:
+        data = client.post("/upload", files={"file": ("a.jpg", make_jpeg(), "image/jpeg")}, headers=USER).json()
+
+    assert data["success"] is True
+    assert data["tag_status"] == "pending" and data["tags"] == []
+    enqueue.assert_called_once()
+
+
+def batch_upload(count, headers):
+    files = [("files", (f"{i}.jpg", make_jpeg(color=(i * 40, 10, 10)), "image/jpeg")) for i in range(count)]
+    response = client.post("/upload/batch", files=files, headers=headers)
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_batch_refunds_quota_for_files_whose_commit_failed():
+    with install_fakes() as fakes, patch("routers.images.save_metadata_batch", side_effect=RuntimeError("commit failed")):
+        lines = batch_upload(3, GUEST)
+        used = fakes.db.collection("guest_usage").document(GUEST["X-Forwarded-For"]).get().get("count")
+
+    assert lines[-1] == {"done": True, "uploaded": 0, "failed": 3}
+    assert used == 0
+
+
+def test_batch_reports_committed_files_as_uploaded_when_indexing_fails():
+    with install_fakes() as fakes, patch("routers.images.after_metadata_saved", side_effect=RuntimeError("index down")):
+        lines = batch_upload(2, GUEST)
+        used = fakes.db.collection("guest_usage").document(GUEST["X-Forwarded-For"]).get().get("count")
+
+    assert all(line["success"] for line in lines[:-1])
+    assert lines[-1] == {"done": True, "uploaded": 2, "failed": 0}
+    assert used == 2
+
+
+def test_failed_upload_refunds_its_quota():
+    with install_fakes() as fakes, patch("routers.images.save_metadata", side_effect=RuntimeError("write failed")):
+        response = client.post("/upload", files={"file": ("a.jpg", make_jpeg(), "image/jpeg")}, headers=GUEST)
+        used = fakes.db.collection("guest_usage").document(GUEST["X-Forwarded-For"]).get().get("count")
+
+    assert response.status_code == 500
+    assert used == 0
+
+
+def test_failed_store_does_not_leave_tasks_behind():
+    def fail(*args, **kwargs):
+        raise RuntimeError("boom")
+
+    async def run():
+        errors = []
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: errors.append(context["message"]))
+        file = UploadFile(io.BytesIO(make_jpeg()), filename="a.jpg", headers=Headers({"content-type": "image/jpeg"}))
+        uploader = uploads.Uploader(user_id="u1", user_email="u1@example.com")
+        try:
+            await uploads.store_upload(file, uploader, fakes.bucket, async_tagging=False)
+        except RuntimeError:
+            pass
+        await asyncio.sleep(0.1)
+        gc.collect()
+        return errors
+
+    with install_fakes() as fakes, patch.object(uploads, "_write_blob", fail), patch.object(uploads, "_describe_image", fail):
+        errors = asyncio.run(run())
+
+    assert errors == []
@@ -46,13 +46,16 @@ SERVER_IMAGE="$REGION-docker.pkg.dev/$PROJECT_ID/$REPO_NAME/$BACKEND_SERVICE:lat
 gcloud builds submit backend --tag "$SERVER_IMAGE" --quiet
 
 # 4. Deploy Backend
+# CPU stays allocated between requests: OTP emails, background tagging and
+# the quota/tagging sweepers run on threads after the response is sent.
 echo "🚀 Deploying Backend to Cloud Run..."
 gcloud run deploy $BACKEND_SERVICE \
     --image "$SERVER_IMAGE" \
     --region $REGION \
     --platform managed \
     --allow-unauthenticated \
-    --set-env-vars="GCS_BUCKET_NAME=$GCS_BUCKET_NAME,OPENAI_API_KEY=$OPENAI_API_KEY,GOOGLE_CLOUD_PROJECT=$PROJECT_ID,SENDGRID_API_KEY=$SENDGRID_API_KEY,SENDGRID_FROM_EMAIL=$SENDGRID_FROM_EMAIL" \
+    --no-cpu-throttling \
+    --set-env-vars="GCS_BUCKET_NAME=$GCS_BUCKET_NAME,OPENAI_API_KEY=$OPENAI_API_KEY,GOOGLE_CLOUD_PROJECT=$PROJECT_ID,SENDGRID_API_KEY=$SENDGRID_API_KEY,SENDGRID_FROM_EMAIL=$SENDGRID_FROM_EMAIL,METRICS_TOKEN=$METRICS_TOKEN" \
     --quiet
 
 # Get Backend URL
@@ -11,6 +11,8 @@ import Login from "./pages/Login"
 function Home() {
   const [images, setImages] = useState([]);
   const [searchQuery, setSearchQuery] = useState("");
+  // Where the next page of the current listing starts (null when there is none)
+  const [page, setPage] = useState({ tag: null, nextCursor: null });
   const { currentUser } = useAuth();
 
   const handleUpload = async (file) => {
@@ -18,6 +20,9 @@ function Home() {
       const result = await api.uploadImage(file, currentUser);
       console.log("Uploaded:", result);
       setImages(prev => [result, ...prev]);
+      if (result.near_duplicates?.length) {
+        alert(`This looks like ${result.near_duplicates.length} image(s) already in your gallery.`);
+      }
 
       // Guest: Persist to Local Storage
       if (!currentUser) {
@@ -30,22 +35,24 @@ function Home() {
     }
   };
 
-  const loadImages = async (tag) => {
+  const loadImages = async (tag, cursor = null) => {
     if (!currentUser) {
       // Guest: Load from Local Storage
       const stored = JSON.parse(localStorage.getItem('guest_images') || '[]');
       setImages(stored);
+      setPage({ tag: null, nextCursor: null });
       return;
     }
 
     try {
-      let results;
+      let data;
       if (!tag) {
-        results = await api.getRecentImages(currentUser);
+        data = await api.getRecentImages(currentUser, cursor);
       } else {
-        results = await api.searchImages(tag, currentUser);
+        data = await api.searchImages(tag, currentUser, cursor);
       }
-      setImages(results);
+      setImages(prev => cursor ? [...prev, ...data.results] : data.results);
+      setPage({ tag, nextCursor: data.nextCursor });
     } catch (e) {
       console.error(e);
       // alert("Failed to load images"); 
@@ -96,6 +103,12 @@ function Home() {
       )}
 
       <Gallery images={images} />
+
+      {page.nextCursor && (
+        <div style={{ textAlign: 'center', margin: '2rem 0' }}>
+          <button onClick={() => loadImages(page.tag, page.nextCursor)}>Load more</button>
+        </div>
+      )}
     </div>
   )
 }
@@ -1,4 +1,5 @@
 import React from 'react'
+import { blurhashToDataURL } from './blurhash'
 
 export function Gallery({ images }) {
     if (!images) return null;
@@ -6,20 +7,27 @@ export function Gallery({ images }) {
     return (
         <div style={{ marginTop: '0' }}>
             <div className="gallery-grid">
-                {images.map((img) => (
-                    <div key={img.id} className="image-card glass-panel">
-                        <img
-                            src={img.url}
-                            alt={img.filename}
-                            loading="lazy"
-                        />
-                        <div className="tags">
-                            {img.tags && img.tags.map((tag, idx) => (
-                                <span key={idx} className="tag">#{tag}</span>
-                            ))}
+                {images.map((img) => {
+                    // Blurred preview painted behind the image until it loads
+                    const placeholder = blurhashToDataURL(img.blurhash);
+                    return (
+                        <div key={img.id} className="image-card glass-panel">
+                            <img
+                                src={img.thumbnail_url || img.url}
+                                alt={img.filename}
+                                loading="lazy"
+                                width={img.width}
+                                height={img.height}
+                                style={placeholder ? { backgroundImage: `url(${placeholder})`, backgroundSize: 'cover' } : undefined}
+                            />
+                            <div className="tags">
+                                {img.tags && img.tags.map((tag, idx) => (
+                                    <span key={idx} className="tag">#{tag}</span>
+                                ))}
+                            </div>
                         </div>
-                    </div>
-                ))}
+                    );
+                })}
             </div>
 
             {images.length === 0 && (
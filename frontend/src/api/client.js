@@ -47,31 +47,57 @@ export const api = {
     },
 
     /**
-     * Search for images by tag
+     * Search for images by tag, one page at a time
+     * Returns { results, nextCursor }; pass nextCursor back for the next page
      */
-    searchImages: async (tag, currentUser) => {
+    searchImages: async (tag, currentUser, cursor = null) => {
         const headers = await getAuthHeaders(currentUser);
-        const response = await fetch(`${API_URL}/search?tag=${encodeURIComponent(tag)}`, {
+        let url = `${API_URL}/search?tag=${encodeURIComponent(tag)}`;
+        if (cursor) url += `&cursor=${encodeURIComponent(cursor)}`;
+        const response = await fetch(url, {
             headers: headers
         });
         if (!response.ok) throw new Error("Search failed");
 
         const data = await response.json();
-        return (data.results || []).map(normalizeUrl);
+        return { results: (data.results || []).map(normalizeUrl), nextCursor: data.next_cursor || null };
     },
 
     /**
-     * Get recent images
+     * Get recent images, one page at a time
+     * Returns { results, nextCursor }; pass nextCursor back for the next page
      */
-    getRecentImages: async (currentUser) => {
+    getRecentImages: async (currentUser, cursor = null) => {
         const headers = await getAuthHeaders(currentUser);
-        const response = await fetch(`${API_URL}/images`, {
+        let url = `${API_URL}/images`;
+        if (cursor) url += `?cursor=${encodeURIComponent(cursor)}`;
+        const response = await fetch(url, {
             headers: headers
         });
         if (!response.ok) throw new Error("Failed to load images");
 
         const data = await response.json();
-        return (data.results || []).map(normalizeUrl);
+        return { results: (data.results || []).map(normalizeUrl), nextCursor: data.next_cursor || null };
+    },
+
+    /**
+     * Download all of the user's images as a ZIP (with a tags.json manifest)
+     */
+    exportImages: async (currentUser) => {
+        const headers = await getAuthHeaders(currentUser);
+        const response = await fetch(`${API_URL}/images/export/link`, {
+            method: 'POST',
+            headers: headers
+        });
+        if (!response.ok) throw new Error("Export failed");
+
+        // A one-time link needs no Authorization header, so the browser can
+        // stream the archive straight to disk instead of holding it in memory
+        const { url } = await response.json();
+        const link = document.createElement('a');
+        link.href = `${API_URL}${url}`;
+        link.download = 'smart-gallery-export.zip';
+        link.click();
     },
 
     /**
@@ -115,6 +141,9 @@ function normalizeUrl(img) {
             img.url = `${API_URL}/${img.url}`;
         }
     }
+    if (img.thumbnail_url && img.thumbnail_url.startsWith('/')) {
+        img.thumbnail_url = `${API_URL}${img.thumbnail_url}`;
+    }
     // Ensure both fields exist for compatibility
     if (!img.url && img.image_url) img.url = img.image_url;
     if (!img.image_url && img.url) img.image_url = img.url;
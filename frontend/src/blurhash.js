@@ -0,0 +1,85 @@
+// Minimal BlurHash decoder (https://blurha.sh): turns the placeholder the
+// backend stores with each image into a small data URL to show while the
+// image itself loads.
+
+const BASE83 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~';
+const SIZE = 32;
+const cache = new Map();
+
+function decode83(str) {
+  let value = 0;
+  for (const char of str) value = value * 83 + BASE83.indexOf(char);
+  return value;
+}
+
+function srgbToLinear(value) {
+  const v = value / 255;
+  return v <= 0.04045 ? v / 12.92 : Math.pow((v + 0.055) / 1.055, 2.4);
+}
+
+function linearToSrgb(value) {
+  const v = Math.max(0, Math.min(1, value));
+  return v <= 0.0031308 ? Math.round(v * 12.92 * 255) : Math.round((1.055 * Math.pow(v, 1 / 2.4) - 0.055) * 255);
+}
+
+function signPow(value, exp) {
+  return Math.sign(value) * Math.pow(Math.abs(value), exp);
+}
+
+function decodeColors(hash) {
+  const sizeFlag = decode83(hash[0]);
+  const numX = (sizeFlag % 9) + 1;
+  const numY = Math.floor(sizeFlag / 9) + 1;
+  const maxValue = (decode83(hash[1]) + 1) / 166;
+  const dc = decode83(hash.substring(2, 6));
+  const colors = [[srgbToLinear(dc >> 16), srgbToLinear((dc >> 8) & 255), srgbToLinear(dc & 255)]];
+  for (let i = 1; i < numX * numY; i++) {
+    const ac = decode83(hash.substring(4 + i * 2, 6 + i * 2));
+    colors.push([
+      signPow((Math.floor(ac / 361) - 9) / 9, 2) * maxValue,
+      signPow(((Math.floor(ac / 19) % 19) - 9) / 9, 2) * maxValue,
+      signPow(((ac % 19) - 9) / 9, 2) * maxValue,
+    ]);
+  }
+  return { numX, numY, colors };
+}
+
+// Data URL of the decoded placeholder, or null for a missing or malformed hash
+export function blurhashToDataURL(hash) {
+  if (!hash || hash.length < 6) return null;
+  if (cache.has(hash)) return cache.get(hash);
+
+  let url = null;
+  try {
+    const { numX, numY, colors } = decodeColors(hash);
+    const canvas = document.createElement('canvas');
+    canvas.width = canvas.height = SIZE;
+    const ctx = canvas.getContext('2d');
+    const pixels = ctx.createImageData(SIZE, SIZE);
+    for (let y = 0; y < SIZE; y++) {
+      for (let x = 0; x < SIZE; x++) {
+        let r = 0, g = 0, b = 0;
+        for (let j = 0; j < numY; j++) {
+          for (let i = 0; i < numX; i++) {
+            const basis = Math.cos((Math.PI * x * i) / SIZE) * Math.cos((Math.PI * y * j) / SIZE);
+            const color = colors[i + j * numX];
+            r += color[0] * basis;
+            g += color[1] * basis;
+            b += color[2] * basis;
+          }
+        }
+        const offset = 4 * (x + y * SIZE);
+        pixels.data[offset] = linearToSrgb(r);
+        pixels.data[offset + 1] = linearToSrgb(g);
+        pixels.data[offset + 2] = linearToSrgb(b);
+        pixels.data[offset + 3] = 255;
+      }
+    }
+    ctx.putImageData(pixels, 0, 0);
+    url = canvas.toDataURL();
+  } catch (e) {
+    console.error(e);
+  }
+  cache.set(hash, url);
+  return url;
+}
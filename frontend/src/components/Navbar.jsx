@@ -1,6 +1,7 @@
 import React from 'react';
 import { useNavigate, useLocation } from 'react-router-dom';
 import { useAuth } from '../contexts/AuthContext';
+import { api } from '../api/client';
 
 export function Navbar() {
     const { currentUser, logout } = useAuth();
@@ -16,6 +17,15 @@ export function Navbar() {
         }
     }
 
+    async function handleExport() {
+        try {
+            await api.exportImages(currentUser);
+        } catch (e) {
+            console.error(e);
+            alert(e.message || "Export failed");
+        }
+    }
+
     // Helper to determine if a link is active
     const isActive = (path) => location.pathname === path;
 
@@ -33,6 +43,12 @@ export function Navbar() {
                 {currentUser ? (
                     <div style={{ display: 'flex', gap: '1rem', alignItems: 'center' }}>
                         <span style={{ fontSize: '0.9rem', opacity: 0.8 }}>{currentUser.email}</span>
+                        <button
+                            onClick={handleExport}
+                            style={{ fontSize: '0.8rem', padding: '0.4rem 0.8rem', background: 'transparent', border: '1px solid var(--text-secondary)' }}
+                        >
+                            Download All
+                        </button>
                         <button
                             onClick={handleLogout}
                             style={{ fontSize: '0.8rem', padding: '0.4rem 0.8rem', background: 'transparent', border: '1px solid var(--text-secondary)' }}
@@ -43,6 +43,15 @@ gcloud iam service-accounts keys create key.json \
     --iam-account="${SA_NAME}@${PROJECT_ID}.iam.gserviceaccount.com" \
     --quiet
 
+# 5. Expire unredeemed export links (services/export.py)
+EXPORT_LINK_COLLECTION="${FIRESTORE_COLLECTION:-images}_export_links"
+echo "⏳ Enabling TTL on ${EXPORT_LINK_COLLECTION}.expires_at ..."
+gcloud firestore fields ttls update expires_at \
+    --collection-group="$EXPORT_LINK_COLLECTION" \
+    --enable-ttl \
+    --async \
+    --quiet
+
 echo ""
 echo "✅ SETUP COMPLETE!"
 echo ""